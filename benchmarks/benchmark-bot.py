@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Offline benchmarks for btcebot, run against a local FakeExchange.  For each
+combination of pair and trader counts, this drives a Bot for a number of
+update loops and reports loop duration, fetch-to-handler latency and
+handler CPU time; it also measures MarketDatabase insert throughput.
+Results can be saved as JSON and compared against a saved baseline to
+catch performance regressions.
+'''
+
+import datetime
+import decimal
+import imp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_HERE, ".."))
+
+import btceapi
+import btcebot
+from fakeexchange import FakeExchange
+
+def _loadSample(name):
+    return imp.load_source(name.replace("-", "_"),
+                           os.path.join(_HERE, "..", "samples", name + ".py"))
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class LatencyProbe(btcebot.TraderBase):
+    '''
+    Records how long after retrieval each update reaches a handler.
+    '''
+    def __init__(self, pairs):
+        btcebot.TraderBase.__init__(self, pairs)
+        self.latencies = []
+
+    def onNewDepth(self, t, pair, asks, bids):
+        self.latencies.append((datetime.datetime.now() - t).total_seconds())
+
+    def onNewTradeHistory(self, t, pair, trades):
+        self.latencies.append((datetime.datetime.now() - t).total_seconds())
+
+def _timeHandlers(bot, cpu):
+    # Wrap every registered handler to accumulate its CPU time.
+    def wrap(handler):
+        def timed(*args):
+            start = time.clock()
+            try:
+                return handler(*args)
+            finally:
+                cpu[0] += time.clock() - start
+        return timed
+
+    for handlers in (bot.depthHandlers, bot.depthChangeHandlers,
+                     bot.tradeHistoryHandlers, bot.newTradesHandlers):
+        handlers[:] = [(wrap(h), pairs) for h, pairs in handlers]
+    bot.loopEndHandlers[:] = [wrap(h) for h in bot.loopEndHandlers]
+
+def benchmarkBot(exchange, options, pairCount, traderCount, workDir):
+    hello = _loadSample("hello-world-bot")
+    logger = _loadSample("logger-bot")
+
+    pairs = exchange.pair_names[:pairCount]
+    api = btcebot.ReplayAPI(exchange.pair_names)
+    pool = btcebot.ConnectionPool(connectionFactory=exchange.connect)
+    bot = btcebot.Bot(api, fixedPoint=options.fixed_point, connectionPool=pool)
+    bot.setFetchConcurrency(options.concurrency)
+    if options.lanes:
+        bot.setTraderLanes()
+    # Everything is due on every update.
+    bot.setCollectionInterval(0)
+
+    # Failed requests are counted in the bot's metrics, but handler errors
+    # are only reported to error handlers.
+    errors = []
+    bot.addErrorHandler(lambda msg, tb: errors.append(msg))
+
+    # Range traders whose thresholds are never reached, so that they only
+    # cost what it takes to look at each update.
+    for i in range(traderCount):
+        pair = pairs[i % len(pairs)]
+        bot.addTrader(hello.RangeTrader(None, pair, decimal.Decimal(0),
+                                        decimal.Decimal(10**9), False, pool))
+    if options.with_logger:
+        bot.addTrader(logger.MarketDataLogger(api, pairs, os.path.join(workDir, "bot.db")))
+    probe = LatencyProbe(pairs)
+    bot.addTrader(probe)
+
+    cpu = [0.0]
+    _timeHandlers(bot, cpu)
+
+    # The first loop opens connections, so leave it out of the results.
+    bot.update()
+    del probe.latencies[:]
+    cpu[0] = 0.0
+
+    loopTimes = []
+    for i in range(options.loops):
+        start = time.time()
+        bot.update()
+        loopTimes.append(time.time() - start)
+    bot.exitTraders()
+    pool.close()
+
+    return {"loop_p50": percentile(loopTimes, 0.5),
+            "loop_p95": percentile(loopTimes, 0.95),
+            "latency_p50": percentile(probe.latencies, 0.5),
+            "latency_p95": percentile(probe.latencies, 0.95),
+            "latency_p99": percentile(probe.latencies, 0.99),
+            "handler_cpu_per_loop": cpu[0] / options.loops,
+            "errors": len(errors) + sum(v for (name, labels), v in bot.metrics.snapshot().items()
+                                        if name == "fetch_errors_total")}
+
+def benchmarkDatabase(exchange, options, writeBehind, workDir):
+    path = os.path.join(workDir, "insert-%s.db" % ("wb" if writeBehind else "sync"))
+    conn = exchange.connect()
+    pair = exchange.pair_names[0]
+    asks, bids = btceapi.getDepth(pair, conn)
+    trades = btceapi.getTradeHistory(pair, conn)
+    conn.close()
+
+    db = btcebot.MarketDatabase(path, exchange.pair_names, writeBehind=writeBehind,
+                                depthKeyframeInterval=options.keyframe_interval)
+    pair_index = db.pair_to_index[pair]
+    rows = options.db_rows
+    t0 = datetime.datetime.now()
+
+    start = time.time()
+    for i in range(rows):
+        db.insertDepth(t0 + datetime.timedelta(seconds=i), pair, asks, bids)
+    db.flush()
+    depthTime = time.time() - start
+
+    # Give every trade a new id so that none are ignored as duplicates.
+    tuples = [db.tupleFromTrade(t) for t in trades]
+    start = time.time()
+    tid = 0
+    for i in range(rows):
+        batch = []
+        for t in tuples:
+            tid += 1
+            batch.append((tid,) + t[1:])
+        db.insertTradeHistory(batch)
+    db.close()
+    tradeTime = time.time() - start
+
+    return {"depth_per_sec": rows / depthTime,
+            "trades_per_sec": rows * len(tuples) / tradeTime}
+
+# Metrics where a bigger number is better; for all others, smaller is better.
+_HIGHER_IS_BETTER = ("depth_per_sec", "trades_per_sec")
+
+def compare(results, baseline, tolerance):
+    '''Print metrics that are worse than the baseline by more than the
+    given fraction, and return how many there were.'''
+    regressions = 0
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            old = baseline.get(name, {}).get(metric)
+            if not old or metric == "errors":
+                continue
+            if metric in _HIGHER_IS_BETTER:
+                change = (old - value) / old
+            else:
+                change = (value - old) / old
+            if change > tolerance:
+                regressions += 1
+                print "REGRESSION %s %s: %.6g -> %.6g (%+.0f%%)" % (
+                    name, metric, old, value, change * 100)
+    return regressions
+
+def run(options):
+    pairCounts = [int(n) for n in options.pairs.split(",")]
+    traderCounts = [int(n) for n in options.traders.split(",")]
+    exchange = FakeExchange(max(pairCounts), options.depth, options.trade_rate,
+                            options.latency, options.error_rate)
+    exchange.start()
+    workDir = tempfile.mkdtemp(prefix="btcebot-bench-")
+    results = {}
+    try:
+        for pairCount in pairCounts:
+            for traderCount in traderCounts:
+                name = "bot pairs=%d traders=%d" % (pairCount, traderCount)
+                results[name] = benchmarkBot(exchange, options, pairCount,
+                                             traderCount, workDir)
+                r = results[name]
+                print ("%-28s loop p50 %7.1f ms  p95 %7.1f ms | latency p50 %6.1f ms"
+                       "  p95 %6.1f ms  p99 %6.1f ms | handler cpu %6.2f ms/loop | errors %d") % (
+                    name, r["loop_p50"] * 1000, r["loop_p95"] * 1000,
+                    r["latency_p50"] * 1000, r["latency_p95"] * 1000,
+                    r["latency_p99"] * 1000, r["handler_cpu_per_loop"] * 1000,
+                    r["errors"])
+
+        for writeBehind in (False, True):
+            name = "db writeBehind=%s" % writeBehind
+            results[name] = benchmarkDatabase(exchange, options, writeBehind, workDir)
+            print "%-28s %9.0f depth snapshots/s  %9.0f trades/s" % (
+                name, results[name]["depth_per_sec"], results[name]["trades_per_sec"])
+    finally:
+        exchange.stop()
+        shutil.rmtree(workDir)
+
+    if options.save:
+        json.dump(results, open(options.save, "w"), indent=2, sort_keys=True)
+
+    if options.compare:
+        baseline = json.load(open(options.compare))
+        if compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark btcebot against a local fake exchange.')
+    parser.add_argument('--pairs', default='1,5,20',
+                        help='Comma-separated numbers of pairs to poll.')
+    parser.add_argument('--traders', default='1,10',
+                        help='Comma-separated numbers of traders to run.')
+    parser.add_argument('--loops', type=int, default=20,
+                        help='Update loops to time for each combination.')
+    parser.add_argument('--depth', type=int, default=150,
+                        help='Price levels on each side of each book.')
+    parser.add_argument('--trade-rate', type=float, default=5.0,
+                        help='Trades per second on each pair.')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Seconds of latency to add to each response.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests that fail.')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Bot fetch concurrency.')
+    parser.add_argument('--fixed-point', default=False, action="store_true",
+                        help='Run the bot in fixed-point mode.')
+    parser.add_argument('--lanes', default=False, action="store_true",
+                        help='Run each trader on its own thread.')
+    parser.add_argument('--with-logger', default=False, action="store_true",
+                        help='Also run the logger-bot.py MarketDataLogger.')
+    parser.add_argument('--db-rows', type=int, default=2000,
+                        help='Depth snapshots and trade batches to insert.')
+    parser.add_argument('--keyframe-interval', type=int, default=1,
+                        help='Depth keyframe interval for the insert benchmark.')
+    parser.add_argument('--save', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Compare results to this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Fractional slowdown reported as a regression.')
+
+    run(parser.parse_args())
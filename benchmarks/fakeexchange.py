@@ -0,0 +1,289 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+A local stand-in for the exchange's public API, for benchmarking btcebot
+without network access.  It serves the v3 info, depth and trades calls
+with synthetic, continuously changing market data, and can add latency and
+errors to its responses.  It can also serve a streaming feed of the same
+data in the format read by btcebot.StreamingSource.
+'''
+
+import BaseHTTPServer
+import decimal
+import httplib
+import json
+import random
+import socket
+import SocketServer
+import threading
+import time
+
+_CURRENCIES = ("btc", "ltc", "nmc", "nvc", "ppc", "dsh", "eth", "bch", "zec",
+               "xmr", "trc", "ftc", "xpm", "usd", "eur", "rur", "gbp", "cnh")
+_QUOTES = ("usd", "btc", "eur", "rur")
+
+def makePairNames(count):
+    '''Return count distinct, realistic-looking pair names.'''
+    names = []
+    for quote in _QUOTES:
+        for base in _CURRENCIES:
+            if base != quote:
+                names.append("%s_%s" % (base, quote))
+    if count > len(names):
+        raise Exception("At most %d pairs are available" % len(names))
+    return names[:count]
+
+class _Market(object):
+    '''Synthetic order book and trade stream for one pair.'''
+    def __init__(self, rng, depthLevels, tradesPerSecond, now):
+        self.rng = rng
+        self.depthLevels = depthLevels
+        self.tradesPerSecond = tradesPerSecond
+        self.mid = rng.uniform(10, 1000)
+        self.step = self.mid * 0.0005
+        self.asks = [[round(self.mid + self.step * (i + 1), 6), self._amount()]
+                     for i in range(depthLevels)]
+        self.bids = [[round(self.mid - self.step * (i + 1), 6), self._amount()]
+                     for i in range(depthLevels)]
+        self.trades = []
+        self.updated = now
+        self.pendingTrades = 0.0
+
+    def _amount(self):
+        return round(self.rng.uniform(0.01, 50), 8)
+
+    def advance(self, now, nextTid):
+        '''Change a few levels of the book and generate the trades that
+        would have happened since the last update.  Returns the next unused
+        trade id.'''
+        rng = self.rng
+        for side in (self.asks, self.bids):
+            for i in rng.sample(xrange(len(side)), min(3, len(side))):
+                side[i][1] = self._amount()
+
+        self.pendingTrades += (now - self.updated) * self.tradesPerSecond
+        self.updated = now
+        while self.pendingTrades >= 1.0:
+            self.pendingTrades -= 1.0
+            isAsk = rng.random() < 0.5
+            price = (self.asks if isAsk else self.bids)[0][0]
+            self.trades.append({"type": "ask" if isAsk else "bid",
+                                "price": price,
+                                "amount": self._amount(),
+                                "tid": nextTid,
+                                "timestamp": int(now)})
+            nextTid += 1
+        del self.trades[:-150]
+        return nextTid
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        exchange = self.server.exchange
+        # Consume the request body so the connection can be reused.
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if exchange.latency:
+            time.sleep(exchange.latency)
+
+        status, payload = exchange.respond(self.path.split("?")[0])
+        data = json.dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_POST = do_GET
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _StreamHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        exchange = self.server.exchange
+        request = json.loads(self.rfile.readline())["subscribe"]
+        depthPairs = [p for p in request.get("depth", ()) if p in exchange.markets]
+        tradePairs = [p for p in request.get("trades", ()) if p in exchange.markets]
+        # What this client has been sent so far.
+        books = {}
+        lastTids = {}
+        while not exchange.streamStopped.is_set():
+            messages = exchange.streamMessages(depthPairs, tradePairs, books, lastTids)
+            if messages:
+                try:
+                    self.wfile.write("".join(json.dumps(m) + "\n" for m in messages))
+                    self.wfile.flush()
+                except socket.error:
+                    return
+            exchange.streamStopped.wait(exchange.streamInterval)
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            # The client has gone away.
+            pass
+
+class _StreamServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeExchangeConnection(object):
+    '''
+    Drop-in replacement for btceapi.BTCEConnection that talks plain HTTP
+    to a FakeExchange.
+    '''
+    def __init__(self, host, port, timeout=30):
+        self.conn = httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def close(self):
+        self.conn.close()
+
+    def makeRequest(self, url, extra_headers=None, params="", with_cookie=False):
+        try:
+            self.conn.request("POST", url, params, extra_headers or {})
+            response = self.conn.getresponse()
+            body = response.read()
+        except Exception:
+            # Don't leave the connection in an unknown state.
+            self.conn.close()
+            raise
+        if response.status != 200:
+            raise Exception("HTTP %d from %s: %s" % (response.status, url, body))
+        return body
+
+    def makeJSONRequest(self, url, extra_headers=None, params=""):
+        response = self.makeRequest(url, extra_headers, params)
+        return json.loads(response, parse_float=decimal.Decimal)
+
+class FakeExchange(object):
+    '''
+    Local HTTP server imitating the exchange's public API.  latency is
+    added to every response (in seconds), and errorRate is the fraction of
+    requests that fail with an HTTP 500 error.
+    '''
+    def __init__(self, pairCount=4, depthLevels=150, tradesPerSecond=1.0,
+                 latency=0.0, errorRate=0.0, seed=0, port=0):
+        self.rng = random.Random(seed)
+        self.pair_names = makePairNames(pairCount)
+        self.latency = latency
+        self.errorRate = errorRate
+        self.lock = threading.Lock()
+        self.nextTid = 1
+        self.requestCount = 0
+        now = time.time()
+        self.markets = dict((p, _Market(self.rng, depthLevels, tradesPerSecond, now))
+                            for p in self.pair_names)
+
+        self.server = _Server(("127.0.0.1", port), _Handler)
+        self.server.exchange = self
+        self.host, self.port = self.server.server_address
+        self.thread = None
+
+        self.streamServer = None
+        self.streamThread = None
+        self.streamPort = None
+        self.streamInterval = 0.05
+        self.streamStopped = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        if self.streamServer is not None:
+            self.streamStopped.set()
+            self.streamServer.shutdown()
+            self.streamServer.server_close()
+            self.streamThread.join()
+            self.streamServer = None
+
+    def startStream(self, port=0, interval=0.05):
+        '''Also serve a streaming feed, advancing the markets and sending
+        what changed to each client every interval seconds.  Returns the
+        port the feed is served on.'''
+        self.streamInterval = interval
+        self.streamStopped.clear()
+        self.streamServer = _StreamServer(("127.0.0.1", port), _StreamHandler)
+        self.streamServer.exchange = self
+        self.streamPort = self.streamServer.server_address[1]
+        self.streamThread = threading.Thread(target=self.streamServer.serve_forever)
+        self.streamThread.daemon = True
+        self.streamThread.start()
+        return self.streamPort
+
+    def streamMessages(self, depthPairs, tradePairs, books, lastTids):
+        '''Return the stream messages bringing a client up to date, given
+        the books (pair -> (asks, bids) dictionaries) and last trade ids
+        (pair -> tid) it has been sent, which are updated.'''
+        messages = []
+        with self.lock:
+            now = time.time()
+            for pair in set(depthPairs) | set(tradePairs):
+                self.nextTid = self.markets[pair].advance(now, self.nextTid)
+
+            for pair in depthPairs:
+                market = self.markets[pair]
+                asks, bids = dict(map(tuple, market.asks)), dict(map(tuple, market.bids))
+                previous = books.get(pair)
+                books[pair] = (asks, bids)
+                if previous is None:
+                    messages.append({"channel": "depth", "pair": pair, "snapshot": True,
+                                     "asks": market.asks, "bids": market.bids})
+                    continue
+                changes = []
+                for levels, old in zip((asks, bids), previous):
+                    changed = [[p, a] for p, a in levels.items() if old.get(p) != a]
+                    changed += [[p, 0] for p in old if p not in levels]
+                    changes.append(changed)
+                if changes[0] or changes[1]:
+                    messages.append({"channel": "depth", "pair": pair,
+                                     "asks": changes[0], "bids": changes[1]})
+
+            for pair in tradePairs:
+                lastTid = lastTids.get(pair, 0)
+                trades = [t for t in self.markets[pair].trades if t["tid"] > lastTid]
+                if trades:
+                    lastTids[pair] = trades[-1]["tid"]
+                    messages.append({"channel": "trades", "pair": pair, "trades": trades})
+        return messages
+
+    def connect(self, timeout=30):
+        '''Open a connection to this exchange; suitable for use as a
+        ConnectionPool connectionFactory.'''
+        return FakeExchangeConnection(self.host, self.port, timeout)
+
+    def respond(self, path):
+        with self.lock:
+            self.requestCount += 1
+            if self.errorRate and self.rng.random() < self.errorRate:
+                return 500, {"success": 0, "error": "injected error"}
+
+            parts = path.strip("/").split("/")
+            if parts == ["api", "3", "info"]:
+                pairs = dict((p, {"decimal_places": 6, "min_price": 0.000001,
+                                  "max_price": 1000000, "min_amount": 0.0001,
+                                  "hidden": 0, "fee": 0.2})
+                             for p in self.pair_names)
+                return 200, {"server_time": int(time.time()), "pairs": pairs}
+
+            if len(parts) == 4 and parts[:2] == ["api", "3"]:
+                method, pair = parts[2:]
+                market = self.markets.get(pair)
+                if market is not None:
+                    self.nextTid = market.advance(time.time(), self.nextTid)
+                    if method == "depth":
+                        return 200, {pair: {"asks": market.asks, "bids": market.bids}}
+                    if method == "trades":
+                        return 200, {pair: market.trades[::-1]}
+
+            return 404, {"success": 0, "error": "Invalid method"}
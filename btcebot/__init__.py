@@ -1,5 +1,20 @@
 # Copyright (c) 2013-2017 CodeReclaimers, LLC
 
+from account import AccountState
+from bars import Bar, BarBuilder
 from bot import Bot
+from breaker import CircuitBreaker, CircuitBreakers
+from columnar import ColumnarTradeStore
+from connection import ConnectionPool
 from database import MarketDatabase
-from trader import TraderBase
\ No newline at end of file
+from dedup import TidWindow, TradeDeduplicator
+from fixedpoint import ScaledTrade
+from metrics import Metrics, MetricsServer
+from orderbook import OrderBook
+from partitioned import PartitionedMarketDatabase
+from replay import Replay, ReplayAPI, runSweep
+from snapshot import MarketSnapshot
+from sources import MarketDataSource, PollingSource, StreamingSource
+from trader import TraderBase
+from transfer import exportMarketData, importTradeHistory
+from triggers import PriceTrigger, PriceTriggers
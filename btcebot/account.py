@@ -0,0 +1,234 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import decimal
+import threading
+import time
+import traceback
+
+from connection import ConnectionPool
+
+class AccountState(object):
+    '''
+    Cached copy of an account's balances and open orders, so traders can
+    decide how much to buy or sell without a getInfo round trip before
+    every order.  A background thread refreshes the cache from the API
+    every refreshInterval seconds, and orders placed or cancelled through
+    trade() and cancelOrder() update it immediately from the responses.
+
+    getBalance and getOpenOrders never block on the network; they return
+    whatever the cache holds, which is None or empty until the first
+    refresh completes (see waitReady).  api is a btceapi.TradeAPI, and
+    requests use connections from connectionPool.
+    '''
+    def __init__(self, api, connectionPool=None, refreshInterval=10.0, metrics=None):
+        self.api = api
+        if connectionPool is None:
+            connectionPool = ConnectionPool()
+        self.connectionPool = connectionPool
+        self.refreshInterval = refreshInterval
+        self.metrics = metrics
+
+        self.lock = threading.Lock()
+        self.balances = {}
+        # order_id -> btceapi OrderItem, or _PlacedOrder for orders placed
+        # since the last refresh.
+        self.orders = {}
+        self.refreshed = None
+        # Incremented by every local change.  While refreshes are in
+        # flight, local changes are also journalled as (number, funds,
+        # order_id, order) and replayed over the refreshed copies, so that
+        # a response which predates them doesn't undo them.  order is None
+        # for a cancellation.
+        self.changes = 0
+        self.refreshing = 0
+        self.journal = []
+        self.ready = threading.Event()
+
+        self.errorHandlers = []
+        self.running = False
+        self.wakeEvent = threading.Event()
+        self.thread = None
+
+        if metrics is not None:
+            metrics.setGauge("account_state_age_seconds", self.age)
+
+    def addErrorHandler(self, handler):
+        '''Add a handler function taking two arguments: a string describing
+        what operation was in process, and a string containing the
+        formatted traceback, as for Bot.addErrorHandler.'''
+        self.errorHandlers.append(handler)
+
+    def onRefreshError(self, tracebackText):
+        msg = "Error while refreshing account state"
+        if self.metrics is not None:
+            self.metrics.increment("account_refresh_errors_total")
+        for h in self.errorHandlers:
+            try:
+                h(msg, tracebackText)
+            except:
+                pass
+
+    # Reading the cache.
+
+    def getBalance(self, currency):
+        '''Return the cached balance of currency (such as "usd") as a
+        Decimal, or None if it isn't known yet.'''
+        with self.lock:
+            return self.balances.get(currency)
+
+    def getBalances(self):
+        '''Return a copy of the cached balances, keyed by currency.'''
+        with self.lock:
+            return dict(self.balances)
+
+    def getOpenOrders(self, pair=None):
+        '''Return the cached open orders, or only those for pair, sorted by
+        order id.'''
+        with self.lock:
+            orders = [o for i, o in sorted(self.orders.items())
+                      if pair is None or o.pair == pair]
+        return orders
+
+    def age(self):
+        '''Return the number of seconds since the last completed refresh,
+        or None if there hasn't been one.'''
+        if self.refreshed is None:
+            return None
+        return time.time() - self.refreshed
+
+    def waitReady(self, timeout=None):
+        '''Wait until the cache has been filled once, and return True if it
+        has.'''
+        self.ready.wait(timeout)
+        return self.ready.is_set()
+
+    # Updating the cache.
+
+    def refresh(self):
+        '''Fetch balances and open orders from the API and replace the
+        cached copies, keeping any orders placed or cancelled locally while
+        the request was in flight.'''
+        with self.lock:
+            changes = self.changes
+            self.refreshing += 1
+        try:
+            start = time.time()
+            with self.connectionPool.connection() as conn:
+                info = self.api.getInfo(conn)
+                if info.open_orders:
+                    orders = self.api.activeOrders(connection=conn)
+                else:
+                    # The API reports an error instead of an empty list.
+                    orders = []
+            if self.metrics is not None:
+                self.metrics.observe("account_refresh_seconds", time.time() - start)
+
+            balances = dict((c, decimal.Decimal(str(v))) for c, v in info.funds.items())
+            orders = dict((o.order_id, o) for o in orders)
+            with self.lock:
+                # The response may predate orders placed or cancelled since
+                # the request was made, so apply those again on top of it.
+                merged = 0
+                for number, funds, order_id, order in self.journal:
+                    if number <= changes:
+                        continue
+                    merged += 1
+                    if funds:
+                        for c, v in funds.items():
+                            balances[c] = decimal.Decimal(str(v))
+                    if order is None:
+                        orders.pop(order_id, None)
+                    elif order_id != 0 and order_id not in orders:
+                        orders[order_id] = order
+                self.balances = balances
+                self.orders = orders
+                self.refreshed = time.time()
+        finally:
+            with self.lock:
+                self.refreshing -= 1
+                if not self.refreshing:
+                    self.journal = []
+        if merged and self.metrics is not None:
+            self.metrics.increment("account_refresh_merged_changes_total", n=merged)
+        self.ready.set()
+        return True
+
+    def _applyFunds(self, funds, order_id, order):
+        # Called with the lock held.  Trade and cancel responses report the
+        # balances that result from them.
+        if funds:
+            for c, v in funds.items():
+                self.balances[c] = decimal.Decimal(str(v))
+        self.changes += 1
+        if self.refreshing:
+            self.journal.append((self.changes, funds, order_id, order))
+
+    def trade(self, pair, trade_type, rate, amount, connection=None):
+        '''Place an order through the API, update the cache from the
+        response, and return the response.'''
+        if connection is None:
+            with self.connectionPool.connection() as conn:
+                return self.trade(pair, trade_type, rate, amount, conn)
+
+        r = self.api.trade(pair, trade_type, rate, amount, connection)
+        order = _PlacedOrder(r.order_id, pair, trade_type, r.remains, rate)
+        with self.lock:
+            self._applyFunds(getattr(r, "funds", None), r.order_id, order)
+            if r.order_id != 0:
+                self.orders[r.order_id] = order
+        return r
+
+    def cancelOrder(self, order_id, connection=None):
+        '''Cancel an order through the API, update the cache from the
+        response, and return the response.'''
+        if connection is None:
+            with self.connectionPool.connection() as conn:
+                return self.cancelOrder(order_id, conn)
+
+        r = self.api.cancelOrder(order_id, connection)
+        with self.lock:
+            self._applyFunds(getattr(r, "funds", None), order_id, None)
+            self.orders.pop(order_id, None)
+        return r
+
+    # Background refresh.
+
+    def _run(self):
+        while self.running:
+            try:
+                self.refresh()
+            except:
+                self.onRefreshError(traceback.format_exc())
+            self.wakeEvent.wait(self.refreshInterval)
+            self.wakeEvent.clear()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="AccountState")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def wake(self):
+        '''Refresh now instead of waiting for the rest of the interval.'''
+        self.wakeEvent.set()
+
+class _PlacedOrder(object):
+    # Stand-in for a btceapi OrderItem, for an order placed since the last
+    # refresh.
+    __slots__ = ('order_id', 'pair', 'type', 'amount', 'rate', 'timestamp_created', 'status')
+
+    def __init__(self, order_id, pair, type, amount, rate):
+        self.order_id = order_id
+        self.pair = pair
+        self.type = type
+        self.amount = amount
+        self.rate = rate
+        self.timestamp_created = time.time()
+        self.status = 0
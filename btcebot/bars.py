@@ -0,0 +1,148 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import collections
+
+from fixedpoint import ScaledTrade, fromScaled, toScaled
+
+# Bar resolutions by name, in seconds.
+RESOLUTIONS = collections.OrderedDict([("1m", 60), ("5m", 300), ("1h", 3600), ("1d", 86400)])
+
+class Bar(object):
+    '''
+    Open/high/low/close/volume summary of one pair's trades over one
+    interval, which starts at start (seconds since the epoch) and lasts
+    resolution seconds.  Like ScaledTrade, prices and the volume are kept
+    as fixed-point integers and only returned as Decimals on request.
+    '''
+    __slots__ = ('pair', 'resolution', 'start', 'scaledOpen', 'scaledHigh',
+                 'scaledLow', 'scaledClose', 'scaledVolume', 'trades')
+
+    def __init__(self, pair, resolution, start, scaledOpen, scaledHigh,
+                 scaledLow, scaledClose, scaledVolume, trades):
+        self.pair = pair
+        self.resolution = resolution
+        self.start = start
+        self.scaledOpen = scaledOpen
+        self.scaledHigh = scaledHigh
+        self.scaledLow = scaledLow
+        self.scaledClose = scaledClose
+        self.scaledVolume = scaledVolume
+        self.trades = trades
+
+    @property
+    def end(self):
+        return self.start + self.resolution
+
+    @property
+    def open(self):
+        return fromScaled(self.scaledOpen)
+
+    @property
+    def high(self):
+        return fromScaled(self.scaledHigh)
+
+    @property
+    def low(self):
+        return fromScaled(self.scaledLow)
+
+    @property
+    def close(self):
+        return fromScaled(self.scaledClose)
+
+    @property
+    def volume(self):
+        return fromScaled(self.scaledVolume)
+
+    def __repr__(self):
+        return "Bar(pair=%r, resolution=%r, start=%r, open=%s, high=%s, low=%s, close=%s, volume=%s, trades=%r)" % (
+            self.pair, self.resolution, self.start, self.open, self.high,
+            self.low, self.close, self.volume, self.trades)
+
+class BarBuilder(object):
+    '''
+    Builds bars at several resolutions from a stream of trades, one trade
+    at a time, keeping the most recent maxBars completed bars of each
+    resolution for each pair.
+
+    A bar is completed when a trade arrives for a later interval, or by
+    close() once its interval ended more than closeDelay seconds ago, so
+    bars are finished even when trading is quiet.  Trades that arrive for
+    an interval that has already been completed are counted in lateTrades
+    and otherwise ignored.  Intervals without trades have no bar.
+    '''
+    def __init__(self, resolutions=RESOLUTIONS.values(), maxBars=1000, closeDelay=5):
+        self.resolutions = sorted(resolutions)
+        self.maxBars = maxBars
+        self.closeDelay = closeDelay
+        # (pair, resolution) -> bar in progress, and deque of completed bars.
+        self.current = {}
+        self.completed = {}
+        self.lateTrades = 0
+
+    def _complete(self, key, bar, closed):
+        bars = self.completed.get(key)
+        if bars is None:
+            bars = self.completed[key] = collections.deque(maxlen=self.maxBars)
+        bars.append(bar)
+        closed.append(bar)
+
+    def add(self, pair, trades):
+        '''Add trades (oldest first) for pair, and return the list of bars
+        they completed.'''
+        closed = []
+        current = self.current
+        for t in trades:
+            if type(t) is ScaledTrade:
+                price, amount = t.scaledPrice, t.scaledAmount
+            else:
+                price, amount = toScaled(t.price), toScaled(t.amount)
+            timestamp = int(t.timestamp)
+
+            for resolution in self.resolutions:
+                key = (pair, resolution)
+                start = timestamp - timestamp % resolution
+                bar = current.get(key)
+                if bar is not None and bar.start == start:
+                    if price > bar.scaledHigh:
+                        bar.scaledHigh = price
+                    elif price < bar.scaledLow:
+                        bar.scaledLow = price
+                    bar.scaledClose = price
+                    bar.scaledVolume += amount
+                    bar.trades += 1
+                    continue
+
+                if bar is not None and start < bar.start:
+                    self.lateTrades += 1
+                    continue
+                bars = self.completed.get(key)
+                if bar is None and bars and start < bars[-1].end:
+                    self.lateTrades += 1
+                    continue
+
+                if bar is not None:
+                    self._complete(key, bar, closed)
+                current[key] = Bar(pair, resolution, start, price, price, price,
+                                   price, amount, 1)
+        return closed
+
+    def close(self, pair, now):
+        '''Complete pair's bars whose intervals ended more than closeDelay
+        seconds before now (seconds since the epoch), and return them.'''
+        closed = []
+        for resolution in self.resolutions:
+            key = (pair, resolution)
+            bar = self.current.get(key)
+            if bar is not None and bar.end + self.closeDelay <= now:
+                del self.current[key]
+                self._complete(key, bar, closed)
+        return closed
+
+    def bars(self, pair, resolution):
+        '''Return the completed bars for pair at resolution (in seconds),
+        oldest first.'''
+        return list(self.completed.get((pair, resolution), ()))
+
+    def currentBar(self, pair, resolution):
+        '''Return the bar in progress for pair at resolution, or None.'''
+        return self.current.get((pair, resolution))
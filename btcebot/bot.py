@@ -6,99 +6,105 @@ import threading
 import time
 import traceback
 
-import btceapi
 import sys
 
+from bars import RESOLUTIONS, BarBuilder
+from connection import ConnectionPool
+from fixedpoint import ScaledTrade
+from lanes import TraderLane
+from metrics import Metrics
+from orderbook import OrderBook, levelsFromScaled
+from scheduler import Scheduler
+from shards import TraderShards
+from snapshot import MarketSnapshot
+from sources import PollingSource
+from tradebuffer import TradeBuffer, TradeView
+from triggers import PriceTriggers
 from trader import TraderBase
 
 def _runBot(bot):
     while bot.running:
-        loop_start = time.time()
-        
-        # Collect the set of pairs for which we should get depth.
-        depthPairs = set()
-        for handler, pairs in bot.depthHandlers:
-            depthPairs.update(pairs)
-            
-        # Get current depth
-        depths = {}
-        conn = btceapi.BTCEConnection()
-        for p in depthPairs:
-            try:
-                asks, bids = btceapi.getDepth(p, conn)
-                depths[p] = (datetime.datetime.now(), asks, bids)
-            except:
-                bot.onDepthRetrievalError(p, traceback.format_exc())
-                   
-        # Collect the set of pairs for which we should get trade history.
-        tradeHistoryPairs = set()
-        for handler, pairs in bot.tradeHistoryHandlers:
-            tradeHistoryPairs.update(pairs)
-        
-        tradeHistories = {}
-        for p in tradeHistoryPairs:
-            try:
-                trades = btceapi.getTradeHistory(p, conn)
-                tradeHistories[p] = (datetime.datetime.now(), trades)
-            except:
-                bot.onTradeHistoryRetrievalError(p, traceback.format_exc())
-        conn.close()
+        bot.wakeEvent.clear()
+        delay = bot.update()
 
-        for p, (t, asks, bids) in depths.items():
-            for handler, pairs in bot.depthHandlers:
-                if p in pairs:
-                    try:
-                        handler(t, p, asks, bids)
-                    except:
-                        bot.onDepthHandlingError(p, handler, traceback.format_exc())
-       
-        for p, (t, trades) in tradeHistories.items():
-            # Merge new trades into the bot's history.
-            bot.mergeTradeHistory(p, trades)
-            
-            # Provide full history to traders
-            for handler, pairs in bot.tradeHistoryHandlers:
-                if p in pairs:
-                    try:
-                        handler(t, p, bot.tradeHistoryItems[p])
-                    except:
-                        exc_type, exc_value, exc_traceback = sys.exc_info()
-                        tb = traceback.format_exception(exc_type, exc_value, exc_traceback)
-                        bot.onTradeHistoryHandlingError(p, handler, tb)
-                        
-        # Tell all bots that have requested it that we're at the end
-        # of an update loop.
-        for handler in bot.loopEndHandlers:
-            try:
-                handler(datetime.datetime.now())
-            except:
-                # TODO: refactor this somewhere
-                t = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                print "%s Error while calling loop end handler (%r): %s" % (t, handler, traceback.format_exc())
-                
-        while bot.running and time.time() - loop_start < bot.collectionInterval:
-            time.sleep(0.5)
-
-    # Give traders and opportunity to do thread-specific cleanup.
-    for t in bot.traders:
-        t.onExit()
-    
+        # Sleep until the next request is due, or until something (like
+        # stop()) wakes us up.
+        if bot.running:
+            bot.wakeEvent.wait(delay)
+
+    bot.source.stop()
+
+    bot.exitTraders()
+
+    bot.connectionPool.close()
+
+def _handlerName(handler):
+    '''Name a handler for metrics: Class.method for bound methods.'''
+    name = getattr(handler, "__name__", type(handler).__name__)
+    obj = getattr(handler, "__self__", None)
+    if obj is not None:
+        return "%s.%s" % (type(obj).__name__, name)
+    return name
             
 class Bot(object):
-    def __init__(self, api, bufferSpanMinutes=10):
+    def __init__(self, api, bufferSpanMinutes=10, fixedPoint=False,
+                 connectionPool=None):
+        '''
+        If fixedPoint is True, buffered trades are stored as ScaledTrade
+        objects, which keep prices and amounts as fixed-point integers and
+        only create Decimals when a trader reads them.
+
+        connectionPool is the ConnectionPool used to retrieve market data;
+        by default the bot creates its own.
+
+        The bot records timings of each stage of its loop in self.metrics
+        (see addMetricsHandler and metrics.MetricsServer).
+        '''
         self.api = api
         self.bufferSpanMinutes = bufferSpanMinutes
+        self.fixedPoint = fixedPoint
         self.depthHandlers = []
+        self.depthChangeHandlers = []
         self.tradeHistoryHandlers = []
+        self.newTradesHandlers = []
+        self.snapshotHandlers = []
+        self.barHandlers = []
         self.loopEndHandlers = []
+        self.priceTriggers = PriceTriggers()
         self.collectionInterval = 60.0
+        self.fetchConcurrency = 4
+        if connectionPool is None:
+            connectionPool = ConnectionPool()
+        self.connectionPool = connectionPool
+        self.scheduler = Scheduler()
+        self.source = PollingSource()
+        self.wakeEvent = threading.Event()
         self.running = False
         self.traders = set()
+        self.laneSize = None
+        self.lanes = {}
+        self.shards = None
         
-        self.tradeHistoryIds = {}
+        self.orderBooks = {}
+        # Pairs whose book was loaded by warmStart, and so should be passed
+        # to the depth handlers even if the first one retrieved matches it.
+        self.primedBooks = set()
+        self.historySource = None
+        self.tradeBuffers = {}
         self.tradeHistoryItems = {}
+        self.barBuilder = None
+        self.marketSnapshots = {}
+        # Pairs with new depth or trade history since the last loop end.
+        self.updatedPairs = set()
         
         self.errorHandlers = []
+
+        self.metrics = Metrics()
+        self.metrics.setGauge("requests_deferred", lambda: self.scheduler.deferred)
+        self.metricsHandlers = []
+        self.metricsInterval = 60.0
+        self.metricsReported = time.time()
+        self.handlerLabels = {}
         
     def addErrorHandler(self, handler):
         '''Add a handler function taking two arguments: a string describing
@@ -140,66 +146,525 @@ class Bot(object):
                 h(msg, tracebackText)
             except:
                 pass
+
+    def onMarketDataError(self, msg, tracebackText):
+        for h in self.errorHandlers:
+            try:
+                h(msg, tracebackText)
+            except:
+                pass
+
+    def onTriggerHandlingError(self, trigger, tracebackText):
+        msg = "Error in handler %r for %s price trigger" % (trigger.handler, trigger.pair)
+        for h in self.errorHandlers:
+            try:
+                h(msg, tracebackText)
+            except:
+                pass
+
+    def onBarHandlingError(self, pair, handler, tracebackText):
+        msg = "Error in handler %r for %s bars" % (handler, pair)
+        for h in self.errorHandlers:
+            try:
+                h(msg, tracebackText)
+            except:
+                pass
+
+    def onSnapshotHandlingError(self, pair, handler, tracebackText):
+        msg = "Error in handler %r for %s market snapshot" % (handler, pair)
+        for h in self.errorHandlers:
+            try:
+                h(msg, tracebackText)
+            except:
+                pass
         
-    def mergeTradeHistory(self, pair, history):
-        keys = self.tradeHistoryIds.setdefault(pair, set())
-        prevItems = self.tradeHistoryItems.get(pair, [])
-        newItems = []
-        
-        # Remove old items
-        now = decimal.Decimal(time.time())
-        dt_sec = self.bufferSpanMinutes * 60
-        for h in prevItems:
-            if now - h.timestamp > dt_sec:
-                keys.remove(h.tid)
+    def update(self):
+        '''Have the market data source pass whatever data is available to
+        the handlers, and return the number of seconds until it should be
+        called again.  This is what the bot thread does on each pass of
+        its loop.'''
+        delay = self.source.update(self)
+        self.reportMetrics()
+        return delay
+
+    def getDepthPairs(self):
+        '''Return the set of pairs for which we should get depth.'''
+        depthPairs = set()
+        for handler, pairs in self.depthHandlers:
+            depthPairs.update(pairs)
+        for handler, pairs in self.depthChangeHandlers:
+            depthPairs.update(pairs)
+        for handler, pairs in self.snapshotHandlers:
+            depthPairs.update(pairs)
+        depthPairs.update(self.priceTriggers.pairs())
+        return depthPairs
+
+    def getTradeHistoryPairs(self):
+        '''Return the set of pairs for which we should get trade history.'''
+        tradeHistoryPairs = set()
+        for handler, pairs in self.tradeHistoryHandlers:
+            tradeHistoryPairs.update(pairs)
+        for handler, pairs in self.newTradesHandlers:
+            tradeHistoryPairs.update(pairs)
+        for handler, pairs in self.snapshotHandlers:
+            tradeHistoryPairs.update(pairs)
+        for handler, pairs in self.barHandlers:
+            tradeHistoryPairs.update(pairs)
+        return tradeHistoryPairs
+
+    def dispatchDepth(self, t, p, asks, bids):
+        '''Pass a depth snapshot for pair p, taken at time t, to the
+        depth handlers.'''
+        book = OrderBook(asks, bids)
+        previous = self.orderBooks.get(p)
+        self.orderBooks[p] = book
+        self.dispatchPriceTriggers(t, p, book)
+        if p in self.primedBooks:
+            self.primedBooks.discard(p)
+        elif previous is not None and book == previous:
+            # Nothing has changed since the last update, so don't
+            # bother the handlers.
+            return
+        self.marketSnapshots.pop(p, None)
+        self.updatedPairs.add(p)
+
+        for handler, pairs in self.depthHandlers:
+            if p in pairs:
+                start = time.time()
+                try:
+                    handler(t, p, asks, bids)
+                except:
+                    self.onDepthHandlingError(p, handler, traceback.format_exc())
+                self.recordHandlerTime(handler, start)
+
+        changeHandlers = [h for h, pairs in self.depthChangeHandlers if p in pairs]
+        if changeHandlers:
+            added, removed, modified = book.diff(previous)
+            added = levelsFromScaled(added)
+            removed = levelsFromScaled(removed)
+            modified = levelsFromScaled(modified)
+            for handler in changeHandlers:
+                start = time.time()
+                try:
+                    handler(t, p, added, removed, modified)
+                except:
+                    self.onDepthHandlingError(p, handler, traceback.format_exc())
+                self.recordHandlerTime(handler, start)
+
+    def dispatchPriceTriggers(self, t, p, book):
+        '''Call the handlers of the price triggers for pair p crossed by
+        the new order book.'''
+        bestAsk = book.askPrices[0] if book.askPrices else None
+        bestBid = book.bidPrices[0] if book.bidPrices else None
+        for trigger in self.priceTriggers.update(p, bestAsk, bestBid):
+            self.metrics.increment("price_triggers_fired_total", (("pair", p),))
+            start = time.time()
+            try:
+                trigger.handler(t, p, trigger)
+            except:
+                self.onTriggerHandlingError(trigger, traceback.format_exc())
+            self.recordHandlerTime(trigger.handler, start)
+
+    def dispatchTradeHistory(self, t, p, trades, now=None):
+        '''Merge trades for pair p, retrieved at time t, into the bot's
+        history and pass it to the trade history handlers.  now is the
+        current time in seconds since the epoch, and defaults to the
+        system clock.'''
+        # Merge new trades into the bot's history.
+        start = time.time()
+        newTrades = self.mergeTradeHistory(p, trades, now)
+        self.metrics.observe("merge_seconds", time.time() - start, (("pair", p),))
+        self.marketSnapshots.pop(p, None)
+        self.updatedPairs.add(p)
+
+        # Provide only the trades we haven't seen before to traders
+        # that asked for them.
+        if newTrades:
+            for handler, pairs in self.newTradesHandlers:
+                if p in pairs:
+                    start = time.time()
+                    try:
+                        handler(t, p, newTrades)
+                    except:
+                        self.onTradeHistoryHandlingError(p, handler, traceback.format_exc())
+                    self.recordHandlerTime(handler, start)
+
+        # Provide full history to traders
+        for handler, pairs in self.tradeHistoryHandlers:
+            if p in pairs:
+                start = time.time()
+                try:
+                    handler(t, p, self.tradeHistoryItems[p])
+                except:
+                    exc_type, exc_value, exc_traceback = sys.exc_info()
+                    tb = traceback.format_exception(exc_type, exc_value, exc_traceback)
+                    self.onTradeHistoryHandlingError(p, handler, tb)
+                self.recordHandlerTime(handler, start)
+
+        if self.barBuilder is not None:
+            self.dispatchBars(t, p, newTrades, now)
+
+    def dispatchBars(self, t, p, newTrades, now=None):
+        '''Add newly merged trades for pair p to the bars being built, and
+        pass any bars that are now complete to the bar handlers.'''
+        if now is None:
+            now = time.time()
+        builder = self.barBuilder
+        bars = builder.add(p, newTrades) + builder.close(p, now)
+        if not bars:
+            return
+
+        for handler, pairs in self.barHandlers:
+            if p in pairs:
+                start = time.time()
+                for bar in bars:
+                    try:
+                        handler(t, p, bar)
+                    except:
+                        self.onBarHandlingError(p, handler, traceback.format_exc())
+                self.recordHandlerTime(handler, start)
+
+    def getSnapshot(self, pair):
+        '''Return the MarketSnapshot for pair's current depth and trade
+        history, creating it if there have been updates since the last
+        one.'''
+        snapshot = self.marketSnapshots.get(pair)
+        if snapshot is None:
+            snapshot = MarketSnapshot(pair, self.orderBooks.get(pair),
+                                      self.tradeHistoryItems.get(pair, ()))
+            self.marketSnapshots[pair] = snapshot
+        return snapshot
+
+    def dispatchSnapshots(self, t):
+        '''Pass a snapshot of each pair updated since the last call to the
+        snapshot handlers for that pair.'''
+        updated, self.updatedPairs = self.updatedPairs, set()
+        for handler, pairs in self.snapshotHandlers:
+            for p in updated:
+                if p in pairs:
+                    start = time.time()
+                    try:
+                        handler(t, p, self.getSnapshot(p))
+                    except:
+                        self.onSnapshotHandlingError(p, handler, traceback.format_exc())
+                    self.recordHandlerTime(handler, start)
+
+    def dispatchLoopEnd(self, t):
+        self.dispatchSnapshots(t)
+
+        for handler in self.loopEndHandlers:
+            start = time.time()
+            try:
+                handler(t)
+            except:
+                # TODO: refactor this somewhere
+                tstr = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                print "%s Error while calling loop end handler (%r): %s" % (tstr, handler, traceback.format_exc())
+            self.recordHandlerTime(handler, start)
+
+    def recordHandlerTime(self, handler, start):
+        '''Record the time since start as an execution of handler.'''
+        labels = self.handlerLabels.get(handler)
+        if labels is None:
+            labels = (("handler", _handlerName(handler)),)
+            self.handlerLabels[handler] = labels
+        self.metrics.observe("handler_seconds", time.time() - start, labels)
+
+    def reportMetrics(self, force=False):
+        '''Pass self.metrics to the metrics handlers if metricsInterval
+        seconds have passed since they were last called, or if force is
+        True.'''
+        now = time.time()
+        if not self.metricsHandlers:
+            return
+        if not force and now - self.metricsReported < self.metricsInterval:
+            return
+        self.metricsReported = now
+        for handler in self.metricsHandlers:
+            try:
+                handler(self.metrics)
+            except:
+                pass
+
+    def exitTraders(self):
+        # Give traders and opportunity to do thread-specific cleanup.
+        if self.shards is not None:
+            self.shards.stop()
+        for t in self.traders:
+            lane = self.lanes.pop(t, None)
+            if lane is not None:
+                # The lane calls onExit on its own thread once it has
+                # delivered everything queued for the trader.
+                lane.stop()
             else:
-                keys.add(h.tid)
-                newItems.append(h)
+                t.onExit()
 
-        # Add new items        
-        for h in history:
-            if h.tid not in keys:
-                keys.add(h.tid)
-                newItems.append(h)
+    def mergeTradeHistory(self, pair, history, now=None):
+        '''Add any previously unseen trades in history to the buffer for
+        the given pair, drop trades older than bufferSpanMinutes as of now
+        (seconds since the epoch, defaulting to the system clock), and
+        return the list of new trades (oldest first).'''
+        buf = self.tradeBuffers.get(pair)
+        if buf is None:
+            if self.fixedPoint:
+                buf = TradeBuffer(ScaledTrade.fromTrade)
+            else:
+                buf = TradeBuffer()
+            self.tradeBuffers[pair] = buf
+            self.tradeHistoryItems[pair] = TradeView(buf.items)
+
+        newItems = buf.add(history)
+
+        # Remove old items
+        if now is None:
+            now = time.time()
+        if self.fixedPoint:
+            cutoff = int(now) - self.bufferSpanMinutes * 60
+        else:
+            cutoff = decimal.Decimal(now) - self.bufferSpanMinutes * 60
+        buf.expire(cutoff)
+
+        return newItems
 
-        self.tradeHistoryItems[pair] = newItems
-        
     def addTrader(self, trader):
+        if self.shards is not None:
+            self.shards.addTrader(trader)
+            return
+
+        # With trader lanes, the bot calls the lane, which calls the
+        # trader on its own thread.
+        target = trader
+        if self.laneSize is not None:
+            name = "%s-%d" % (type(trader).__name__, len(self.lanes))
+            target = TraderLane(self, trader, name, self.laneSize)
+            self.lanes[trader] = target
+            target.start()
+
         if trader.onNewDepth.__func__ is not TraderBase.onNewDepth.__func__:
-            self.addDepthHandler(trader.onNewDepth, trader.pairs)
+            self.addDepthHandler(target.onNewDepth, trader.pairs)
+
+        if trader.onDepthChange.__func__ is not TraderBase.onDepthChange.__func__:
+            self.addDepthChangeHandler(target.onDepthChange, trader.pairs)
             
         if trader.onNewTradeHistory.__func__ is not TraderBase.onNewTradeHistory.__func__:
-            self.addTradeHistoryHandler(trader.onNewTradeHistory, trader.pairs)
+            self.addTradeHistoryHandler(target.onNewTradeHistory, trader.pairs)
+
+        if trader.onNewTrades.__func__ is not TraderBase.onNewTrades.__func__:
+            self.addNewTradesHandler(target.onNewTrades, trader.pairs)
+
+        if trader.onNewBar.__func__ is not TraderBase.onNewBar.__func__:
+            self.addBarHandler(target.onNewBar, trader.pairs)
+
+        if trader.onNewSnapshot.__func__ is not TraderBase.onNewSnapshot.__func__:
+            self.addSnapshotHandler(target.onNewSnapshot, trader.pairs)
 
         if trader.onLoopEnd.__func__ is not TraderBase.onLoopEnd.__func__:
-            self.addLoopEndHandler(trader.onLoopEnd)
+            self.addLoopEndHandler(target.onLoopEnd)
             
         self.traders.add(trader)
+
+    def setTraderLanes(self, max_pending=100):
+        '''Run each trader added after this call on a thread of its own
+        (see lanes.TraderLane), queueing at most max_pending depth change
+        updates for a trader that falls behind.  Depth, trade history and
+        loop end updates for a lagging trader are coalesced so that it
+        always catches up to the latest state.  Pass None to go back to
+        calling traders on the bot thread.'''
+        self.laneSize = max_pending
+
+    def setTraderProcesses(self, processes=None, slots=1024, max_levels=200):
+        '''Run traders added after this call in processes worker
+        processes (by default, one per CPU), fed through a shared-memory
+        ring of slots records (see shards.TraderShards).  At most
+        max_levels levels on each side of the book are passed on.'''
+        self.shards = TraderShards(self, processes, slots, max_levels)
+
+    def traderLag(self):
+        '''Return a dictionary mapping each trader running in a lane to the
+        number of seconds its oldest undelivered update has been waiting.'''
+        return dict((t, lane.lag()) for t, lane in self.lanes.items())
         
     def addDepthHandler(self, handler, pairs):
         for p in pairs:
             self.api.validate_pair(p)
 
         self.depthHandlers.append((handler, pairs))
+
+    def addDepthChangeHandler(self, handler, pairs):
+        for p in pairs:
+            self.api.validate_pair(p)
+
+        self.depthChangeHandlers.append((handler, pairs))
         
     def addTradeHistoryHandler(self, handler, pairs):
         for p in pairs:
             self.api.validate_pair(p)
 
         self.tradeHistoryHandlers.append((handler, pairs))
-        
+
+    def addNewTradesHandler(self, handler, pairs):
+        for p in pairs:
+            self.api.validate_pair(p)
+
+        self.newTradesHandlers.append((handler, pairs))
+
+    def addBarHandler(self, handler, pairs):
+        for p in pairs:
+            self.api.validate_pair(p)
+
+        if self.barBuilder is None:
+            self.barBuilder = BarBuilder()
+        self.barHandlers.append((handler, pairs))
+
+    def setBarResolutions(self, resolutions, max_bars=1000):
+        '''Build bars at the given resolutions, which may be names from
+        bars.RESOLUTIONS ("1m", "5m", "1h" or "1d") or numbers of seconds,
+        keeping the last max_bars completed bars of each in memory.'''
+        seconds = [RESOLUTIONS.get(r, r) for r in resolutions]
+        self.barBuilder = BarBuilder(seconds, max_bars)
+
+    def addSnapshotHandler(self, handler, pairs):
+        for p in pairs:
+            self.api.validate_pair(p)
+
+        self.snapshotHandlers.append((handler, pairs))
+
+    def addPriceTrigger(self, pair, side, price, handler, once=False):
+        '''Call handler(t, pair, trigger) when the best ask of pair falls to
+        price or below (side "ask"), or when the best bid rises to price or
+        above (side "bid").  The handler is called each time the price
+        crosses the threshold, or only the first time if once is True.
+        Returns the triggers.PriceTrigger, which can be passed to
+        removePriceTrigger.  Triggers may be added and removed from any
+        thread, but handlers are called on the bot thread, so they should
+        return quickly.'''
+        self.api.validate_pair(pair)
+        trigger = self.priceTriggers.add(pair, side, price, handler, once)
+        self.wake()
+        return trigger
+
+    def removePriceTrigger(self, trigger):
+        self.priceTriggers.remove(trigger)
+
     def addLoopEndHandler(self, handler):
         self.loopEndHandlers.append(handler)
 
+    def addMetricsHandler(self, handler):
+        '''Add a handler function taking one argument, the bot's Metrics
+        object, which is called every metricsInterval seconds.  If an
+        exception is raised inside the handler, it will be ignored.'''
+        self.metricsHandlers.append(handler)
+
+    def setMetricsInterval(self, interval_seconds):
+        self.metricsInterval = interval_seconds
+
     def setCollectionInterval(self, interval_seconds):
         self.collectionInterval = interval_seconds
+        self.wake()
+
+    def setPairInterval(self, pair, interval_seconds, kind=None, priority=0):
+        '''Poll pair every interval_seconds instead of every collection
+        interval.  kind may be "depth" or "trades" to set the interval for
+        just that kind of request.  When a request rate limit is set,
+        requests with higher priority are made first.'''
+        self.api.validate_pair(pair)
+        self.scheduler.setInterval(pair, interval_seconds, kind, priority)
+        self.wake()
+
+    def setRequestRateLimit(self, requests_per_second, burst=None):
+        '''Limit the average rate of market data requests across all
+        pairs, allowing bursts of up to burst requests.  Pass None to
+        remove the limit.'''
+        self.scheduler.setRateLimit(requests_per_second, burst)
+        self.wake()
+
+    def setHistorySource(self, source):
+        '''Load recorded market data from source when the bot starts (see
+        warmStart).  source is a MarketDatabase, or anything else with the
+        same retrieveTradeHistory method, and optionally
+        retrieveLatestDepth.'''
+        self.historySource = source
+
+    def warmStart(self, now=None):
+        '''Fill the trade buffers with the last bufferSpanMinutes of trades
+        from the history source, and load the latest recorded depth from
+        the same period, so handlers see a full buffer from the first
+        loop.  Handlers are not called for the loaded data.  now is the
+        current time in seconds since the epoch, and defaults to the
+        system clock.  This is called by start().'''
+        source = self.historySource
+        if source is None:
+            return
+        if now is None:
+            now = time.time()
+        began = time.time()
+        since = int(now) - self.bufferSpanMinutes * 60
+
+        for p in self.getTradeHistoryPairs():
+            trades = list(source.retrieveTradeHistory(since, int(now), p))
+            self.primeTradeHistory(p, trades, now)
+
+        retrieveLatestDepth = getattr(source, "retrieveLatestDepth", None)
+        if retrieveLatestDepth is not None:
+            sinceDate = datetime.datetime.fromtimestamp(since)
+            for p in self.getDepthPairs():
+                latest = retrieveLatestDepth(p, sinceDate)
+                if latest is not None:
+                    t, asks, bids = latest
+                    self.primeDepth(p, OrderBook(asks, bids))
+
+        self.metrics.observe("warm_start_seconds", time.time() - began)
+
+    def primeTradeHistory(self, pair, trades, now=None):
+        '''Add trades to the buffer for pair without calling any handlers,
+        as warmStart does.'''
+        newTrades = self.mergeTradeHistory(pair, trades, now)
+        if self.barBuilder is not None:
+            # Bars completed by old trades have already been recorded.
+            self.barBuilder.add(pair, newTrades)
+        self.marketSnapshots.pop(pair, None)
+
+    def primeDepth(self, pair, book):
+        '''Set the order book (an orderbook.OrderBook) of pair without
+        calling any handlers, as warmStart does; the next depth retrieved
+        is compared against it.'''
+        self.orderBooks[pair] = book
+        self.primedBooks.add(pair)
+        self.marketSnapshots.pop(pair, None)
+
+    def setMarketDataSource(self, source):
+        '''Get market data from source (a sources.MarketDataSource), such
+        as a StreamingSource, instead of polling the public API.  This must
+        be called before the bot is started.'''
+        self.source = source
+
+    def wake(self):
+        '''Make the bot thread check for due requests immediately instead
+        of sleeping until the next one is scheduled.'''
+        self.wakeEvent.set()
+
+    def setFetchConcurrency(self, max_requests):
+        '''Set the maximum number of depth/trade history requests that
+        will be in flight at once during each update loop.'''
+        self.fetchConcurrency = max(1, int(max_requests))
+        # Keep enough idle connections around to serve a whole loop.
+        pool = self.connectionPool
+        pool.maxIdle = max(pool.maxIdle, self.fetchConcurrency)
         
     def start(self):
+        # Warm start first, so that trader processes start from the loaded
+        # buffers and books too.
+        self.warmStart()
+        if self.shards is not None:
+            # Fork the trader processes before starting any threads.
+            self.shards.start()
         self.running = True
+        self.source.start(self)
         self.thread = threading.Thread(target = _runBot, args=(self,))
         self.thread.start()
         
     def stop(self):
         self.running = False
+        self.wake()
         self.thread.join()
         
@@ -0,0 +1,135 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import random
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+class CircuitBreaker(object):
+    '''
+    Stops requests to something that keeps failing.  After threshold
+    consecutive failures the breaker opens and refuses requests for a
+    backoff delay, which starts at baseDelay seconds and doubles each time
+    the breaker opens again without having recovered, up to maxDelay.
+    Each delay is shortened by a random fraction of up to jitter, so that
+    breakers opened together don't all retry together.  Once the delay has
+    passed the breaker is half-open: it allows a single probe request, and
+    closes if that succeeds or opens again if it fails.
+    '''
+    def __init__(self, threshold=3, baseDelay=5.0, maxDelay=300.0, jitter=0.5,
+                 rng=random):
+        self.threshold = threshold
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+        self.rng = rng
+        self.state = CLOSED
+        self.failures = 0
+        # Number of times the breaker has opened since it last closed.
+        self.trips = 0
+        self.retryAt = None
+        self.lastError = None
+
+    def ready(self, now):
+        '''Return whether allow(now) would return True, without changing
+        the state.'''
+        return self.state == CLOSED or (self.state == OPEN and now >= self.retryAt)
+
+    def allow(self, now):
+        '''Return whether a request may be made at time now.  A True result
+        while the breaker is open makes the request the half-open probe.'''
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now >= self.retryAt:
+            self.state = HALF_OPEN
+            return True
+        return False
+
+    def success(self):
+        '''Record a successful request, and return True if this closed the
+        breaker.'''
+        recovered = self.state != CLOSED
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.retryAt = None
+        return recovered
+
+    def failure(self, now, error=None):
+        '''Record a failed request at time now, with an optional summary of
+        the error, and return True if this opened the breaker.'''
+        self.failures += 1
+        self.lastError = error
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            delay = min(self.maxDelay, self.baseDelay * 2 ** self.trips)
+            delay *= 1.0 - self.jitter * self.rng.random()
+            self.state = OPEN
+            self.trips += 1
+            self.retryAt = now + delay
+            return True
+        return False
+
+class CircuitBreakers(object):
+    '''
+    Circuit breakers for market data requests: one for each kind of
+    request (endpoint) and pair, and one for each endpoint as a whole.
+    A request is made only if both of its breakers allow it.  Failures of
+    one pair open only its own breaker, but if an endpoint fails
+    endpointThreshold times in a row, across all pairs, its breaker opens
+    and the endpoint is only probed with one request at a time until it
+    recovers.  Other arguments are passed to each CircuitBreaker.
+    '''
+    def __init__(self, threshold=3, endpointThreshold=10, baseDelay=5.0,
+                 maxDelay=300.0, jitter=0.5, rng=random):
+        self.threshold = threshold
+        self.endpointThreshold = endpointThreshold
+        self.options = dict(baseDelay=baseDelay, maxDelay=maxDelay, jitter=jitter, rng=rng)
+        # (kind, pair) or (kind, None) -> CircuitBreaker
+        self.breakers = {}
+
+    def breaker(self, kind, pair=None):
+        '''Return the breaker for kind and pair, or for the whole endpoint
+        if pair is None.'''
+        key = (kind, pair)
+        b = self.breakers.get(key)
+        if b is None:
+            threshold = self.endpointThreshold if pair is None else self.threshold
+            b = self.breakers[key] = CircuitBreaker(threshold, **self.options)
+        return b
+
+    def allow(self, kind, pair, now):
+        '''Return whether a request of kind for pair may be made at time
+        now.'''
+        pairBreaker = self.breaker(kind, pair)
+        if not pairBreaker.ready(now):
+            return False
+        endpoint = self.breaker(kind)
+        if endpoint.state != CLOSED and not endpoint.allow(now):
+            # Only one probe is allowed while the endpoint is failing.
+            return False
+        return pairBreaker.allow(now)
+
+    def success(self, kind, pair):
+        '''Record a successful request, and return the list of breakers
+        (as (kind, pair) keys) that this closed.'''
+        closed = []
+        if self.breaker(kind).success():
+            closed.append((kind, None))
+        if self.breaker(kind, pair).success():
+            closed.append((kind, pair))
+        return closed
+
+    def failure(self, kind, pair, now, error=None):
+        '''Record a failed request, and return the list of breakers (as
+        (kind, pair) keys) that this opened.'''
+        opened = []
+        if self.breaker(kind, pair).failure(now, error):
+            opened.append((kind, pair))
+        if self.breaker(kind).failure(now, error):
+            opened.append((kind, None))
+        return opened
+
+    def openCount(self):
+        '''Return the number of breakers that are not closed.'''
+        return sum(1 for b in self.breakers.values() if b.state != CLOSED)
@@ -0,0 +1,312 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Append-only columnar storage for trade history, for research workloads
+that read long ranges of trades.
+
+Each pair has a directory holding one file per column, with one
+fixed-width native value per trade, in trade id order:
+
+    tid.i64  timestamp.i64  price.i64  amount.i64  type.i8
+
+Prices and amounts are fixed-point integers (see fixedpoint.SCALE), and
+type is the trade type index (0 for "bid", 1 for "ask").  index.i64 is a
+sparse timestamp index: entry k is the timestamp of the last trade in the
+k-th block of indexInterval trades.  The timestamp column never
+decreases: a trade with an earlier timestamp than one with a lower trade
+id is stored with that trade's timestamp instead.  So a time range is
+found by a binary search over the index followed by one within a single
+block of the timestamp column.
+
+Columns are only ever appended to, and the number of complete trades is
+the length of the shortest column, so other processes can read the files
+while the bot is writing them.  With NumPy, retrieved columns are slices
+of memory-mapped files, so nothing is copied until it is used.
+'''
+
+import array
+import bisect
+import mmap
+import os
+
+from btceapi.public import Trade
+
+from fixedpoint import INT64_TYPECODE, ScaledTrade, fromScaled, toScaled
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_COLUMNS = (("tid", INT64_TYPECODE), ("timestamp", INT64_TYPECODE),
+            ("price", INT64_TYPECODE), ("amount", INT64_TYPECODE), ("type", "b"))
+_INDEX = "index"
+_TRADE_TYPES = ("bid", "ask")
+
+def _fileName(name, typecode):
+    return "%s.%s" % (name, "i8" if typecode == "b" else "i64")
+
+class _PairWriter(object):
+    # Open column files for appending to one pair's store.
+    def __init__(self, path, indexInterval):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.indexInterval = indexInterval
+        rows = _rowCount(path)
+        for name, typecode in _COLUMNS:
+            filePath = os.path.join(path, _fileName(name, typecode))
+            if os.path.exists(filePath):
+                # Drop anything after the last complete trade, such as a
+                # partial write from a crash.
+                with open(filePath, "r+b") as f:
+                    f.truncate(rows * array.array(typecode).itemsize)
+        self.files = [open(os.path.join(path, _fileName(name, typecode)), "ab")
+                      for name, typecode in _COLUMNS]
+
+        # Bring the index up to date with the columns, in case the last
+        # append was interrupted.
+        indexPath = os.path.join(path, _fileName(_INDEX, INT64_TYPECODE))
+        blocks = rows // indexInterval
+        indexed = os.path.getsize(indexPath) // 8 if os.path.exists(indexPath) else 0
+        self.indexFile = open(indexPath, "ab")
+        if indexed > blocks:
+            self.indexFile.truncate(blocks * 8)
+        for k in xrange(indexed, blocks):
+            self.indexFile.write(array.array(INT64_TYPECODE, [
+                _readValue(path, "timestamp", (k + 1) * indexInterval - 1)]).tostring())
+        self.indexFile.flush()
+        self.rows = rows
+        self.lastTid = _readValue(path, "tid", rows - 1) if rows else None
+        self.lastTimestamp = _readValue(path, "timestamp", rows - 1) if rows else None
+
+    def append(self, rows):
+        # rows is a list of (tid, timestamp, price, amount, type) tuples
+        # in tid order, all newer than lastTid.  Timestamps are clamped so
+        # that they never decrease (see the module documentation).
+        columns = [array.array(typecode) for name, typecode in _COLUMNS]
+        lastTimestamp = self.lastTimestamp
+        for row in rows:
+            if lastTimestamp is not None and row[1] < lastTimestamp:
+                row = (row[0], lastTimestamp) + row[2:]
+            lastTimestamp = row[1]
+            for column, value in zip(columns, row):
+                column.append(value)
+        # Readers only count trades that are complete in every column.
+        for f, column in zip(self.files, columns):
+            f.write(column.tostring())
+            f.flush()
+
+        timestamps = columns[1]
+        index = array.array(INT64_TYPECODE)
+        interval = self.indexInterval
+        for i in xrange(len(rows)):
+            row = self.rows + i
+            if row % interval == interval - 1:
+                index.append(timestamps[i])
+        if index:
+            self.indexFile.write(index.tostring())
+            self.indexFile.flush()
+
+        self.rows += len(rows)
+        self.lastTid = columns[0][-1]
+        self.lastTimestamp = lastTimestamp
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        self.indexFile.close()
+
+def _rowCount(path):
+    counts = []
+    for name, typecode in _COLUMNS:
+        filePath = os.path.join(path, _fileName(name, typecode))
+        if not os.path.exists(filePath):
+            return 0
+        counts.append(os.path.getsize(filePath) // array.array(typecode).itemsize)
+    return min(counts)
+
+def _readValue(path, name, row):
+    typecode = dict(_COLUMNS).get(name, INT64_TYPECODE)
+    values = array.array(typecode)
+    with open(os.path.join(path, _fileName(name, typecode)), "rb") as f:
+        f.seek(row * values.itemsize)
+        values.fromfile(f, 1)
+    return values[0]
+
+def _readColumn(path, name, typecode, start, stop):
+    # Return rows [start, stop) of a column: a slice of a memory map with
+    # NumPy, or an array.array otherwise.
+    filePath = os.path.join(path, _fileName(name, typecode))
+    if numpy is not None:
+        dtype = numpy.int8 if typecode == "b" else numpy.int64
+        if stop <= start:
+            return numpy.zeros(0, dtype=dtype)
+        itemsize = numpy.dtype(dtype).itemsize
+        with open(filePath, "rb") as f:
+            m = mmap.mmap(f.fileno(), stop * itemsize, access=mmap.ACCESS_READ)
+        return numpy.frombuffer(m, dtype=dtype, count=stop - start, offset=start * itemsize)
+
+    values = array.array(typecode)
+    if stop > start:
+        with open(filePath, "rb") as f:
+            f.seek(start * values.itemsize)
+            values.fromfile(f, stop - start)
+    return values
+
+class ColumnarTradeStore(object):
+    '''
+    Trade history store with the trade insert and retrieval methods of
+    MarketDatabase, kept in per-pair column files under directory (see the
+    module documentation).  As with MarketDatabase, trades that are
+    already stored are ignored; here that means any trade with a trade id
+    no greater than the highest stored for its pair.  A trade whose
+    timestamp is earlier than that of a trade with a lower id is stored
+    with the later timestamp, so that time ranges can be found by binary
+    search.
+
+    If fixedPoint is True, retrieveTradeHistory yields ScaledTrade objects
+    instead of btceapi Trade objects.  indexInterval is the number of trades
+    per sparse index entry, and must be the same every time a directory is
+    opened.  Any number of processes may read a directory, but only one
+    should write to it.
+    '''
+    def __init__(self, directory, all_pairs, fixedPoint=False, indexInterval=4096):
+        self.directory = directory
+        self.fixedPoint = fixedPoint
+        self.indexInterval = indexInterval
+        self.index_to_pair = dict(enumerate(all_pairs))
+        self.pair_to_index = dict((p, i) for i, p in self.index_to_pair.items())
+        self.index_to_tradetype = dict(enumerate(_TRADE_TYPES))
+        self.tradetype_to_index = dict((t, i) for i, t in self.index_to_tradetype.items())
+        self.writers = {}
+
+    def _pairPath(self, pair):
+        return os.path.join(self.directory, pair)
+
+    def _writer(self, pair):
+        writer = self.writers.get(pair)
+        if writer is None:
+            writer = self.writers[pair] = _PairWriter(self._pairPath(pair), self.indexInterval)
+        return writer
+
+    def tupleFromTrade(self, t):
+        if type(t) is ScaledTrade:
+            price, amount = t.scaledPrice, t.scaledAmount
+        else:
+            price, amount = toScaled(t.price), toScaled(t.amount)
+        # btceapi may parse the id and timestamp as Decimals.
+        return (int(t.tid),
+                self.pair_to_index[t.pair],
+                self.tradetype_to_index[t.type],
+                price,
+                amount,
+                int(t.timestamp))
+
+    def insertTradeHistory(self, trade_data):
+        '''
+        Append one or more trades, given in the same forms accepted by
+        MarketDatabase.insertTradeHistory, and return the number appended.
+        Trades no newer than the last one stored for their pair are
+        skipped.
+        '''
+        if type(trade_data) is not list:
+            trade_data = [trade_data]
+        if not trade_data:
+            return 0
+
+        if type(trade_data[0]) in (Trade, ScaledTrade):
+            trade_data = map(self.tupleFromTrade, trade_data)
+
+        byPair = {}
+        for tid, pair_index, trade_type, price, amount, timestamp in trade_data:
+            if not isinstance(price, (int, long)):
+                price, amount = toScaled(price), toScaled(amount)
+            byPair.setdefault(pair_index, []).append(
+                (tid, int(timestamp), price, amount, trade_type))
+
+        appended = 0
+        for pair_index, rows in byPair.items():
+            writer = self._writer(self.index_to_pair[pair_index])
+            rows.sort()
+            if writer.lastTid is not None:
+                rows = [r for r in rows if r[0] > writer.lastTid]
+            # Drop duplicates within the batch.
+            rows = [r for i, r in enumerate(rows) if i == 0 or r[0] != rows[i - 1][0]]
+            if rows:
+                writer.append(rows)
+                appended += len(rows)
+        return appended
+
+    def _rowRange(self, path, rows, start_date, end_date):
+        # Narrow down to whole blocks with the sparse index, then search
+        # the timestamps within the first and last blocks.
+        interval = self.indexInterval
+        blocks = min(rows // interval,
+                     os.path.getsize(os.path.join(path, _fileName(_INDEX, INT64_TYPECODE))) // 8)
+        index = _readColumn(path, _INDEX, INT64_TYPECODE, 0, blocks)
+
+        def search(value, right):
+            block = (bisect.bisect_right if right else bisect.bisect_left)(index, value)
+            lo = block * interval
+            # Trades after the last indexed block are all searched.
+            hi = rows if block == len(index) else lo + interval
+            timestamps = _readColumn(path, "timestamp", INT64_TYPECODE, lo, hi)
+            if right:
+                return lo + bisect.bisect_right(timestamps, value)
+            return lo + bisect.bisect_left(timestamps, value)
+
+        return search(start_date, False), search(end_date, True)
+
+    def retrieveTradeHistoryArrays(self, start_date, end_date, pair, batchSize=None):
+        '''
+        Retrieve the trades of the given pair with a timestamp in the range
+        [start_date, end_date] as a dictionary of columns, as described for
+        MarketDatabase.retrieveTradeHistoryArrays.  With NumPy, the columns
+        are read-only views of memory-mapped files.  batchSize is accepted
+        for compatibility, and ignored.
+        '''
+        self.flush()
+        path = self._pairPath(pair)
+        rows = _rowCount(path) if os.path.isdir(path) else 0
+        if rows:
+            start, stop = self._rowRange(path, rows, start_date, end_date)
+        else:
+            start = stop = 0
+        return dict((name, _readColumn(path, name, typecode, start, stop))
+                    for name, typecode in _COLUMNS)
+
+    def retrieveTradeHistory(self, start_date, end_date, pair, batchSize=10000):
+        '''
+        Yield a btceapi Trade (or a ScaledTrade, in fixed-point mode) for
+        each stored trade of the given pair with a timestamp in the range
+        [start_date, end_date], in timestamp order.
+        '''
+        columns = self.retrieveTradeHistoryArrays(start_date, end_date, pair)
+        tids, timestamps, prices, amounts, types = [columns[name] for name, tc in _COLUMNS]
+        for i in xrange(0, len(tids), batchSize):
+            j = i + batchSize
+            rows = zip(tids[i:j], timestamps[i:j], prices[i:j], amounts[i:j], types[i:j])
+            if self.fixedPoint:
+                for tid, timestamp, price, amount, trade_type in rows:
+                    yield ScaledTrade(pair, _TRADE_TYPES[trade_type], int(tid),
+                                      int(timestamp), int(price), int(amount))
+            else:
+                for tid, timestamp, price, amount, trade_type in rows:
+                    yield Trade(pair=pair,
+                                type=_TRADE_TYPES[trade_type],
+                                price=fromScaled(int(price)),
+                                tid=int(tid),
+                                amount=fromScaled(int(amount)),
+                                timestamp=int(timestamp))
+
+    def flush(self):
+        '''Appends are written through to the files as they are made, so
+        there is nothing to wait for; this is for compatibility with
+        MarketDatabase.'''
+        pass
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
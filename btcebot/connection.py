@@ -0,0 +1,90 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import contextlib
+import threading
+import time
+
+import btceapi
+
+class ConnectionPool(object):
+    '''
+    A thread-safe pool of persistent BTCEConnection objects.  Idle
+    connections are kept open between uses so that callers don't pay for
+    a new TCP/TLS handshake on every request.  A connection that raises
+    an exception while checked out is closed and dropped, so the next
+    caller gets a freshly opened one.
+
+    connectionFactory is called with the timeout to open each new
+    connection, and defaults to btceapi.BTCEConnection.
+    '''
+    def __init__(self, maxIdle=8, maxIdleSeconds=60.0, timeout=30,
+                 connectionFactory=None):
+        if connectionFactory is None:
+            connectionFactory = btceapi.BTCEConnection
+        self.connectionFactory = connectionFactory
+        self.maxIdle = maxIdle
+        self.maxIdleSeconds = maxIdleSeconds
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # (time last released, connection), most recently used last.
+        self.idle = []
+
+    def acquire(self):
+        '''Check out a connection, reusing an idle one if possible.'''
+        stale = []
+        conn = None
+        now = time.time()
+        with self.lock:
+            while self.idle:
+                released, c = self.idle.pop()
+                if now - released <= self.maxIdleSeconds:
+                    conn = c
+                    break
+                # The server has probably dropped this one, and everything
+                # older than it, so don't bother trying them.
+                stale.append(c)
+                stale.extend(c for r, c in self.idle)
+                del self.idle[:]
+
+        for c in stale:
+            self.discard(c)
+
+        if conn is None:
+            conn = self.connectionFactory(self.timeout)
+        return conn
+
+    def release(self, conn):
+        '''Return a healthy connection to the pool.'''
+        with self.lock:
+            if len(self.idle) < self.maxIdle:
+                self.idle.append((time.time(), conn))
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        '''Close a connection instead of returning it to the pool.'''
+        try:
+            conn.close()
+        except:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''Context manager that checks out a connection and returns it to
+        the pool afterwards, or discards it if an exception was raised.'''
+        conn = self.acquire()
+        try:
+            yield conn
+        except:
+            self.discard(conn)
+            raise
+        self.release(conn)
+
+    def close(self):
+        '''Close all idle connections.  The pool remains usable, and will
+        open new connections as they are needed.'''
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for released, conn in idle:
+            self.discard(conn)
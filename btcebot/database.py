@@ -1,29 +1,186 @@
 # Copyright (c) 2013-2017 CodeReclaimers, LLC
 
+import array
 import cPickle
 import datetime
 import decimal
 import os.path
+import Queue
 import sqlite3
+import threading
+import time
 
 import btceapi
 from btceapi.public import Trade
 
-# Add support for conversion to/from decimal
+import depthcodec
+from bars import Bar, BarBuilder
+from depthcodec import DepthLevels
+from fixedpoint import INT64_TYPECODE, ScaledTrade, fromScaled, toScaled, toScaledArrays
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Add support for conversion to/from decimal.  Prices and amounts written
+# by this module are converted explicitly (see tupleFromTrade), so these
+# are only used for Decimals passed in directly by callers.
 def adapt_decimal(d):
-    return int(d*decimal.Decimal("1e8"))
+    return toScaled(d)
 
 def convert_decimal(s):
-    return decimal.Decimal(s) * decimal.Decimal("1e-8")
+    return fromScaled(int(s))
 
 sqlite3.register_adapter(decimal.Decimal, adapt_decimal)
 sqlite3.register_converter("DECIMAL", convert_decimal)
 
+# Schema version stored in the database's user_version; see _migrate.
+SCHEMA_VERSION = 3
+
+# Values of the depth.encoding column.  Binary rows use the kind codes
+# from depthcodec.
+PICKLE_ENCODING = 0
+KEYFRAME_ENCODING = depthcodec.KEYFRAME
+DELTA_ENCODING = depthcodec.DELTA
+
+# Queue markers used by _BatchWriter.
+_FLUSH = object()
+_STOP = object()
+
+class _BatchWriter(threading.Thread):
+    '''
+    Background thread that owns its own connection to the database and
+    applies queued inserts in group commits: a commit happens once
+    batchSize inserts are pending, or batchInterval seconds after the
+    first uncommitted insert, whichever comes first.
+    '''
+    def __init__(self, database_path, batchSize, batchInterval, metrics=None):
+        threading.Thread.__init__(self, name="MarketDatabase writer")
+        self.daemon = True
+        self.database_path = database_path
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self.metrics = metrics
+        self.queue = Queue.Queue()
+        self.error = None
+
+    def put(self, sql, rows):
+        self.queue.put((sql, rows))
+
+    def flush(self):
+        '''Block until everything queued so far has been committed.'''
+        self.queue.put(_FLUSH)
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stop(self):
+        '''Commit everything queued and stop the thread, raising any
+        error it reported.'''
+        try:
+            self.flush()
+        finally:
+            self.queue.put(_STOP)
+            self.join()
+
+    def run(self):
+        try:
+            connection = sqlite3.connect(self.database_path)
+            # With WAL, NORMAL only syncs at checkpoints, which is still safe
+            # against corruption but much cheaper per commit.
+            connection.execute("PRAGMA synchronous=NORMAL")
+        except Exception, e:
+            # Keep draining the queue so flush() reports the error instead
+            # of waiting forever.
+            self.error = e
+            connection = None
+        uncommitted = 0
+        deadline = None
+        while True:
+            if deadline is None:
+                item = self.queue.get()
+            else:
+                try:
+                    item = self.queue.get(True, max(0.0, deadline - time.time()))
+                except Queue.Empty:
+                    # The batch window has elapsed.
+                    item = None
+
+            if item is not None:
+                uncommitted += 1
+                if item is not _FLUSH and item is not _STOP:
+                    sql, rows = item
+                    if connection is not None:
+                        try:
+                            connection.executemany(sql, rows)
+                        except Exception, e:
+                            self.error = e
+                    if deadline is None:
+                        deadline = time.time() + self.batchInterval
+                    if uncommitted < self.batchSize:
+                        continue
+
+            if connection is not None:
+                start = time.time()
+                try:
+                    connection.commit()
+                except Exception, e:
+                    self.error = e
+                if self.metrics is not None:
+                    self.metrics.observe("db_commit_seconds", time.time() - start)
+            deadline = None
+
+            # Only now is the queued data durable, so only now let a
+            # flush() waiting on the queue return.
+            for i in xrange(uncommitted):
+                self.queue.task_done()
+            uncommitted = 0
+
+            if item is _STOP:
+                break
+
+        if connection is not None:
+            connection.close()
+
 class MarketDatabase(object):
-    def __init__(self, database_path, all_pairs):
+    def __init__(self, database_path, all_pairs, writeBehind=False,
+                 batchSize=1000, batchInterval=1.0, depthEncoding="binary",
+                 depthKeyframeInterval=1, fixedPoint=False, metrics=None):
+        '''
+        If writeBehind is True, inserts are queued and written to the
+        database by a background thread in group commits of up to batchSize
+        inserts or batchInterval seconds, and the database is switched to
+        write-ahead logging.  Use flush() to wait for queued inserts to be
+        committed, and always close() the database to drain the queue.
+
+        depthEncoding selects how depth snapshots are stored: "binary"
+        (see depthcodec) or "pickle" (the format used by older versions).
+        With binary encoding and a depthKeyframeInterval greater than 1,
+        snapshots are stored as deltas against the most recent full
+        snapshot (keyframe) of the same pair, with a new keyframe at least
+        every depthKeyframeInterval snapshots.
+
+        If fixedPoint is True, retrieveTradeHistory yields ScaledTrade
+        objects built directly from the stored fixed-point integers,
+        instead of btceapi Trade objects with Decimal prices and amounts.
+
+        If metrics is given (for example, a Bot's metrics), commit times
+        are recorded in it, along with the depth of the write-behind queue.
+        '''
+        if depthEncoding not in ("binary", "pickle"):
+            raise Exception("Unknown depth encoding: %r" % depthEncoding)
+
         create = not os.path.isfile(database_path)
         self.connection = sqlite3.connect(database_path)
         self.cursor = self.connection.cursor()
+        self.writer = None
+        self.depthEncoding = depthEncoding
+        self.depthKeyframeInterval = depthKeyframeInterval
+        self.depthKeyframes = {}
+        self.fixedPoint = fixedPoint
+        self.metrics = metrics
         if create:
             # The database is new, so create tables and populate the enumerations.
             self.createTables()
@@ -52,6 +209,17 @@ class MarketDatabase(object):
             self.cursor.execute("SELECT id, name from trade_types")
             self.index_to_tradetype = dict(self.cursor.fetchall())
             self.tradetype_to_index = dict((p, i) for i, p in self.index_to_tradetype.items())
+
+            self._migrate()
+
+        if writeBehind:
+            # WAL lets the writer thread commit while other connections
+            # read, and makes each commit an append instead of a rewrite.
+            self.cursor.execute("PRAGMA journal_mode=WAL").fetchall()
+            self.writer = _BatchWriter(database_path, batchSize, batchInterval, metrics)
+            self.writer.start()
+            if metrics is not None:
+                metrics.setGauge("db_write_queue_depth", self.queueDepth)
     
     def createTables(self):
         self.cursor.execute('''
@@ -84,79 +252,476 @@ class MarketDatabase(object):
                 pair INT,
                 asks BLOB,
                 bids BLOB,
+                encoding INT DEFAULT 0,
                 FOREIGN KEY(pair) REFERENCES pairs(id)
             );''')
-        
+
+        self.createIndexes()
+        self.createBarTable()
+
+        self.cursor.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
         self.connection.commit()    
+
+    def createBarTable(self):
+        # Rollups of trade_history at each bar resolution (in seconds).
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bars(
+                pair INT,
+                resolution INT,
+                start INT,
+                open DECIMAL,
+                high DECIMAL,
+                low DECIMAL,
+                close DECIMAL,
+                volume DECIMAL,
+                trades INT,
+                PRIMARY KEY(pair, resolution, start),
+                FOREIGN KEY(pair) REFERENCES pairs(id)
+            );''')
+
+    def createIndexes(self):
+        # All retrieval is by pair over a time range.
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS trade_history_pair_timestamp
+                ON trade_history(pair, timestamp);''')
+
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS depth_pair_timestamp
+                ON depth(pair, timestamp);''')
+
+    def _migrate(self):
+        '''Bring the schema of a database created by an older version up to
+        date.'''
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            # Depth rows record how their asks and bids are encoded;
+            # existing rows are pickled.
+            self.cursor.execute("ALTER TABLE depth ADD COLUMN encoding INT DEFAULT 0")
+
+        if version < 2:
+            # This may take a while on a large database, but only happens once.
+            self.createIndexes()
+
+        if version < 3:
+            # Existing trades can be rolled up with backfillBars.
+            self.createBarTable()
+
+        self.cursor.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.connection.commit()
     
+    def flush(self):
+        '''Wait until all queued inserts have been committed.  Has no
+        effect unless the database was opened in write-behind mode.'''
+        if self.writer is not None:
+            self.writer.flush()
+
+    def queueDepth(self):
+        '''Return the number of inserts waiting for the write-behind
+        thread.'''
+        writer = self.writer
+        if writer is None:
+            return 0
+        return writer.queue.qsize()
+
     def close(self):
-        self.cursor = None
-        if self.connection is not None:
-            self.connection.close()
-            self.connection = None
+        try:
+            if self.writer is not None:
+                writer, self.writer = self.writer, None
+                writer.stop()
+        finally:
+            self.cursor = None
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
     
+    def _iterRows(self, sql, parameters, batchSize):
+        # Use a cursor of our own so that several retrievals can be in
+        # progress at once, and fetch rows in batches to limit the number
+        # of round trips into the sqlite library.
+        cursor = self.connection.cursor()
+        cursor.arraysize = batchSize
+        cursor.execute(sql, parameters)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def _write(self, sql, rows):
+        if self.writer is not None:
+            self.writer.put(sql, rows)
+        else:
+            self.cursor.executemany(sql, rows)
+            start = time.time()
+            self.connection.commit()
+            if self.metrics is not None:
+                self.metrics.observe("db_commit_seconds", time.time() - start)
+
     def tupleFromTrade(self, t):
-        return (t.tid,
+        if type(t) is ScaledTrade:
+            price, amount = t.scaledPrice, t.scaledAmount
+        else:
+            price, amount = toScaled(t.price), toScaled(t.amount)
+        # btceapi parses numbers as Decimals, which would otherwise be
+        # stored through the Decimal adapter.
+        return (int(t.tid),
                 self.pair_to_index[t.pair],
                 self.tradetype_to_index[t.type],
-                t.price,
-                t.amount,
-                t.timestamp)
+                price,
+                amount,
+                int(t.timestamp))
     
     def insertTradeHistory(self, trade_data):
         '''
         Add one or more trades to the trade history store.  If trade_data is a
         list, then it is assumed to be a list of multiple trades; if it is a tuple,
-        or a btceapi.Trade object, it is assumed to represent a single trade.
-        Tuples should be (trade id, pair id, trade type id, price, amount, date).
+        a btceapi.Trade or a ScaledTrade object, it is assumed to represent a
+        single trade.  Tuples should be (trade id, pair id, trade type id, price,
+        amount, date), where price and amount are Decimals or fixed-point
+        integers.
         '''
         if type(trade_data) is not list:
             trade_data = [trade_data]
             
-        if type(trade_data[0]) is Trade:
+        if type(trade_data[0]) in (Trade, ScaledTrade):
             trade_data = map(self.tupleFromTrade, trade_data)
 
-        self.cursor.executemany("INSERT OR IGNORE INTO trade_history VALUES(?, ?, ?, ?, ?, ?)", trade_data)
-        self.connection.commit()
+        self._write("INSERT OR IGNORE INTO trade_history VALUES(?, ?, ?, ?, ?, ?)", trade_data)
         
-    def retrieveTradeHistory(self, start_date, end_date, pair):
-        vars = ("tid", "trade_type", "price", "amount", "date", "pair", "trade_type")
+    def retrieveTradeHistory(self, start_date, end_date, pair, batchSize=1000):
+        '''
+        Yield a btceapi Trade (or a ScaledTrade, in fixed-point mode) for
+        each stored trade of the given pair with a timestamp in the range
+        [start_date, end_date], in timestamp order.
+        '''
+        self.flush()
+        pair_index = self.pair_to_index[pair]
+        index_to_tradetype = self.index_to_tradetype
+        sql = """select tid, trade_type, price, amount, timestamp
+           from trade_history
+           where pair == ? and timestamp >= ?
+               and timestamp <= ?
+           order by timestamp"""
+
+        rows = self._iterRows(sql, (pair_index, start_date, end_date), batchSize)
+        if self.fixedPoint:
+            for tid, trade_type, price, amount, timestamp in rows:
+                yield ScaledTrade(pair, index_to_tradetype[trade_type], tid,
+                                  timestamp, price, amount)
+            return
+
+        for tid, trade_type, price, amount, timestamp in rows:
+            yield Trade(pair=pair,
+                        type=index_to_tradetype[trade_type],
+                        price=fromScaled(price),
+                        tid=tid,
+                        amount=fromScaled(amount),
+                        timestamp=timestamp)
+
+    def retrieveTradeTuples(self, start_date, end_date, pair, batchSize=10000):
+        '''
+        Yield each stored trade of the given pair with a timestamp in the
+        range [start_date, end_date] as a (tid, pair index, trade type
+        index, price, amount, timestamp) tuple, the form accepted by
+        insertTradeHistory, with fixed-point prices and amounts.  Trades
+        come in trade id order, for copying into stores that are appended
+        to in that order, such as ColumnarTradeStore.
+        '''
+        self.flush()
         pair_index = self.pair_to_index[pair]
-        sql = """select tid, trade_type, price, amount, date, pairs.name, trade_types.name
-           from trade_history, pairs, trade_types
-           where pair == ? and date >= ?
-               and date <= ?
-               and trade_history.pair == pairs.id
-               and trade_history.trade_type == trade_types.id
-           order by date"""
-
-        for row in self.cursor.execute(sql, (pair_index, start_date, end_date)):
-            row = dict(zip(vars, row))
-            yield Trade(**row)
+        sql = """select tid, pair, trade_type, price, amount, timestamp
+           from trade_history
+           where pair == ? and timestamp >= ?
+               and timestamp <= ?
+           order by tid"""
+        return self._iterRows(sql, (pair_index, start_date, end_date), batchSize)
+
+    def retrieveTradeHistoryArrays(self, start_date, end_date, pair, batchSize=10000):
+        '''
+        Retrieve the same trades as retrieveTradeHistory, but as a dictionary
+        of columns: "tid", "timestamp", "price", "amount" and "type".  Prices
+        and amounts are fixed-point integers (see fixedpoint.SCALE), and type
+        is the trade type index (see tradetype_to_index).  The columns are
+        NumPy arrays if NumPy is installed, and array.array objects
+        otherwise.
+        '''
+        self.flush()
+        pair_index = self.pair_to_index[pair]
+        sql = """select tid, timestamp, price, amount, trade_type
+           from trade_history
+           where pair == ? and timestamp >= ?
+               and timestamp <= ?
+           order by timestamp"""
+
+        names = ("tid", "timestamp", "price", "amount", "type")
+        typecodes = (INT64_TYPECODE,) * 4 + ("b",)
+        columns = [array.array(tc) for tc in typecodes]
+
+        cursor = self.connection.cursor()
+        cursor.execute(sql, (pair_index, start_date, end_date))
+        while True:
+            rows = cursor.fetchmany(batchSize)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+
+        if numpy is not None:
+            dtypes = (numpy.int64,) * 4 + (numpy.int8,)
+            columns = [numpy.frombuffer(c, dtype=dt) for c, dt in zip(columns, dtypes)]
+
+        return dict(zip(names, columns))
+
+    def insertBars(self, bars):
+        '''Store Bar objects, replacing any stored bars for the same pair,
+        resolution and start time.'''
+        rows = [(self.pair_to_index[b.pair], b.resolution, b.start, b.scaledOpen,
+                 b.scaledHigh, b.scaledLow, b.scaledClose, b.scaledVolume, b.trades)
+                for b in bars]
+        if rows:
+            self._write("INSERT OR REPLACE INTO bars VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def retrieveBars(self, start_date, end_date, pair, resolution, batchSize=1000):
+        '''
+        Yield the stored Bar objects for the given pair and resolution (in
+        seconds) that start in the range [start_date, end_date], in time
+        order.
+        '''
+        self.flush()
+        sql = """select start, open, high, low, close, volume, trades
+           from bars
+           where pair == ? and resolution == ? and start >= ?
+               and start <= ?
+           order by start"""
+
+        rows = self._iterRows(sql, (self.pair_to_index[pair], resolution,
+                                    start_date, end_date), batchSize)
+        for row in rows:
+            yield Bar(pair, resolution, *row)
+
+    def backfillBars(self, start_date, end_date, pair, resolutions):
+        '''Roll up the stored trades of pair in [start_date, end_date] into
+        bars at the given resolutions (in seconds) and store them, for
+        history recorded before bars were being stored.  Returns the number
+        of bars stored.'''
+        # Only the last completed bar is needed to recognize late trades.
+        builder = BarBuilder(resolutions, maxBars=1)
+        count = 0
+        trades = []
+        for trade in self.retrieveTradeHistory(start_date, end_date, pair):
+            trades.append(trade)
+            if len(trades) >= 10000:
+                bars = builder.add(pair, trades)
+                self.insertBars(bars)
+                count += len(bars)
+                trades = []
+
+        # Bars still in progress at the end of the range are stored too;
+        # they are replaced once they are complete.
+        bars = builder.add(pair, trades) + builder.current.values()
+        self.insertBars(bars)
+        return count + len(bars)
+
+    def _encodeDepth(self, pair, asks, bids):
+        askPrices, askAmounts = toScaledArrays(asks)
+        bidPrices, bidAmounts = toScaledArrays(bids)
+
+        keyframe = self.depthKeyframes.get(pair)
+        if keyframe is not None and keyframe[0] < self.depthKeyframeInterval:
+            count, keyAskPrices, keyAskAmounts, keyBidPrices, keyBidAmounts = keyframe
+            askBlob = depthcodec.encodeDelta(askPrices, askAmounts,
+                                             keyAskPrices, keyAskAmounts, False)
+            bidBlob = depthcodec.encodeDelta(bidPrices, bidAmounts,
+                                             keyBidPrices, keyBidAmounts, True)
+            if askBlob is not None and bidBlob is not None:
+                self.depthKeyframes[pair] = (count + 1,) + keyframe[1:]
+                return DELTA_ENCODING, askBlob, bidBlob
+
+        # Deltas are only ever written against a keyframe written by this
+        # object, so a reader always finds the right keyframe by looking
+        # for the most recent one before the delta.
+        self.depthKeyframes[pair] = (1, askPrices, askAmounts, bidPrices, bidAmounts)
+        return (KEYFRAME_ENCODING,
+                depthcodec.encodeKeyframe(askPrices, askAmounts, False),
+                depthcodec.encodeKeyframe(bidPrices, bidAmounts, True))
 
     def insertDepth(self, dt, pair, asks, bids):
+        if self.depthEncoding == "pickle":
+            encoding, asks, bids = PICKLE_ENCODING, cPickle.dumps(asks), cPickle.dumps(bids)
+        else:
+            encoding, asks, bids = self._encodeDepth(pair, asks, bids)
+            asks = sqlite3.Binary(asks)
+            bids = sqlite3.Binary(bids)
+
         depth_data = (dt,
                       self.pair_to_index[pair],
-                      cPickle.dumps(asks),
-                      cPickle.dumps(bids))
-        self.cursor.execute("INSERT INTO depth VALUES(?, ?, ?, ?)", depth_data)
-        self.connection.commit()
+                      asks,
+                      bids,
+                      encoding)
+        self._write("INSERT INTO depth(timestamp, pair, asks, bids, encoding) VALUES(?, ?, ?, ?, ?)",
+                    [depth_data])
 
-    def retrieveDepth(self, start_date, end_date, pair):
+    def _depthKeyframeBefore(self, pair_index, timestamp):
+        sql = """select asks, bids
+                 from depth
+                 where pair == ?
+                     and timestamp < ?
+                     and encoding == ?
+                 order by timestamp desc
+                 limit 1"""
+        row = self.connection.execute(sql, (pair_index, timestamp, KEYFRAME_ENCODING)).fetchone()
+        if row is None:
+            raise Exception("Missing depth keyframe before %s" % timestamp)
+        asks, bids = row
+        return DepthLevels(str(asks)), DepthLevels(str(bids))
+
+    def retrieveDepth(self, start_date, end_date, pair, batchSize=1000):
+        '''
+        Yield (datetime, asks, bids) for each stored depth snapshot of the
+        given pair in the date range.  asks and bids are DepthLevels
+        objects, which are only decoded when they are first used.
+        '''
+        self.flush()
         pair_index = self.pair_to_index[pair]
-        sql = """select date, asks, bids
-                 from depth, pairs
+        sql = """select timestamp, asks, bids, encoding
+                 from depth
                  where pair == ? 
-                     and date >= ?
-                     and date <= ?
-                     and depth.pair == pairs.id
-                 order by date"""
-
-        depth = []               
-        for d, asks, bids in self.cursor.execute(sql, (pair_index, start_date, end_date)):
-            dt, frac = d.split(".")
+                     and timestamp >= ?
+                     and timestamp <= ?
+                 order by timestamp"""
+
+        keyAsks = keyBids = None
+        for d, asks, bids, encoding in \
+                self._iterRows(sql, (pair_index, start_date, end_date), batchSize):
+            if encoding == DELTA_ENCODING:
+                if keyAsks is None:
+                    keyAsks, keyBids = self._depthKeyframeBefore(pair_index, d)
+                asks = DepthLevels(str(asks), keyAsks)
+                bids = DepthLevels(str(bids), keyBids)
+            else:
+                asks = DepthLevels(str(asks))
+                bids = DepthLevels(str(bids))
+                if encoding == KEYFRAME_ENCODING:
+                    keyAsks, keyBids = asks, bids
+
+            dt = d.split(".")[0]
             # TODO: refactor this somewhere
             d = datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
-            asks = cPickle.loads(str(asks))
-            bids = cPickle.loads(str(bids))
             yield d, asks, bids
+
+    def retrieveLatestDepth(self, pair, start_date=None):
+        '''
+        Return (datetime, asks, bids) for the most recent stored depth
+        snapshot of the given pair, or None if there is none (or none at
+        or after start_date, if it is given).
+        '''
+        self.flush()
+        pair_index = self.pair_to_index[pair]
+        sql = """select timestamp, asks, bids, encoding
+                 from depth
+                 where pair == ?
+                     and timestamp >= ?
+                 order by timestamp desc
+                 limit 1"""
+        if start_date is None:
+            start_date = datetime.datetime.min
+        row = self.connection.execute(sql, (pair_index, start_date)).fetchone()
+        if row is None:
+            return None
+
+        d, asks, bids, encoding = row
+        if encoding == DELTA_ENCODING:
+            keyAsks, keyBids = self._depthKeyframeBefore(pair_index, d)
+            asks = DepthLevels(str(asks), keyAsks)
+            bids = DepthLevels(str(bids), keyBids)
+        else:
+            asks = DepthLevels(str(asks))
+            bids = DepthLevels(str(bids))
+
+        dt = d.split(".")[0]
+        d = datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
+        return d, asks, bids
+
+    def downsampleDepth(self, interval_seconds, pairs=None):
+        '''
+        Thin out stored depth, keeping only the first snapshot of each pair
+        in every interval_seconds, rewritten as keyframes.  Space is only
+        returned to the file system by vacuum().  Returns the number of
+        snapshots kept.
+        '''
+        self.flush()
+        if pairs is None:
+            pairs = self.pair_to_index.keys()
+        kept = 0
+        for pair in pairs:
+            rows = []
+            lastBucket = None
+            for d, asks, bids in self.retrieveDepth(datetime.datetime.min,
+                                                    datetime.datetime.max, pair):
+                bucket = int(time.mktime(d.timetuple())) // interval_seconds
+                if bucket == lastBucket:
+                    continue
+                lastBucket = bucket
+                askPrices, askAmounts = asks.arrays()
+                bidPrices, bidAmounts = bids.arrays()
+                rows.append((d, self.pair_to_index[pair],
+                             sqlite3.Binary(depthcodec.encodeKeyframe(askPrices, askAmounts, False)),
+                             sqlite3.Binary(depthcodec.encodeKeyframe(bidPrices, bidAmounts, True)),
+                             KEYFRAME_ENCODING))
+
+            self.connection.execute("DELETE FROM depth WHERE pair == ?", (self.pair_to_index[pair],))
+            self.connection.executemany(
+                "INSERT INTO depth(timestamp, pair, asks, bids, encoding) VALUES(?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+            # Later inserts must not be written as deltas against a
+            # keyframe that may have just been removed.
+            self.depthKeyframes.pop(pair, None)
+            kept += len(rows)
+        return kept
+
+    def deleteDepth(self):
+        '''Delete all stored depth snapshots.'''
+        self.flush()
+        self.connection.execute("DELETE FROM depth")
+        self.connection.commit()
+        self.depthKeyframes.clear()
+
+    def vacuum(self):
+        '''Rebuild the database file to return unused space.  This blocks
+        other connections until it is done.'''
+        self.flush()
+        self.connection.execute("VACUUM")
+
+    def migrateDepthEncoding(self, batchSize=1000):
+        '''
+        Rewrite depth snapshots stored as pickled lists by older versions
+        as binary keyframes.  Pickled rows are readable without this, but
+        are larger and slower to decode.  Returns the number of rows
+        converted.
+        '''
+        self.flush()
+        select = "select rowid, asks, bids from depth where encoding == ? limit ?"
+        update = "update depth set asks = ?, bids = ?, encoding = ? where rowid == ?"
+        converted = 0
+        while True:
+            rows = self.connection.execute(select, (PICKLE_ENCODING, batchSize)).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for rowid, asks, bids in rows:
+                askPrices, askAmounts = toScaledArrays(cPickle.loads(str(asks)))
+                bidPrices, bidAmounts = toScaledArrays(cPickle.loads(str(bids)))
+                updates.append((sqlite3.Binary(depthcodec.encodeKeyframe(askPrices, askAmounts, False)),
+                                sqlite3.Binary(depthcodec.encodeKeyframe(bidPrices, bidAmounts, True)),
+                                KEYFRAME_ENCODING,
+                                rowid))
+            self.connection.executemany(update, updates)
+            self.connection.commit()
+            converted += len(rows)
+
+        return converted
@@ -0,0 +1,71 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import heapq
+import operator
+
+_byTid = operator.attrgetter("tid")
+
+class TidWindow(object):
+    '''
+    Remembers which trade ids of a single pair have been seen, in constant
+    memory.  Since trade ids increase monotonically, only the most recent
+    size ids are kept; any id no greater than the oldest one forgotten is
+    treated as already seen.  Ids that arrive late but within the window
+    are still accepted once each.
+    '''
+    def __init__(self, size=1000):
+        self.size = size
+        self.tids = set()
+        self.heap = []
+        self.floor = None
+        self.highWater = None
+
+    def add(self, tid):
+        '''Record tid, and return True if it had not been seen before.'''
+        if self.floor is not None and tid <= self.floor:
+            return False
+        if tid in self.tids:
+            return False
+        self.tids.add(tid)
+        heapq.heappush(self.heap, tid)
+        if len(self.heap) > self.size:
+            self.floor = heapq.heappop(self.heap)
+            self.tids.discard(self.floor)
+        if self.highWater is None or tid > self.highWater:
+            self.highWater = tid
+        return True
+
+    def filter(self, trades):
+        '''Record the trades, and return those not seen before as a list
+        sorted by trade id.'''
+        newTrades = []
+        for t in sorted(trades, key=_byTid):
+            if self.add(t.tid):
+                newTrades.append(t)
+        return newTrades
+
+class TradeDeduplicator(object):
+    '''
+    Keeps a TidWindow for each pair, so that trades fetched repeatedly can
+    be reduced to the ones not seen before.
+    '''
+    def __init__(self, size=1000):
+        self.size = size
+        self.windows = {}
+
+    def window(self, pair):
+        w = self.windows.get(pair)
+        if w is None:
+            w = self.windows[pair] = TidWindow(self.size)
+        return w
+
+    def filter(self, pair, trades):
+        '''Return the trades for pair not seen before, sorted by trade id.'''
+        return self.window(pair).filter(trades)
+
+    def highWater(self, pair):
+        '''Return the highest trade id seen for pair, or None.'''
+        w = self.windows.get(pair)
+        if w is None:
+            return None
+        return w.highWater
@@ -0,0 +1,207 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Compact binary encoding for one side of a depth snapshot.
+
+Each encoded blob starts with a fixed header:
+
+    magic      2 bytes   "BD"
+    version    1 byte    FORMAT_VERSION
+    kind       1 byte    KEYFRAME or DELTA
+    flags      1 byte    bit 0 set if prices are in descending order
+    count      4 bytes   number of levels (little-endian)
+
+followed by count little-endian int64 prices and then count int64 amounts,
+all as fixed-point integers (see fixedpoint.SCALE).
+
+A keyframe holds the complete side of the book.  A delta holds only the
+levels that differ from the most recent keyframe for the same pair, with
+an amount of -1 marking a level that has been removed.
+'''
+
+import array
+import collections
+import cPickle
+import struct
+import sys
+
+from fixedpoint import INT64_TYPECODE, fromScaledArrays, toScaledArrays
+
+FORMAT_VERSION = 1
+KEYFRAME = 1
+DELTA = 2
+
+_MAGIC = "BD"
+_HEADER = struct.Struct("<2sBBBI")
+_REMOVED = -1
+_BIG_ENDIAN = sys.byteorder == "big"
+
+def _newArray():
+    return array.array(INT64_TYPECODE)
+
+def _pack(kind, descending, prices, amounts):
+    header = _HEADER.pack(_MAGIC, FORMAT_VERSION, kind, int(descending), len(prices))
+    if _BIG_ENDIAN:
+        prices = array.array(INT64_TYPECODE, prices)
+        amounts = array.array(INT64_TYPECODE, amounts)
+        prices.byteswap()
+        amounts.byteswap()
+    return header + prices.tostring() + amounts.tostring()
+
+def isBinary(blob):
+    return blob[:2] == _MAGIC
+
+def blobKind(blob):
+    magic, version, kind, flags, count = _HEADER.unpack_from(blob)
+    return kind
+
+def encodeKeyframe(prices, amounts, descending):
+    return _pack(KEYFRAME, descending, prices, amounts)
+
+def encodeDelta(prices, amounts, keyPrices, keyAmounts, descending):
+    '''Encode the levels in prices/amounts relative to the keyframe
+    keyPrices/keyAmounts.  Returns None if the delta would not be
+    smaller than a keyframe.'''
+    outPrices = _newArray()
+    outAmounts = _newArray()
+    i = j = 0
+    nKey = len(keyPrices)
+    nNew = len(prices)
+    while i < nKey and j < nNew:
+        pk = keyPrices[i]
+        pn = prices[j]
+        if pk == pn:
+            if keyAmounts[i] != amounts[j]:
+                outPrices.append(pn)
+                outAmounts.append(amounts[j])
+            i += 1
+            j += 1
+        elif (pk < pn) != descending:
+            outPrices.append(pk)
+            outAmounts.append(_REMOVED)
+            i += 1
+        else:
+            outPrices.append(pn)
+            outAmounts.append(amounts[j])
+            j += 1
+
+    for i in xrange(i, nKey):
+        outPrices.append(keyPrices[i])
+        outAmounts.append(_REMOVED)
+    outPrices.extend(prices[j:])
+    outAmounts.extend(amounts[j:])
+
+    if len(outPrices) >= nNew:
+        return None
+    return _pack(DELTA, descending, outPrices, outAmounts)
+
+def _applyDelta(keyPrices, keyAmounts, deltaPrices, deltaAmounts, descending):
+    prices = _newArray()
+    amounts = _newArray()
+    i = j = 0
+    nKey = len(keyPrices)
+    nDelta = len(deltaPrices)
+    while i < nKey and j < nDelta:
+        pk = keyPrices[i]
+        pd = deltaPrices[j]
+        if pk == pd:
+            if deltaAmounts[j] != _REMOVED:
+                prices.append(pd)
+                amounts.append(deltaAmounts[j])
+            i += 1
+            j += 1
+        elif (pk < pd) != descending:
+            prices.append(pk)
+            amounts.append(keyAmounts[i])
+            i += 1
+        else:
+            if deltaAmounts[j] != _REMOVED:
+                prices.append(pd)
+                amounts.append(deltaAmounts[j])
+            j += 1
+
+    prices.extend(keyPrices[i:])
+    amounts.extend(keyAmounts[i:])
+    for j in xrange(j, nDelta):
+        if deltaAmounts[j] != _REMOVED:
+            prices.append(deltaPrices[j])
+            amounts.append(deltaAmounts[j])
+    return prices, amounts
+
+def decode(blob, keyframe=None):
+    '''Decode a blob into a pair of (prices, amounts) arrays.  If the blob
+    is a delta, keyframe must be the decoded (prices, amounts) arrays of
+    the keyframe it was encoded against.'''
+    magic, version, kind, flags, count = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Unsupported depth encoding (version %r)" % version)
+
+    start = _HEADER.size
+    middle = start + 8 * count
+    prices = _newArray()
+    amounts = _newArray()
+    prices.fromstring(blob[start:middle])
+    amounts.fromstring(blob[middle:middle + 8 * count])
+    if _BIG_ENDIAN:
+        prices.byteswap()
+        amounts.byteswap()
+
+    if kind == DELTA:
+        if keyframe is None:
+            raise ValueError("Depth delta can't be decoded without its keyframe")
+        keyPrices, keyAmounts = keyframe
+        return _applyDelta(keyPrices, keyAmounts, prices, amounts, bool(flags & 1))
+    return prices, amounts
+
+class DepthLevels(collections.Sequence):
+    '''
+    Read-only list of (price, amount) tuples for one side of a stored
+    depth snapshot, which is only decoded when it is first accessed.  Use
+    arrays() to get the fixed-point price and amount arrays without
+    creating any Decimal objects.  Rows written by older versions as
+    pickled lists are also accepted.
+    '''
+    def __init__(self, blob, keyframe=None):
+        self._blob = blob
+        self._keyframe = keyframe
+        self._arrays = None
+        self._levels = None
+
+    def arrays(self):
+        if self._arrays is None:
+            blob = self._blob
+            if isBinary(blob):
+                keyframe = None
+                if self._keyframe is not None:
+                    keyframe = self._keyframe.arrays()
+                self._arrays = decode(blob, keyframe)
+            else:
+                self._levels = cPickle.loads(blob)
+                self._arrays = toScaledArrays(self._levels)
+            self._blob = self._keyframe = None
+        return self._arrays
+
+    def levels(self):
+        if self._levels is None:
+            self._levels = fromScaledArrays(*self.arrays())
+        return self._levels
+
+    def __getitem__(self, index):
+        return self.levels()[index]
+
+    def __len__(self):
+        if self._levels is not None:
+            return len(self._levels)
+        return len(self.arrays()[0])
+
+    def __iter__(self):
+        return iter(self.levels())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.levels())
@@ -0,0 +1,78 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import array
+import decimal
+
+# Prices and amounts are stored as integer multiples of 1e-8, which is
+# the finest precision used by the exchange.
+SCALE = 100000000
+_DECIMAL_SCALE = decimal.Decimal(SCALE)
+
+# array.array typecode for 64-bit signed integers ('q' isn't available
+# in Python 2, but 'l' is 64 bits on most 64-bit platforms).
+INT64_TYPECODE = None
+for _tc in ("q", "l"):
+    try:
+        if array.array(_tc).itemsize == 8:
+            INT64_TYPECODE = _tc
+            break
+    except ValueError:
+        pass
+if INT64_TYPECODE is None:
+    raise ImportError("No 64-bit integer array type available on this platform")
+
+def toScaled(d):
+    return int(d * _DECIMAL_SCALE)
+
+def fromScaled(n):
+    return decimal.Decimal(n).scaleb(-8)
+
+def toScaledArrays(levels):
+    '''Convert a list of (price, amount) tuples into a pair of parallel
+    arrays of fixed-point integers.'''
+    if hasattr(levels, "arrays"):
+        # Already stored as fixed-point arrays (e.g. depthcodec.DepthLevels).
+        return levels.arrays()
+    prices = array.array(INT64_TYPECODE, [toScaled(p) for p, a in levels])
+    amounts = array.array(INT64_TYPECODE, [toScaled(a) for p, a in levels])
+    return prices, amounts
+
+def fromScaledArrays(prices, amounts):
+    '''Inverse of toScaledArrays.'''
+    return zip(map(fromScaled, prices), map(fromScaled, amounts))
+
+class ScaledTrade(object):
+    '''
+    Compact stand-in for btceapi's Trade, which keeps price and amount as
+    fixed-point integers (scaledPrice and scaledAmount) and the timestamp
+    as an integer.  The price and amount attributes still return Decimals,
+    but they are only created when a trader actually asks for them.
+    '''
+    __slots__ = ('pair', 'type', 'tid', 'timestamp', 'scaledPrice', 'scaledAmount')
+
+    def __init__(self, pair, type, tid, timestamp, scaledPrice, scaledAmount):
+        self.pair = pair
+        self.type = type
+        self.tid = tid
+        self.timestamp = timestamp
+        self.scaledPrice = scaledPrice
+        self.scaledAmount = scaledAmount
+
+    @classmethod
+    def fromTrade(cls, t):
+        if type(t) is cls:
+            return t
+        return cls(t.pair, t.type, t.tid, int(t.timestamp),
+                   toScaled(t.price), toScaled(t.amount))
+
+    @property
+    def price(self):
+        return fromScaled(self.scaledPrice)
+
+    @property
+    def amount(self):
+        return fromScaled(self.scaledAmount)
+
+    def __repr__(self):
+        return "ScaledTrade(pair=%r, type=%r, tid=%r, timestamp=%r, price=%s, amount=%s)" % (
+            self.pair, self.type, self.tid, self.timestamp, self.price, self.amount)
@@ -0,0 +1,162 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import collections
+import threading
+import time
+import traceback
+
+from tradebuffer import TradeView
+
+def _latest(old, new):
+    return new
+
+def _appendTrades(old, new):
+    # Deliver every new trade, with the time of the latest update.
+    t, p, oldTrades = old
+    t, p, newTrades = new
+    return (t, p, oldTrades + newTrades)
+
+class TraderLane(threading.Thread):
+    '''
+    Runs one trader's handlers on a thread of its own, so that a slow or
+    blocking trader doesn't hold up market data for the others.  The bot
+    thread only queues events; this thread delivers them in order.
+
+    Events that describe the current state of the market (depth, full
+    trade history, snapshots and loop ends) are coalesced: if the trader hasn't
+    caught up with the previous one for the same pair, it is replaced by
+    the latest.  New trades for a pair are appended to any that are still
+    pending, so none are missed.  Depth changes and bars can't be merged,
+    and at most maxPending of them are queued; beyond that they are
+    dropped and counted in self.dropped.
+    '''
+    def __init__(self, bot, trader, name, maxPending=100):
+        threading.Thread.__init__(self, name="TraderLane %s" % name)
+        self.daemon = True
+        self.bot = bot
+        self.trader = trader
+        self.laneName = name
+        self.maxPending = maxPending
+        self.cond = threading.Condition()
+        # Entries of (key, handler, args, errorHandler, time queued).  For
+        # coalesced events the args are kept in self.latest instead.
+        self.pending = collections.deque()
+        self.latest = {}
+        self.unkeyed = 0
+        self.stopping = False
+        self.coalesced = 0
+        self.dropped = 0
+
+        labels = (("trader", name),)
+        metrics = bot.metrics
+        self.waitHistogram = metrics.histogram("trader_wait_seconds", labels)
+        metrics.setGauge("trader_queue_depth", lambda: len(self.pending), labels)
+        metrics.setGauge("trader_lag_seconds", self.lag, labels)
+        metrics.setGauge("trader_coalesced", lambda: self.coalesced, labels)
+        metrics.setGauge("trader_dropped", lambda: self.dropped, labels)
+
+    def submit(self, key, handler, args, errorHandler, combine=_latest):
+        '''Queue a call of handler(*args).  Events with the same key that
+        are still pending are merged with combine(oldArgs, newArgs); a key
+        of None means the event is never merged.'''
+        with self.cond:
+            if key is None:
+                if self.unkeyed >= self.maxPending:
+                    self.dropped += 1
+                    return
+                self.unkeyed += 1
+                self.pending.append((None, handler, args, errorHandler, time.time()))
+            elif key in self.latest:
+                self.latest[key] = combine(self.latest[key], args)
+                self.coalesced += 1
+                return
+            else:
+                self.latest[key] = args
+                self.pending.append((key, handler, None, errorHandler, time.time()))
+            self.cond.notify()
+
+    def lag(self):
+        '''Return how long the oldest pending event has been waiting, in
+        seconds.'''
+        with self.cond:
+            if not self.pending:
+                return 0.0
+            return time.time() - self.pending[0][4]
+
+    def stop(self):
+        '''Deliver the pending events, call the trader's onExit on this
+        lane's thread and wait for it to finish.'''
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.join()
+
+    def run(self):
+        bot = self.bot
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+                key, handler, args, errorHandler, queued = self.pending.popleft()
+                if key is None:
+                    self.unkeyed -= 1
+                else:
+                    args = self.latest.pop(key)
+
+            start = time.time()
+            self.waitHistogram.observe(start - queued)
+            try:
+                handler(*args)
+            except:
+                errorHandler(args, handler, traceback.format_exc())
+            bot.recordHandlerTime(handler, start)
+
+        # Give the trader an opportunity to do thread-specific cleanup.
+        self.trader.onExit()
+
+    # Handlers registered with the bot in place of the trader's own.
+
+    def _depthError(self, args, handler, tracebackText):
+        self.bot.onDepthHandlingError(args[1], handler, tracebackText)
+
+    def _tradeHistoryError(self, args, handler, tracebackText):
+        self.bot.onTradeHistoryHandlingError(args[1], handler, tracebackText)
+
+    def _barError(self, args, handler, tracebackText):
+        self.bot.onBarHandlingError(args[1], handler, tracebackText)
+
+    def _snapshotError(self, args, handler, tracebackText):
+        self.bot.onSnapshotHandlingError(args[1], handler, tracebackText)
+
+    def _loopEndError(self, args, handler, tracebackText):
+        tstr = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        print "%s Error while calling loop end handler (%r): %s" % (tstr, handler, tracebackText)
+
+    def onNewDepth(self, t, pair, asks, bids):
+        self.submit(("depth", pair), self.trader.onNewDepth, (t, pair, asks, bids),
+                    self._depthError)
+
+    def onDepthChange(self, t, pair, added, removed, modified):
+        self.submit(None, self.trader.onDepthChange, (t, pair, added, removed, modified),
+                    self._depthError)
+
+    def onNewTradeHistory(self, t, pair, trades):
+        # The bot keeps changing its buffer, so pass a view of a copy.
+        self.submit(("history", pair), self.trader.onNewTradeHistory,
+                    (t, pair, TradeView(list(trades))), self._tradeHistoryError)
+
+    def onNewTrades(self, t, pair, trades):
+        self.submit(("trades", pair), self.trader.onNewTrades, (t, pair, list(trades)),
+                    self._tradeHistoryError, _appendTrades)
+
+    def onNewBar(self, t, pair, bar):
+        self.submit(None, self.trader.onNewBar, (t, pair, bar), self._barError)
+
+    def onNewSnapshot(self, t, pair, snapshot):
+        self.submit(("snapshot", pair), self.trader.onNewSnapshot, (t, pair, snapshot),
+                    self._snapshotError)
+
+    def onLoopEnd(self, t):
+        self.submit(("loopEnd",), self.trader.onLoopEnd, (t,), self._loopEndError)
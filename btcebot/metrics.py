@@ -0,0 +1,183 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import bisect
+import BaseHTTPServer
+import threading
+
+# Default histogram bucket upper bounds, in seconds.
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram(object):
+    '''
+    Counts observations in fixed buckets, so that recording a value is
+    just a bisect and a couple of additions.
+    '''
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus one for values above the last bound.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        '''Estimate the q-th quantile (0 <= q <= 1) as the upper bound of
+        the bucket it falls in.'''
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+def _formatLabels(labels, extra=()):
+    items = tuple(labels) + tuple(extra)
+    if not items:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                             for k, v in items)
+
+class Metrics(object):
+    '''
+    Registry of named counters, gauges and histograms.  Each metric is
+    identified by a name and a tuple of (label, value) pairs.  Gauges can
+    also be functions, which are called whenever the metrics are read.
+    '''
+    def __init__(self, prefix="btcebot_"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def histogram(self, name, labels=()):
+        key = (name, labels)
+        h = self.histograms.get(key)
+        if h is None:
+            with self.lock:
+                h = self.histograms.setdefault(key, Histogram())
+        return h
+
+    def observe(self, name, value, labels=()):
+        self.histogram(name, labels).observe(value)
+
+    def increment(self, name, labels=(), n=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def setGauge(self, name, value, labels=()):
+        '''Set a gauge to a value, or to a function returning its value.'''
+        self.gauges[(name, labels)] = value
+
+    def snapshot(self):
+        '''
+        Return the current values as a dictionary mapping (name, labels)
+        to a number for counters and gauges, or to a dictionary with
+        "count", "sum", "p50", "p95" and "p99" entries for histograms.
+        '''
+        result = {}
+        with self.lock:
+            counters = self.counters.items()
+            gauges = self.gauges.items()
+            histograms = self.histograms.items()
+        for key, value in counters:
+            result[key] = value
+        for key, value in gauges:
+            result[key] = value() if callable(value) else value
+        for key, h in histograms:
+            result[key] = {"count": h.count,
+                           "sum": h.sum,
+                           "p50": h.quantile(0.5),
+                           "p95": h.quantile(0.95),
+                           "p99": h.quantile(0.99)}
+        return result
+
+    def prometheusText(self):
+        '''Return all metrics in the Prometheus text exposition format.'''
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items())
+
+        typed = set()
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s %s" % (name, kind))
+
+        for (name, labels), value in counters:
+            name = self.prefix + name
+            declare(name, "counter")
+            lines.append("%s%s %s" % (name, _formatLabels(labels), value))
+
+        for (name, labels), value in gauges:
+            name = self.prefix + name
+            declare(name, "gauge")
+            if callable(value):
+                value = value()
+            lines.append("%s%s %s" % (name, _formatLabels(labels), value))
+
+        for (name, labels), h in histograms:
+            name = self.prefix + name
+            declare(name, "histogram")
+            with h.lock:
+                counts = list(h.counts)
+                count = h.count
+                total = h.sum
+            cumulative = 0
+            for bound, n in zip(h.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append("%s_bucket%s %d" % (name, _formatLabels(labels, (("le", bound),)),
+                                                 cumulative))
+            lines.append("%s_sum%s %r" % (name, _formatLabels(labels), total))
+            lines.append("%s_count%s %d" % (name, _formatLabels(labels), count))
+
+        return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.metrics.prometheusText()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class MetricsServer(object):
+    '''
+    Serves a Metrics registry in the Prometheus text format over HTTP from
+    a background thread.
+    '''
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        self.server = BaseHTTPServer.HTTPServer((host, port), _MetricsHandler)
+        self.server.metrics = metrics
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
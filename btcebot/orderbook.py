@@ -0,0 +1,85 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+from fixedpoint import fromScaled, fromScaledArrays, toScaledArrays
+
+def _diffSide(side, descending, oldPrices, oldAmounts, newPrices, newAmounts,
+              added, removed, modified):
+    # Both books are sorted in the same order (ascending for asks,
+    # descending for bids), so walk them together.
+    i = j = 0
+    nOld = len(oldPrices)
+    nNew = len(newPrices)
+    while i < nOld and j < nNew:
+        po = oldPrices[i]
+        pn = newPrices[j]
+        if po == pn:
+            if oldAmounts[i] != newAmounts[j]:
+                modified.append((side, pn, newAmounts[j]))
+            i += 1
+            j += 1
+        elif (po < pn) != descending:
+            removed.append((side, po, oldAmounts[i]))
+            i += 1
+        else:
+            added.append((side, pn, newAmounts[j]))
+            j += 1
+
+    for i in xrange(i, nOld):
+        removed.append((side, oldPrices[i], oldAmounts[i]))
+    for j in xrange(j, nNew):
+        added.append((side, newPrices[j], newAmounts[j]))
+
+class OrderBook(object):
+    '''
+    Snapshot of the order book for one pair.  Price levels are stored in
+    parallel arrays of fixed-point integers (see fixedpoint.SCALE), which
+    are much smaller than lists of Decimal tuples and can be compared
+    against the previous snapshot without creating any objects.
+    '''
+    __slots__ = ("askPrices", "askAmounts", "bidPrices", "bidAmounts")
+
+    def __init__(self, asks, bids):
+        self.askPrices, self.askAmounts = toScaledArrays(asks)
+        self.bidPrices, self.bidAmounts = toScaledArrays(bids)
+
+    def __eq__(self, other):
+        return (self.askPrices == other.askPrices
+                and self.bidPrices == other.bidPrices
+                and self.askAmounts == other.askAmounts
+                and self.bidAmounts == other.bidAmounts)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def asks(self):
+        return fromScaledArrays(self.askPrices, self.askAmounts)
+
+    def bids(self):
+        return fromScaledArrays(self.bidPrices, self.bidAmounts)
+
+    def diff(self, previous):
+        '''
+        Compare this book to a previous snapshot of the same pair (or None),
+        and return a tuple of lists (added, removed, modified).  Each list
+        contains (side, price, amount) tuples, where side is "ask" or "bid"
+        and price and amount are fixed-point integers.  For removed levels
+        the amount is the last amount seen; for modified levels it is the
+        new amount.
+        '''
+        added = []
+        removed = []
+        modified = []
+        if previous is None:
+            previous = _EMPTY_BOOK
+        _diffSide("ask", False, previous.askPrices, previous.askAmounts,
+                  self.askPrices, self.askAmounts, added, removed, modified)
+        _diffSide("bid", True, previous.bidPrices, previous.bidAmounts,
+                  self.bidPrices, self.bidAmounts, added, removed, modified)
+        return added, removed, modified
+
+_EMPTY_BOOK = OrderBook((), ())
+
+def levelsFromScaled(levels):
+    '''Convert a list of (side, price, amount) tuples as returned by
+    OrderBook.diff into the same tuples with Decimal price and amount.'''
+    return [(side, fromScaled(p), fromScaled(a)) for side, p, a in levels]
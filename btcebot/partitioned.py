@@ -0,0 +1,375 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import array
+import datetime
+import glob
+import os
+import sqlite3
+import threading
+
+from btceapi.public import Trade
+
+from database import MarketDatabase
+from fixedpoint import INT64_TYPECODE, ScaledTrade
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_PERIODS = {"day": 1, "week": 7}
+
+def _dateOfTimestamp(timestamp):
+    return datetime.date.fromtimestamp(timestamp)
+
+def _dateOfDatetime(dt):
+    return dt.date()
+
+def _finishPartition(path):
+    # Fold the write-ahead log back into the database and leave WAL mode,
+    # so that a closed partition is a single self-contained file.
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        connection.execute("PRAGMA journal_mode=DELETE").fetchall()
+    except sqlite3.OperationalError:
+        # Something else still has it open; it is finished again the next
+        # time it is closed.
+        pass
+    finally:
+        connection.close()
+
+class PartitionedMarketDatabase(object):
+    '''
+    A MarketDatabase split into one file per day or week (period), kept in
+    directory and named after the date each partition starts, such as
+    day-20170131.db.  Inserts go to the partition for each row's time, and
+    retrieval reads only the partitions that overlap the requested range,
+    so the live partition stays small no matter how much history has been
+    recorded.  Dates are local, like the depth timestamps the bot records.
+
+    At most maxOpen partitions are kept open for writing; others are
+    closed as needed (waiting for their queued inserts, and folding any
+    write-ahead log back into the file) and reopened if more data arrives
+    for them.  Any other keyword arguments, such as
+    writeBehind or depthKeyframeInterval, are passed to each partition's
+    MarketDatabase.
+
+    Old partitions are managed by applyRetention, which runs in the
+    background whenever a new partition is started:
+      * depth in partitions that ended more than depthDownsampleDays ago is
+        thinned out to one snapshot per depthDownsampleInterval seconds;
+      * depth in partitions that ended more than depthRetentionDays ago is
+        deleted, keeping the trades and bars;
+      * partitions that ended more than retentionDays ago are deleted.
+    A partition is never changed while it is open for writing or being
+    read, and it is not opened while retention is changing it.
+    '''
+    def __init__(self, directory, all_pairs, period="day", depthDownsampleDays=None,
+                 depthDownsampleInterval=60, depthRetentionDays=None,
+                 retentionDays=None, maxOpen=4, **options):
+        if period not in _PERIODS:
+            raise Exception("Unknown partition period: %r" % period)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.all_pairs = list(all_pairs)
+        self.period = period
+        self.depthDownsampleDays = depthDownsampleDays
+        self.depthDownsampleInterval = depthDownsampleInterval
+        self.depthRetentionDays = depthRetentionDays
+        self.retentionDays = retentionDays
+        self.maxOpen = maxOpen
+        self.options = options
+        self.fixedPoint = options.get("fixedPoint", False)
+        self.metrics = options.get("metrics")
+        # Partition start date -> MarketDatabase open for writing, least
+        # recently used first.
+        self.open = {}
+        self.used = []
+        # Partition start date -> number of retrievals reading it through
+        # a connection of their own.
+        self.reading = {}
+        # Start dates of partitions retention is changing right now.
+        self.retaining = set()
+        self.lock = threading.Lock()
+        self.retentionDone = threading.Condition(self.lock)
+        self.retentionThread = None
+
+    # Partition names and ranges.
+
+    def partitionStart(self, date):
+        '''Return the first date of the partition containing date.'''
+        if self.period == "week":
+            return date - datetime.timedelta(days=date.weekday())
+        return date
+
+    def partitionEnd(self, start):
+        return start + datetime.timedelta(days=_PERIODS[self.period])
+
+    def partitionPath(self, start):
+        return os.path.join(self.directory, "%s-%s.db" % (self.period, start.strftime("%Y%m%d")))
+
+    def partitions(self):
+        '''Return the start dates of all stored partitions, oldest first.'''
+        starts = []
+        for path in glob.glob(os.path.join(self.directory, self.period + "-*.db")):
+            name = os.path.basename(path)[len(self.period) + 1:-3]
+            try:
+                starts.append(datetime.datetime.strptime(name, "%Y%m%d").date())
+            except ValueError:
+                continue
+        return sorted(starts)
+
+    def _overlapping(self, startDate, endDate):
+        first = self.partitionStart(startDate)
+        return [s for s in self.partitions() if first <= s <= endDate]
+
+    # Writing.
+
+    def _writable(self, start):
+        with self.lock:
+            while start in self.retaining:
+                self.retentionDone.wait()
+            db = self.open.get(start)
+            if db is not None:
+                self.used.remove(start)
+                self.used.append(start)
+                return db
+
+            isNew = not os.path.isfile(self.partitionPath(start))
+            while len(self.open) >= self.maxOpen:
+                oldest = self.used.pop(0)
+                self.open.pop(oldest).close()
+                _finishPartition(self.partitionPath(oldest))
+            db = MarketDatabase(self.partitionPath(start), self.all_pairs, **self.options)
+            self.open[start] = db
+            self.used.append(start)
+
+        if self.metrics is not None:
+            self.metrics.setGauge("db_write_queue_depth", self.queueDepth)
+        if isNew and self.open and start == max(self.open):
+            # A new partition has been started, so older ones are done with.
+            self.startRetention()
+        return db
+
+    def insertTradeHistory(self, trade_data):
+        '''Like MarketDatabase.insertTradeHistory, with each trade going to
+        the partition for its timestamp.'''
+        if type(trade_data) is not list:
+            trade_data = [trade_data]
+        groups = {}
+        for t in trade_data:
+            if type(t) in (Trade, ScaledTrade):
+                timestamp = t.timestamp
+            else:
+                timestamp = t[5]
+            start = self.partitionStart(_dateOfTimestamp(timestamp))
+            groups.setdefault(start, []).append(t)
+        for start, trades in sorted(groups.items()):
+            self._writable(start).insertTradeHistory(trades)
+
+    def insertDepth(self, dt, pair, asks, bids):
+        self._writable(self.partitionStart(_dateOfDatetime(dt))).insertDepth(dt, pair, asks, bids)
+
+    def insertBars(self, bars):
+        groups = {}
+        for b in bars:
+            start = self.partitionStart(_dateOfTimestamp(b.start))
+            groups.setdefault(start, []).append(b)
+        for start, group in sorted(groups.items()):
+            self._writable(start).insertBars(group)
+
+    def flush(self):
+        with self.lock:
+            databases = self.open.values()
+        for db in databases:
+            db.flush()
+
+    def queueDepth(self):
+        with self.lock:
+            databases = self.open.values()
+        return sum(db.queueDepth() for db in databases)
+
+    def close(self):
+        with self.lock:
+            opened = self.open.items()
+            self.open = {}
+            self.used = []
+        for start, db in opened:
+            db.close()
+            _finishPartition(self.partitionPath(start))
+        if self.retentionThread is not None:
+            self.retentionThread.join()
+            self.retentionThread = None
+
+    # Reading.
+
+    def _reader(self, start):
+        # Return (db, mustRelease), or (None, False) if the partition has
+        # been deleted.  Partitions open for writing have to be read
+        # through the same object, since it may still have inserts queued;
+        # others are opened for the caller, which must pass them to
+        # _release when done so retention knows they are no longer read.
+        with self.lock:
+            while start in self.retaining:
+                self.retentionDone.wait()
+            db = self.open.get(start)
+            if db is not None:
+                return db, False
+            path = self.partitionPath(start)
+            if not os.path.isfile(path):
+                return None, False
+            self.reading[start] = self.reading.get(start, 0) + 1
+        try:
+            return MarketDatabase(path, self.all_pairs, fixedPoint=self.fixedPoint), True
+        except:
+            self._release(start, None)
+            raise
+
+    def _release(self, start, db):
+        if db is not None:
+            db.close()
+        with self.lock:
+            self.reading[start] -= 1
+            if not self.reading[start]:
+                del self.reading[start]
+
+    def _fanOut(self, starts, retrieve):
+        for start in starts:
+            db, mustRelease = self._reader(start)
+            if db is None:
+                continue
+            try:
+                for item in retrieve(db):
+                    yield item
+            finally:
+                if mustRelease:
+                    self._release(start, db)
+
+    def retrieveTradeHistory(self, start_date, end_date, pair, batchSize=1000):
+        '''Like MarketDatabase.retrieveTradeHistory, reading only the
+        partitions that overlap [start_date, end_date].'''
+        starts = self._overlapping(_dateOfTimestamp(start_date), _dateOfTimestamp(end_date))
+        return self._fanOut(starts, lambda db: db.retrieveTradeHistory(start_date, end_date,
+                                                                       pair, batchSize))
+
+    def retrieveTradeHistoryArrays(self, start_date, end_date, pair, batchSize=10000):
+        '''Like MarketDatabase.retrieveTradeHistoryArrays, reading only the
+        partitions that overlap [start_date, end_date].'''
+        starts = self._overlapping(_dateOfTimestamp(start_date), _dateOfTimestamp(end_date))
+        parts = list(self._fanOut(starts, lambda db: [db.retrieveTradeHistoryArrays(
+            start_date, end_date, pair, batchSize)]))
+        if len(parts) == 1:
+            return parts[0]
+
+        names = ("tid", "timestamp", "price", "amount", "type")
+        if numpy is not None:
+            if not parts:
+                return dict((n, numpy.array([], dtype=numpy.int8 if n == "type" else numpy.int64))
+                            for n in names)
+            return dict((n, numpy.concatenate([p[n] for p in parts])) for n in names)
+
+        columns = {}
+        for n in names:
+            column = array.array("b" if n == "type" else INT64_TYPECODE)
+            for p in parts:
+                column.extend(p[n])
+            columns[n] = column
+        return columns
+
+    def retrieveDepth(self, start_date, end_date, pair, batchSize=1000):
+        '''Like MarketDatabase.retrieveDepth, reading only the partitions
+        that overlap [start_date, end_date].'''
+        starts = self._overlapping(_dateOfDatetime(start_date), _dateOfDatetime(end_date))
+        return self._fanOut(starts, lambda db: db.retrieveDepth(start_date, end_date,
+                                                                pair, batchSize))
+
+    def retrieveLatestDepth(self, pair, start_date=None):
+        '''Like MarketDatabase.retrieveLatestDepth, reading partitions from
+        the newest until a snapshot is found.'''
+        starts = self.partitions()
+        if start_date is not None:
+            starts = self._overlapping(_dateOfDatetime(start_date), datetime.date.max)
+        for start in reversed(starts):
+            db, mustRelease = self._reader(start)
+            if db is None:
+                continue
+            try:
+                latest = db.retrieveLatestDepth(pair, start_date)
+            finally:
+                if mustRelease:
+                    self._release(start, db)
+            if latest is not None:
+                return latest
+        return None
+
+    def retrieveBars(self, start_date, end_date, pair, resolution, batchSize=1000):
+        '''Like MarketDatabase.retrieveBars, reading only the partitions
+        that overlap [start_date, end_date].'''
+        starts = self._overlapping(_dateOfTimestamp(start_date), _dateOfTimestamp(end_date))
+        return self._fanOut(starts, lambda db: db.retrieveBars(start_date, end_date, pair,
+                                                               resolution, batchSize))
+
+    # Retention.
+
+    def startRetention(self):
+        '''Run applyRetention on a background thread, unless it is already
+        running.'''
+        if self.retentionThread is not None and self.retentionThread.is_alive():
+            return
+        self.retentionThread = threading.Thread(target=self.applyRetention,
+                                                name="PartitionedMarketDatabase retention")
+        self.retentionThread.daemon = True
+        self.retentionThread.start()
+
+    def applyRetention(self, today=None):
+        '''Downsample or delete old partitions as configured, skipping any
+        that are open for writing or being read.'''
+        if today is None:
+            today = datetime.date.today()
+        age = lambda start: (today - self.partitionEnd(start)).days
+
+        for start in self.partitions():
+            with self.lock:
+                if start in self.open or start in self.reading:
+                    continue
+                self.retaining.add(start)
+            try:
+                self._applyRetention(start, age)
+            finally:
+                with self.lock:
+                    self.retaining.discard(start)
+                    self.retentionDone.notify_all()
+
+    def _applyRetention(self, start, age):
+        path = self.partitionPath(start)
+        if self.retentionDays is not None and age(start) >= self.retentionDays:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            return
+
+        if self.depthRetentionDays is not None and age(start) >= self.depthRetentionDays:
+            action = "deleted"
+        elif self.depthDownsampleDays is not None and age(start) >= self.depthDownsampleDays:
+            action = "downsampled"
+        else:
+            return
+
+        db = MarketDatabase(path, self.all_pairs)
+        try:
+            # Each partition records what has been done to it already.
+            db.connection.execute("CREATE TABLE IF NOT EXISTS retention(action TEXT PRIMARY KEY)")
+            done = set(a for (a,) in db.connection.execute("SELECT action FROM retention"))
+            if action in done or (action == "downsampled" and "deleted" in done):
+                return
+            if action == "deleted":
+                db.deleteDepth()
+            else:
+                db.downsampleDepth(self.depthDownsampleInterval)
+            db.connection.execute("INSERT OR REPLACE INTO retention VALUES(?)", (action,))
+            db.connection.commit()
+            db.vacuum()
+        finally:
+            db.close()
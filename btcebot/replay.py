@@ -0,0 +1,139 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import datetime
+import heapq
+import multiprocessing
+import os.path
+import time
+
+from database import MarketDatabase
+
+# Event kinds, in the order they are dispatched when timestamps are equal.
+# Events are (time, kind, pair, trade id or 0, data) tuples, so that
+# trades recorded in the same second are replayed in trade id order.
+_DEPTH = 0
+_TRADE = 1
+
+def _epoch(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond * 1e-6
+
+def _depthEvents(database, start, end, pair):
+    for d, asks, bids in database.retrieveDepth(start, end, pair):
+        yield _epoch(d), _DEPTH, pair, 0, (d, asks, bids)
+
+def _tradeEvents(database, start, end, pair):
+    for t in database.retrieveTradeHistory(start, end, pair):
+        yield t.timestamp, _TRADE, pair, t.tid, t
+
+class ReplayAPI(object):
+    '''
+    Minimal stand-in for btceapi.APIInfo, so that a Bot can be created for
+    replay without contacting the exchange.
+    '''
+    def __init__(self, pair_names):
+        self.pair_names = list(pair_names)
+
+    def validate_pair(self, pair):
+        if pair not in self.pair_names:
+            raise Exception("Unrecognized pair: %r" % pair)
+
+class Replay(object):
+    '''
+    Drives a Bot's handlers with depth and trade history recorded in a
+    MarketDatabase, as fast as the handlers can process it.
+
+    Recorded data is grouped into update loops covering bot.collectionInterval
+    seconds of virtual time.  For each loop, the last depth snapshot of each
+    pair is passed to the depth handlers, the trades recorded during the loop
+    are merged into the bot's trade history and passed to the trade history
+    handlers, and then the loop end handlers are called, just as a live Bot
+    would.  Stretches of time in which nothing was recorded are skipped.
+    '''
+    def __init__(self, bot, database, start, end):
+        '''start and end are datetimes bounding the data to replay.'''
+        self.bot = bot
+        self.database = database
+        self.start = start
+        self.end = end
+        self.loops = 0
+
+    def _events(self):
+        db = self.database
+        startEpoch = int(_epoch(self.start))
+        endEpoch = int(_epoch(self.end))
+        streams = [_depthEvents(db, self.start, self.end, p)
+                   for p in self.bot.getDepthPairs()]
+        streams += [_tradeEvents(db, startEpoch, endEpoch, p)
+                    for p in self.bot.getTradeHistoryPairs()]
+        return heapq.merge(*streams)
+
+    def _dispatch(self, loopEnd, depths, trades):
+        bot = self.bot
+        t = datetime.datetime.fromtimestamp(loopEnd)
+        for p, (d, asks, bids) in depths.items():
+            bot.dispatchDepth(d, p, asks, bids)
+        for p in bot.getTradeHistoryPairs():
+            bot.dispatchTradeHistory(t, p, trades.get(p, ()), loopEnd)
+        bot.dispatchLoopEnd(t)
+        self.loops += 1
+
+    def run(self):
+        '''Replay all of the data, then call the traders' onExit methods.
+        Returns the number of update loops that were run.'''
+        interval = self.bot.collectionInterval
+        loopEnd = None
+        depths = {}
+        trades = {}
+        for when, kind, pair, tid, data in self._events():
+            if loopEnd is not None and when >= loopEnd:
+                self._dispatch(loopEnd, depths, trades)
+                depths = {}
+                trades = {}
+                loopEnd = None
+
+            if loopEnd is None:
+                loopEnd = when + interval
+
+            if kind == _DEPTH:
+                depths[pair] = data
+            else:
+                trades.setdefault(pair, []).append(data)
+
+        if loopEnd is not None:
+            self._dispatch(loopEnd, depths, trades)
+
+        self.bot.exitTraders()
+        return self.loops
+
+def _sweepWorker(args):
+    makeBot, evaluate, database_path, start, end, params = args
+    database = MarketDatabase(database_path, None)
+    try:
+        bot = makeBot(ReplayAPI(database.pair_to_index), params)
+        Replay(bot, database, start, end).run()
+        return params, evaluate(bot)
+    finally:
+        database.close()
+
+def runSweep(makeBot, evaluate, database_path, start, end, parameterSets,
+             processes=None):
+    '''
+    Replay the same recorded data once for each item in parameterSets,
+    spreading the runs across worker processes (one per CPU by default).
+    makeBot(api, params) must return a Bot with its traders added, and
+    evaluate(bot) is called after the replay to produce the result for that
+    run.  Both must be module-level functions so they can be sent to the
+    worker processes, and results must be picklable.  Returns a list of
+    (params, result) tuples in the same order as parameterSets.
+    '''
+    if not os.path.isfile(database_path):
+        raise Exception("Market database not found: %s" % database_path)
+
+    jobs = [(makeBot, evaluate, database_path, start, end, params)
+            for params in parameterSets]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_sweepWorker, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,114 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+# Kinds of market data request.
+DEPTH = "depth"
+TRADES = "trades"
+
+class TokenBucket(object):
+    '''
+    Request rate limiter: holds up to burst tokens, refilled at rate tokens
+    per second, and each request uses one token.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        '''Use a token if one is available, and return whether it was.'''
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def delay(self, now):
+        '''Return the number of seconds until a token will be available.'''
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+class Scheduler(object):
+    '''
+    Decides which (kind, pair) requests are due on each pass of the bot
+    loop.  Each pair, or each kind of request for a pair, can have its own
+    polling interval and priority; anything without one is polled every
+    default interval (the bot's collection interval).  If a rate limit is
+    set, due requests are granted in priority order (most overdue first
+    among equal priorities) while the budget lasts, and the rest wait for
+    a later pass.
+    '''
+    def __init__(self):
+        self.settings = {}
+        self.nextDue = {}
+        self.bucket = None
+        # Number of due requests the rate limit held back on the last pass.
+        self.deferred = 0
+
+    def setInterval(self, pair, interval, kind=None, priority=0):
+        '''Poll pair every interval seconds.  If kind is DEPTH or TRADES,
+        this only applies to that kind of request.  Requests with a higher
+        priority are served first when the rate limit is reached.'''
+        self.settings[(kind, pair)] = (interval, priority)
+        # Apply the new interval from now on.
+        self.nextDue.pop((DEPTH, pair), None)
+        self.nextDue.pop((TRADES, pair), None)
+
+    def setRateLimit(self, rate, burst=None):
+        '''Allow at most rate requests per second on average, with bursts
+        of up to burst requests.  A rate of None removes the limit.'''
+        if rate is None:
+            self.bucket = None
+        else:
+            self.bucket = TokenBucket(rate, burst or max(1.0, rate))
+
+    def _lookup(self, key, defaultInterval):
+        kind, pair = key
+        setting = self.settings.get(key)
+        if setting is None:
+            setting = self.settings.get((None, pair), (defaultInterval, 0))
+        return setting
+
+    def due(self, now, wanted, defaultInterval):
+        '''Return the list of (kind, pair) requests from wanted that should
+        be made now, and mark them as done.'''
+        nextDue = self.nextDue
+        candidates = []
+        for key in wanted:
+            when = nextDue.get(key, 0)
+            if when <= now:
+                interval, priority = self._lookup(key, defaultInterval)
+                candidates.append((-priority, when, key, interval))
+
+        if not candidates:
+            self.deferred = 0
+            return []
+
+        candidates.sort()
+        granted = []
+        for negPriority, when, key, interval in candidates:
+            if self.bucket is not None and not self.bucket.take(now):
+                break
+            nextDue[key] = now + interval
+            granted.append(key)
+        self.deferred = len(candidates) - len(granted)
+        return granted
+
+    def delay(self, now, wanted, defaultInterval):
+        '''Return the number of seconds until the next request in wanted
+        will be due and allowed by the rate limit, or defaultInterval if
+        there are no requests to make.'''
+        if not wanted:
+            return defaultInterval
+        when = min(self.nextDue.get(key, 0) for key in wanted)
+        delay = max(0.0, when - now)
+        if self.bucket is not None:
+            delay = max(delay, self.bucket.delay(now))
+        return delay
@@ -0,0 +1,342 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Runs traders in worker processes, so that CPU-heavy strategies aren't
+limited to one core by the GIL.  The bot process still makes every
+exchange request; it publishes each depth snapshot and batch of trades
+once into a ring of fixed-size slots in shared memory, and each worker
+reads them from there and dispatches them to its traders through a Bot of
+its own.
+
+Every slot starts with a header:
+
+    seq        8 bytes   record sequence number, 0 while being written
+    kind       1 byte    _DEPTH, _TRADES, _LOOP_END or _STOP
+    pair       2 bytes   index into the pair table (after 1 pad byte)
+    time       8 bytes   seconds since the epoch, as a double
+    size1      4 bytes   asks blob length, or number of trades
+    size2      4 bytes   bids blob length
+
+Depth records are followed by the asks and bids as depthcodec keyframes,
+so workers decode them lazily and never create Decimals for levels their
+traders don't read.  Trade records are followed by five native int64s per
+trade: tid, timestamp, price, amount (both fixed-point) and type.
+'''
+
+import array
+import datetime
+import multiprocessing
+import struct
+import time
+import traceback
+
+import depthcodec
+from fixedpoint import INT64_TYPECODE, ScaledTrade, toScaled
+from replay import ReplayAPI, _epoch
+from trader import TraderBase
+
+_DEPTH = 1
+_TRADES = 2
+_LOOP_END = 3
+_STOP = 4
+
+_HEADER = struct.Struct("=QBxHdII")
+_SEQ = struct.Struct("=Q")
+_TRADE_FIELDS = 5
+_TRADE_TYPES = ("bid", "ask")
+_TRADE_TYPE_INDEX = {"bid": 0, "ask": 1}
+
+class _Ring(object):
+    '''
+    Single-writer ring of fixed-size records in shared memory.  Readers
+    keep their own position and detect records overwritten before they
+    could read them by checking the sequence number before and after.
+    '''
+    def __init__(self, slots, slotSize):
+        self.slots = slots
+        self.slotSize = slotSize
+        self.buffer = multiprocessing.RawArray('c', slots * slotSize)
+        self.nextSeq = 1
+
+    def write(self, kind, pairIndex, t, size1=0, size2=0, payload=""):
+        seq = self.nextSeq
+        self.nextSeq += 1
+        offset = ((seq - 1) % self.slots) * self.slotSize
+        buf = self.buffer
+        # Mark the slot as being written, then fill in the rest of the
+        # header and the payload, and only then publish the sequence
+        # number on its own, so that a reader that sees it also sees
+        # everything it covers.
+        _HEADER.pack_into(buf, offset, 0, kind, pairIndex, t, size1, size2)
+        start = offset + _HEADER.size
+        buf[start:start + len(payload)] = payload
+        _SEQ.pack_into(buf, offset, seq)
+
+    def read(self, seq):
+        '''Return (seq, kind, pairIndex, time, size1, size2, payload) for
+        the record with the given sequence number, a record with a later
+        sequence number if that one has been overwritten, or None if it
+        hasn't been written yet.'''
+        offset = ((seq - 1) % self.slots) * self.slotSize
+        buf = self.buffer
+        found = _SEQ.unpack_from(buf, offset)[0]
+        if found < seq:
+            return None
+        header = _HEADER.unpack_from(buf, offset)
+        if header[0] != found:
+            # Being overwritten already.
+            return self.read(seq + self.slots)
+        start = offset + _HEADER.size
+        kind, size1, size2 = header[1], header[4], header[5]
+        if kind == _DEPTH:
+            payload = buf[start:start + size1 + size2]
+        elif kind == _TRADES:
+            payload = buf[start:start + size1 * _TRADE_FIELDS * 8]
+        else:
+            payload = ""
+        if _SEQ.unpack_from(buf, offset)[0] != found:
+            # Overwritten while we were reading it.
+            return self.read(seq + self.slots)
+        return header + (payload,)
+
+def _shardMain(ring, wakeEvent, errors, traders, pairNames, bufferSpanMinutes,
+               barResolutions, warmTrades, warmBooks):
+    # Imported here because bot imports this module.
+    from bot import Bot
+
+    bot = Bot(ReplayAPI(pairNames), bufferSpanMinutes, fixedPoint=True)
+    if barResolutions is not None:
+        bot.setBarResolutions(barResolutions)
+    # Start from the trades and books the bot had when it forked us.
+    for pair, trades in warmTrades.items():
+        bot.primeTradeHistory(pair, trades)
+    for pair, book in warmBooks.items():
+        bot.primeDepth(pair, book)
+    bot.addErrorHandler(lambda msg, tracebackText: errors.put((msg, tracebackText)))
+    for trader in traders:
+        bot.addTrader(trader)
+
+    seq = 1
+    while True:
+        wakeEvent.clear()
+        record = ring.read(seq)
+        if record is None:
+            wakeEvent.wait(1.0)
+            continue
+
+        found, kind, pairIndex, t, size1, size2, payload = record
+        if found != seq:
+            errors.put(("Trader process fell behind; %d market data updates were lost"
+                        % (found - seq), ""))
+        seq = found + 1
+
+        pair = pairNames[pairIndex]
+        dt = datetime.datetime.fromtimestamp(t)
+        if kind == _DEPTH:
+            asks = depthcodec.DepthLevels(payload[:size1])
+            bids = depthcodec.DepthLevels(payload[size1:])
+            bot.dispatchDepth(dt, pair, asks, bids)
+        elif kind == _TRADES:
+            fields = array.array(INT64_TYPECODE, payload)
+            trades = []
+            for i in xrange(0, len(fields), _TRADE_FIELDS):
+                tid, timestamp, price, amount, tradeType = fields[i:i + _TRADE_FIELDS]
+                trades.append(ScaledTrade(pair, _TRADE_TYPES[tradeType], tid,
+                                          timestamp, price, amount))
+            bot.dispatchTradeHistory(dt, pair, trades, t)
+        elif kind == _LOOP_END:
+            bot.dispatchLoopEnd(dt)
+        elif kind == _STOP:
+            break
+
+    for trader in traders:
+        try:
+            trader.onExit()
+        except:
+            errors.put(("Error in onExit of %r" % trader, traceback.format_exc()))
+
+class TraderShards(object):
+    '''
+    Spreads traders over worker processes fed from a shared-memory ring
+    (see the module documentation).  Create it through
+    Bot.setTraderProcesses, and add traders with Bot.addTrader as usual;
+    the processes are started when the bot publishes its first update, so
+    every trader must be added before that.
+
+    Traders in a worker get trades as ScaledTrade objects, and a copy of
+    the bot's trade buffer made in the worker, which starts from whatever
+    the bot had loaded when the worker was started (see Bot.warmStart).
+    Errors raised by their
+    handlers, or by onExit, are passed back to the bot's error handlers.
+    Depth beyond maxLevels on either side is not passed on.  A worker that
+    falls more than slots records behind skips ahead, and reports how
+    many updates it lost.
+    '''
+    def __init__(self, bot, processes=None, slots=1024, maxLevels=200, maxTrades=150):
+        self.bot = bot
+        self.processes = processes or multiprocessing.cpu_count()
+        self.maxLevels = maxLevels
+        self.maxTrades = maxTrades
+        depthSize = 2 * (depthcodec._HEADER.size + maxLevels * 16)
+        tradeSize = maxTrades * _TRADE_FIELDS * 8
+        # Keep every slot, and so every sequence number, 8-byte aligned,
+        # so that sequence numbers are never written or read torn.
+        slotSize = _HEADER.size + max(depthSize, tradeSize)
+        self.ring = _Ring(slots, (slotSize + 7) // 8 * 8)
+        self.shards = [[] for i in range(self.processes)]
+        self.traderCount = 0
+        self.pairNames = []
+        self.pairIndex = {}
+        self.depthPairs = set()
+        self.tradePairs = set()
+        self.lastTid = {}
+        self.workers = []
+        self.errors = multiprocessing.Queue()
+
+        bot.addDepthHandler(self.publishDepth, self.depthPairs)
+        bot.addTradeHistoryHandler(self.publishTrades, self.tradePairs)
+        bot.addLoopEndHandler(self.publishLoopEnd)
+
+    def addTrader(self, trader):
+        if self.workers:
+            raise Exception("Traders can't be added once the trader processes are running")
+
+        def overrides(name):
+            return getattr(trader, name).__func__ is not getattr(TraderBase, name).__func__
+
+        for p in trader.pairs:
+            self.bot.api.validate_pair(p)
+            if p not in self.pairIndex:
+                self.pairIndex[p] = len(self.pairNames)
+                self.pairNames.append(p)
+        snapshots = overrides("onNewSnapshot")
+        if snapshots or overrides("onNewDepth") or overrides("onDepthChange"):
+            self.depthPairs.update(trader.pairs)
+        if (snapshots or overrides("onNewTradeHistory") or overrides("onNewTrades")
+                or overrides("onNewBar")):
+            self.tradePairs.update(trader.pairs)
+
+        self.shards[self.traderCount % self.processes].append(trader)
+        self.traderCount += 1
+
+    def start(self):
+        if self.workers:
+            return
+        barResolutions = None
+        if self.bot.barBuilder is not None:
+            barResolutions = self.bot.barBuilder.resolutions
+        # Pass on whatever the bot has already loaded (see Bot.warmStart),
+        # and only publish trades newer than that.
+        warmTrades = {}
+        for pair in self.tradePairs:
+            trades = list(self.bot.tradeHistoryItems.get(pair, ()))
+            if trades:
+                warmTrades[pair] = trades
+                self.lastTid[pair] = trades[-1].tid
+        warmBooks = dict((pair, self.bot.orderBooks[pair]) for pair in self.depthPairs
+                         if pair in self.bot.primedBooks)
+        for traders in self.shards:
+            if not traders:
+                continue
+            wakeEvent = multiprocessing.Event()
+            process = multiprocessing.Process(
+                target=_shardMain,
+                args=(self.ring, wakeEvent, self.errors, traders, self.pairNames,
+                      self.bot.bufferSpanMinutes, barResolutions, warmTrades, warmBooks))
+            process.daemon = True
+            process.start()
+            self.workers.append((process, wakeEvent))
+
+    def _publish(self, kind, pair, t, size1=0, size2=0, payload=""):
+        self.start()
+        pairIndex = self.pairIndex.get(pair, 0)
+        self.ring.write(kind, pairIndex, t, size1, size2, payload)
+        for process, wakeEvent in self.workers:
+            wakeEvent.set()
+
+    def publishDepth(self, t, pair, asks, bids):
+        # The bot has already converted this snapshot to fixed point.
+        book = self.bot.orderBooks[pair]
+        n = self.maxLevels
+        asks = depthcodec.encodeKeyframe(book.askPrices[:n], book.askAmounts[:n], False)
+        bids = depthcodec.encodeKeyframe(book.bidPrices[:n], book.bidAmounts[:n], True)
+        self._publish(_DEPTH, pair, _epoch(t), len(asks), len(bids), asks + bids)
+
+    def publishTrades(self, t, pair, trades):
+        # trades is the bot's whole buffer; only publish what's new since
+        # the last time, which is at the end.
+        lastTid = self.lastTid.get(pair)
+        newTrades = []
+        for trade in reversed(trades):
+            if lastTid is not None and trade.tid <= lastTid:
+                break
+            newTrades.append(trade)
+        newTrades.reverse()
+        if newTrades:
+            self.lastTid[pair] = newTrades[-1].tid
+
+        epoch = _epoch(t)
+        # Always publish, even if there is nothing new, so that workers
+        # call their trade history handlers as often as the bot would.
+        start = 0
+        while True:
+            batch = newTrades[start:start + self.maxTrades]
+            fields = array.array(INT64_TYPECODE)
+            for trade in batch:
+                if type(trade) is ScaledTrade:
+                    price, amount = trade.scaledPrice, trade.scaledAmount
+                else:
+                    price, amount = toScaled(trade.price), toScaled(trade.amount)
+                fields.extend((trade.tid, int(trade.timestamp), price, amount,
+                               _TRADE_TYPE_INDEX[trade.type]))
+            self._publish(_TRADES, pair, epoch, len(batch), 0, fields.tostring())
+            start += self.maxTrades
+            if start >= len(newTrades):
+                break
+
+    def publishLoopEnd(self, t):
+        self._publish(_LOOP_END, None, _epoch(t))
+        self.reportErrors()
+
+    def _reportError(self, msg, tracebackText):
+        for h in self.bot.errorHandlers:
+            try:
+                h(msg, tracebackText)
+            except:
+                pass
+
+    def reportErrors(self):
+        '''Pass errors reported by the worker processes to the bot's error
+        handlers.'''
+        while True:
+            try:
+                msg, tracebackText = self.errors.get_nowait()
+            except Exception:
+                break
+            self._reportError(msg, tracebackText)
+
+    def stop(self, timeout=10.0):
+        '''Tell the workers to finish, wait up to timeout seconds for them
+        to call onExit on their traders, and report any errors.  Workers
+        still running after that are terminated.'''
+        if not self.workers:
+            return
+        self._publish(_STOP, None, time.time())
+        deadline = time.time() + timeout
+        terminated = []
+        for process, wakeEvent in self.workers:
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+                terminated.append(process)
+        # Workers flush their error queue before they exit.
+        self.reportErrors()
+        for process, wakeEvent in self.workers:
+            if process in terminated:
+                self._reportError("Trader process %d didn't exit within %g s and was terminated"
+                                  % (process.pid, timeout), "")
+            elif process.exitcode:
+                self._reportError("Trader process %d exited with code %s"
+                                  % (process.pid, process.exitcode), "")
+        self.workers = []
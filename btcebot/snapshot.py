@@ -0,0 +1,137 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import array
+import decimal
+
+from fixedpoint import INT64_TYPECODE, ScaledTrade, fromScaled, toScaled
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _memoized(method):
+    # Cache the result for each combination of arguments on the snapshot,
+    # so every trader that asks for it after the first gets it for free.
+    name = method.__name__
+    def wrapper(self, *args):
+        key = (name,) + args
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = method(self, *args)
+            return value
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+def _countAtOrBetter(prices, price, descending):
+    # Number of levels at price or better: prices are ascending for asks
+    # and descending for bids.
+    lo, hi = 0, len(prices)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if descending:
+            beyond = prices[mid] < price
+        else:
+            beyond = prices[mid] > price
+        if beyond:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+class MarketSnapshot(object):
+    '''
+    The state of one pair's market as of the end of a bot loop: its order
+    book (an OrderBook, or None if no depth has been retrieved) and its
+    buffer of recent trades.  Derived values are computed the first time
+    they are asked for and then shared by every trader given the same
+    snapshot.  Prices and amounts are returned as Decimals.
+    '''
+    def __init__(self, pair, book, trades):
+        self.pair = pair
+        self.book = book
+        # Copy the buffer, since the bot keeps changing it.
+        self.trades = list(trades)
+        self._memo = {}
+
+    def _side(self, side):
+        if side == "ask":
+            return self.book.askPrices, self.book.askAmounts, False
+        if side == "bid":
+            return self.book.bidPrices, self.book.bidAmounts, True
+        raise Exception("Unknown side: %r" % side)
+
+    @_memoized
+    def bestAsk(self):
+        '''Return the lowest ask as a (price, amount) tuple, or None.'''
+        if self.book is None or not self.book.askPrices:
+            return None
+        return fromScaled(self.book.askPrices[0]), fromScaled(self.book.askAmounts[0])
+
+    @_memoized
+    def bestBid(self):
+        '''Return the highest bid as a (price, amount) tuple, or None.'''
+        if self.book is None or not self.book.bidPrices:
+            return None
+        return fromScaled(self.book.bidPrices[0]), fromScaled(self.book.bidAmounts[0])
+
+    @_memoized
+    def spread(self):
+        '''Return the best ask minus the best bid, or None.'''
+        if self.bestAsk() is None or self.bestBid() is None:
+            return None
+        return fromScaled(self.book.askPrices[0] - self.book.bidPrices[0])
+
+    @_memoized
+    def mid(self):
+        '''Return the price halfway between the best bid and ask, or None.'''
+        if self.bestAsk() is None or self.bestBid() is None:
+            return None
+        return (self.bestAsk()[0] + self.bestBid()[0]) / 2
+
+    @_memoized
+    def _cumulative(self, side):
+        prices, amounts, descending = self._side(side)
+        if numpy is not None:
+            return numpy.cumsum(numpy.frombuffer(amounts, dtype=numpy.int64))
+        total = 0
+        cumulative = array.array(INT64_TYPECODE)
+        for a in amounts:
+            total += a
+            cumulative.append(total)
+        return cumulative
+
+    @_memoized
+    def cumulativeDepth(self, side, price):
+        '''Return the total amount on side ("ask" or "bid") offered at price
+        or better, that is, what a market order could fill up to price.'''
+        if self.book is None:
+            return decimal.Decimal(0)
+        prices, amounts, descending = self._side(side)
+        n = _countAtOrBetter(prices, toScaled(price), descending)
+        if not n:
+            return decimal.Decimal(0)
+        return fromScaled(int(self._cumulative(side)[n - 1]))
+
+    @_memoized
+    def vwap(self, since=None):
+        '''Return the volume-weighted average price of the buffered trades,
+        or only of those with a timestamp of at least since, or None if
+        there are none.'''
+        value = 0
+        volume = 0
+        for t in self.trades:
+            if since is not None and t.timestamp < since:
+                continue
+            if type(t) is ScaledTrade:
+                price, amount = t.scaledPrice, t.scaledAmount
+            else:
+                price, amount = toScaled(t.price), toScaled(t.amount)
+            # Python integers, since the products overflow 64 bits.
+            value += price * amount
+            volume += amount
+        if not volume:
+            return None
+        return fromScaled(value // volume)
@@ -0,0 +1,448 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Market data sources for Bot.  A source decides how depth and trades reach
+the bot: PollingSource requests them from the public API on a schedule,
+and StreamingSource receives them over a persistent socket as they happen.
+'''
+
+import collections
+import datetime
+import decimal
+import errno
+import json
+import os
+import Queue
+import select
+import socket
+import threading
+import time
+import traceback
+
+import btceapi
+from btceapi.public import Trade
+
+from breaker import CircuitBreaker, CircuitBreakers
+from scheduler import DEPTH, TRADES
+
+class MarketDataSource(object):
+    '''
+    Base class for market data sources.  The bot calls start() before its
+    thread starts, update() on each pass of its loop (on the bot thread),
+    and stop() once the loop has finished.  update() passes whatever data
+    is available to the bot's dispatch methods and returns the number of
+    seconds until it should be called again; a source that receives data
+    in the background calls bot.wake() to have it called sooner.
+    '''
+    def start(self, bot):
+        pass
+
+    def update(self, bot):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+def _summary(e):
+    return "%s: %s" % (type(e).__name__, e)
+
+def _fetchMarketData(bot, depthPairs, tradeHistoryPairs):
+    '''Retrieve depth and trade history for the given pairs, using up to
+    bot.fetchConcurrency worker threads sharing the bot's connection pool.
+    Every result is stamped with the time its own request completed.
+    Returns four dictionaries keyed by pair: depths, depth retrieval
+    errors, trade histories, and trade history retrieval errors.  Errors
+    are one-line summaries, since formatting a traceback for every failed
+    request is expensive when the exchange is having trouble.'''
+    jobs = Queue.Queue()
+    for p in depthPairs:
+        jobs.put((True, p))
+    for p in tradeHistoryPairs:
+        jobs.put((False, p))
+
+    depths = {}
+    depthErrors = {}
+    tradeHistories = {}
+    tradeHistoryErrors = {}
+
+    pool = bot.connectionPool
+    metrics = bot.metrics
+
+    def worker():
+        while True:
+            try:
+                isDepth, p = jobs.get_nowait()
+            except Queue.Empty:
+                break
+
+            start = time.time()
+            if isDepth:
+                labels = (("kind", DEPTH), ("pair", p))
+                try:
+                    with pool.connection() as conn:
+                        asks, bids = btceapi.getDepth(p, conn)
+                    depths[p] = (datetime.datetime.now(), asks, bids)
+                except Exception, e:
+                    depthErrors[p] = _summary(e)
+                    metrics.increment("fetch_errors_total", labels + (("error", type(e).__name__),))
+            else:
+                labels = (("kind", TRADES), ("pair", p))
+                try:
+                    with pool.connection() as conn:
+                        trades = btceapi.getTradeHistory(p, conn)
+                    tradeHistories[p] = (datetime.datetime.now(), trades)
+                except Exception, e:
+                    tradeHistoryErrors[p] = _summary(e)
+                    metrics.increment("fetch_errors_total", labels + (("error", type(e).__name__),))
+            metrics.observe("fetch_seconds", time.time() - start, labels)
+
+    nworkers = min(bot.fetchConcurrency, jobs.qsize())
+    if nworkers <= 1:
+        # Not worth the thread overhead; just fetch on the bot thread.
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for i in range(nworkers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    return depths, depthErrors, tradeHistories, tradeHistoryErrors
+
+class PollingSource(MarketDataSource):
+    '''
+    Polls the public API for the depth and trade history of every pair the
+    bot's handlers need, as often as the bot's scheduler allows (see
+    Bot.setCollectionInterval, setPairInterval and setRequestRateLimit).
+    This is the bot's default source.
+
+    Requests go through breakers (a breaker.CircuitBreakers, with default
+    settings if not given), so a pair or endpoint that keeps failing is
+    backed off instead of costing a timeout on every loop.  Failures are
+    counted in the bot's metrics as fetch_errors_total; the bot's error
+    handlers are only told when a breaker opens or closes again.
+    '''
+    def __init__(self, breakers=None):
+        if breakers is None:
+            breakers = CircuitBreakers()
+        self.breakers = breakers
+
+    def start(self, bot):
+        bot.metrics.setGauge("circuit_breakers_open", self.breakers.openCount)
+
+    def _recordResults(self, bot, kind, results, errors, now):
+        breakers = self.breakers
+        for p in results:
+            for key in breakers.success(kind, p):
+                self._reportBreaker(bot, key, "recovered", "")
+        for p, error in errors.items():
+            for key in breakers.failure(kind, p, now, error):
+                b = breakers.breaker(*key)
+                text = "%d consecutive failures, the last one %s; retrying in %.1f seconds" % (
+                    b.failures, error, b.retryAt - now)
+                self._reportBreaker(bot, key, "failing", text)
+
+    def _reportBreaker(self, bot, key, what, text):
+        kind, pair = key
+        name = {DEPTH: "depth", TRADES: "trade history"}[kind]
+        if what == "failing" and pair is not None:
+            if kind == DEPTH:
+                bot.onDepthRetrievalError(pair, text)
+            else:
+                bot.onTradeHistoryRetrievalError(pair, text)
+            return
+        bot.onMarketDataError("Retrieval of %s for %s %s" % (name, pair or "all pairs", what), text)
+
+    def update(self, bot):
+        scheduler = bot.scheduler
+        metrics = bot.metrics
+        loopStart = time.time()
+
+        # Work out which pairs are due to be polled, leaving out those
+        # whose circuit breakers are open.
+        wanted = [(DEPTH, p) for p in bot.getDepthPairs()]
+        wanted += [(TRADES, p) for p in bot.getTradeHistoryPairs()]
+        due = scheduler.due(loopStart, wanted, bot.collectionInterval)
+        allowed = [(kind, p) for kind, p in due if self.breakers.allow(kind, p, loopStart)]
+        if len(allowed) < len(due):
+            metrics.increment("fetch_skipped_total", n=len(due) - len(allowed))
+
+        if allowed:
+            depthPairs = [p for kind, p in allowed if kind == DEPTH]
+            tradeHistoryPairs = [p for kind, p in allowed if kind == TRADES]
+
+            # Get current depth and trade history for all pairs in parallel.
+            depths, depthErrors, tradeHistories, tradeHistoryErrors = \
+                _fetchMarketData(bot, depthPairs, tradeHistoryPairs)
+            fetchEnd = time.time()
+            metrics.observe("stage_seconds", fetchEnd - loopStart, (("stage", "fetch"),))
+
+            self._recordResults(bot, DEPTH, depths, depthErrors, fetchEnd)
+            self._recordResults(bot, TRADES, tradeHistories, tradeHistoryErrors, fetchEnd)
+
+            for p, (t, asks, bids) in depths.items():
+                bot.dispatchDepth(t, p, asks, bids)
+
+            for p, (t, trades) in tradeHistories.items():
+                bot.dispatchTradeHistory(t, p, trades)
+
+            # Tell all bots that have requested it that we're at the end
+            # of an update loop.
+            bot.dispatchLoopEnd(datetime.datetime.now())
+
+            loopEnd = time.time()
+            metrics.observe("stage_seconds", loopEnd - fetchEnd, (("stage", "dispatch"),))
+            metrics.observe("loop_seconds", loopEnd - loopStart)
+            if loopEnd - loopStart > bot.collectionInterval:
+                metrics.increment("loop_overruns_total")
+
+        return scheduler.delay(time.time(), wanted, bot.collectionInterval)
+
+_CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+def _sortedLevels(levels, descending):
+    return sorted(levels.items(), reverse=descending)
+
+def _decimal(value):
+    return decimal.Decimal(str(value))
+
+class StreamingSource(MarketDataSource):
+    '''
+    Receives depth and trades for the bot's pairs over a persistent TCP
+    connection to host:port, and dispatches each update as soon as the bot
+    thread picks it up, instead of waiting for the next poll.  The feed is
+    a stream of JSON objects, one per line.  On connecting, the source
+    sends
+
+        {"subscribe": {"depth": [pairs...], "trades": [pairs...]}}
+
+    with the pairs the bot's handlers need (so traders should be added
+    before the bot is started), and the server replies with messages like
+
+        {"channel": "depth", "pair": "btc_usd", "snapshot": true,
+         "asks": [[price, amount], ...], "bids": [[price, amount], ...]}
+        {"channel": "depth", "pair": "btc_usd",
+         "asks": [[price, amount], ...], "bids": []}
+        {"channel": "trades", "pair": "btc_usd",
+         "trades": [{"tid": ..., "type": "bid", "price": ..., "amount": ...,
+                     "timestamp": ...}, ...]}
+
+    A depth snapshot replaces the book; otherwise the levels given replace
+    those at the same prices, and an amount of zero removes a level.  The
+    source keeps each book up to date and passes the whole book to the
+    depth handlers, so handlers see the same arguments as when polling.
+    Numbers may be JSON numbers or strings.
+
+    If the handlers fall behind the feed, depth updates for a pair are
+    coalesced, so only the latest book is dispatched, and trades for a
+    pair are collected into one batch of at most maxPendingTrades; older
+    trades beyond that are dropped and counted in the bot's metrics as
+    stream_trades_dropped_total.
+
+    If the connection fails, or can't be made within timeout seconds, the
+    error is passed to the bot's error handlers and the source reconnects after reconnectDelay seconds,
+    doubling the delay (up to maxReconnectDelay) while it keeps failing.
+    The time from receiving the first message of each update to finishing
+    its dispatch is recorded in the bot's metrics as
+    event_latency_seconds.
+    '''
+    def __init__(self, host, port, reconnectDelay=1.0, maxReconnectDelay=60.0, timeout=30,
+                 maxPendingTrades=10000):
+        self.host = host
+        self.port = port
+        self.reconnectDelay = reconnectDelay
+        self.maxReconnectDelay = maxReconnectDelay
+        self.timeout = timeout
+        self.maxPendingTrades = maxPendingTrades
+        # Guards books and the pending updates, which are shared by the
+        # receiving thread and the bot thread.
+        self.lock = threading.Lock()
+        # (kind, pair) -> time the first message not yet dispatched was
+        # received, in arrival order.
+        self.pending = collections.OrderedDict()
+        self.pendingTrades = {}
+        # pair -> (asks, bids), each a dict of price -> amount.
+        self.books = {}
+        self.bot = None
+        self.running = False
+        self.sock = None
+        self.thread = None
+        self.connected = threading.Event()
+        self.stopEvent = threading.Event()
+
+    def start(self, bot):
+        self.bot = bot
+        self.running = True
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self._run, name="StreamingSource")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopEvent.set()
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        # Back off exponentially, with jitter, while the feed is down.
+        breaker = CircuitBreaker(1, self.reconnectDelay, self.maxReconnectDelay)
+        while self.running:
+            breaker.allow(time.time())
+            try:
+                self._receive(breaker)
+            except:
+                if self.running:
+                    self.bot.onMarketDataError("Error in market data stream from %s:%d"
+                                               % (self.host, self.port),
+                                               traceback.format_exc())
+            self.connected.clear()
+            if self.running:
+                now = time.time()
+                breaker.failure(now)
+                self.stopEvent.wait(max(0.0, breaker.retryAt - now))
+
+    def _connect(self):
+        # Like socket.create_connection, but checks self.running while it
+        # waits, so that stop() doesn't have to wait for a connection
+        # attempt to finish or time out.  Returns None if stopped.
+        deadline = time.time() + self.timeout
+        error = socket.error("No addresses found for %s" % self.host)
+        for family, socktype, proto, name, address in socket.getaddrinfo(
+                self.host, self.port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(family, socktype, proto)
+            sock.setblocking(0)
+            err = sock.connect_ex(address)
+            while err in _CONNECT_IN_PROGRESS:
+                remaining = deadline - time.time()
+                if not self.running:
+                    sock.close()
+                    return None
+                if remaining <= 0:
+                    err = errno.ETIMEDOUT
+                    break
+                r, w, x = select.select([], [sock], [sock], min(0.25, remaining))
+                if w or x:
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err == 0:
+                sock.setblocking(1)
+                return sock
+            sock.close()
+            error = socket.error(err, os.strerror(err))
+        raise error
+
+    def _receive(self, breaker):
+        bot = self.bot
+        sock = self._connect()
+        if sock is None:
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        stream = None
+        try:
+            if not self.running:
+                # stop() was called before it could see the socket.
+                return
+            request = {"subscribe": {"depth": sorted(bot.getDepthPairs()),
+                                     "trades": sorted(bot.getTradeHistoryPairs())}}
+            sock.sendall(json.dumps(request) + "\n")
+            # Books from before a reconnection may be out of date.
+            with self.lock:
+                self.books = {}
+            self.connected.set()
+            breaker.success()
+
+            stream = sock.makefile("rb")
+            while self.running:
+                line = stream.readline()
+                if not line:
+                    if self.running:
+                        raise Exception("Market data stream closed by server")
+                    return
+                line = line.strip()
+                if line:
+                    self._handleMessage(json.loads(line), time.time())
+        finally:
+            self.sock = None
+            if stream is not None:
+                stream.close()
+            sock.close()
+
+    def _handleMessage(self, message, received):
+        channel = message.get("channel")
+        pair = message.get("pair")
+        if channel == "depth":
+            updates = [[(_decimal(price), _decimal(amount)) for price, amount in message.get(side, ())]
+                       for side in ("asks", "bids")]
+            with self.lock:
+                book = self.books.get(pair)
+                if book is None or message.get("snapshot"):
+                    book = self.books[pair] = ({}, {})
+                for levels, changes in zip(book, updates):
+                    for price, amount in changes:
+                        if amount:
+                            levels[price] = amount
+                        else:
+                            levels.pop(price, None)
+                self.pending.setdefault((DEPTH, pair), received)
+        elif channel == "trades":
+            trades = [Trade(pair=pair,
+                            type=t["type"],
+                            price=_decimal(t["price"]),
+                            tid=int(t["tid"]),
+                            amount=_decimal(t["amount"]),
+                            timestamp=int(t["timestamp"]))
+                      for t in message.get("trades", ())]
+            with self.lock:
+                pending = self.pendingTrades.setdefault(pair, [])
+                pending.extend(trades)
+                dropped = len(pending) - self.maxPendingTrades
+                if dropped > 0:
+                    del pending[:dropped]
+                self.pending.setdefault((TRADES, pair), received)
+            if dropped > 0:
+                self.bot.metrics.increment("stream_trades_dropped_total", (("pair", pair),),
+                                           dropped)
+        else:
+            return
+        self.bot.wake()
+
+    def update(self, bot):
+        if self.pending:
+            # Take everything pending, building each book only once however
+            # many updates to it arrived since the last time.
+            events = []
+            with self.lock:
+                for (kind, pair), received in self.pending.items():
+                    if kind == DEPTH:
+                        book = self.books.get(pair)
+                        if book is None:
+                            continue
+                        data = (_sortedLevels(book[0], False), _sortedLevels(book[1], True))
+                    else:
+                        data = self.pendingTrades.pop(pair, [])
+                    events.append((kind, pair, received, data))
+                self.pending.clear()
+
+            metrics = bot.metrics
+            for kind, pair, received, data in events:
+                t = datetime.datetime.fromtimestamp(received)
+                if kind == DEPTH:
+                    asks, bids = data
+                    bot.dispatchDepth(t, pair, asks, bids)
+                else:
+                    bot.dispatchTradeHistory(t, pair, data)
+                metrics.observe("event_latency_seconds", time.time() - received,
+                                (("kind", kind),))
+            bot.dispatchLoopEnd(datetime.datetime.now())
+
+        # Nothing to do until the next message arrives, but check back
+        # now and then so metrics are still reported.
+        return bot.collectionInterval
@@ -0,0 +1,102 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import collections
+import itertools
+import operator
+
+from dedup import TidWindow
+
+_byTid = operator.attrgetter("tid")
+
+class TradeBuffer(object):
+    '''
+    Time-ordered buffer of recent trades for a single pair.  Trades are
+    kept oldest first in a deque, so expired trades are evicted from the
+    head and new trades are appended to the tail without touching the rest
+    of the buffer.  Duplicates are rejected by a TidWindow, which relies on
+    trade ids increasing monotonically instead of keeping a set of every
+    id in the buffer; a trade that shows up late, within the window, is
+    still added in its place.
+
+    If convert is given, it is applied to each new trade before it is
+    added to the buffer.
+    '''
+    def __init__(self, convert=None, window=1000):
+        self.items = collections.deque()
+        self.seen = TidWindow(window)
+        self.convert = convert
+
+    @property
+    def lastTid(self):
+        return self.seen.highWater
+
+    def add(self, history):
+        '''Add the trades in history that have not been seen before, and
+        return them as a list, oldest first.'''
+        lastTid = self.seen.highWater
+        newItems = self.seen.filter(history)
+
+        if newItems:
+            if self.convert is not None:
+                newItems = map(self.convert, newItems)
+            items = self.items
+            if lastTid is not None and newItems[0].tid < lastTid:
+                # Some trades arrived late, so put them in order; the
+                # deque is updated in place since the bot shares it.
+                merged = sorted(list(items) + newItems, key=_byTid)
+                items.clear()
+                items.extend(merged)
+            else:
+                items.extend(newItems)
+
+        return newItems
+
+    def expire(self, cutoff):
+        '''Remove trades with a timestamp earlier than cutoff.'''
+        items = self.items
+        while items and items[0].timestamp < cutoff:
+            items.popleft()
+
+class TradeView(object):
+    '''
+    Read-only view of a sequence of trades, such as a TradeBuffer's deque,
+    as passed to onNewTradeHistory handlers.  It supports len(), iteration
+    (also reversed) and indexing; slicing returns a list, so recent
+    trades can be taken with trades[-20:] without copying the whole
+    buffer.
+    '''
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        self._items = items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def __getitem__(self, index):
+        items = self._items
+        if not isinstance(index, slice):
+            return items[index]
+        n = len(items)
+        indices = xrange(*index.indices(n))
+        if not indices:
+            return []
+        lo, hi = min(indices[0], indices[-1]), max(indices[0], indices[-1]) + 1
+        # Walk in from whichever end is nearer.
+        if n - hi < lo:
+            segment = list(itertools.islice(reversed(items), n - hi, n - lo))
+            segment.reverse()
+        else:
+            segment = list(itertools.islice(items, lo, hi))
+        if index.step is None or index.step == 1:
+            return segment
+        return [segment[i - lo] for i in indices]
+
+    def __repr__(self):
+        return "TradeView(%r)" % (list(self._items),)
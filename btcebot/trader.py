@@ -7,9 +7,34 @@ class TraderBase(object):
     def onNewDepth(self, t, pair, asks, bids):
         pass
 
+    # added, removed and modified are lists of (side, price, amount)
+    # tuples describing how the book has changed since the previous
+    # update, where side is "ask" or "bid".
+    def onDepthChange(self, t, pair, added, removed, modified):
+        pass
+
+    # trades is a read-only tradebuffer.TradeView of the bot's buffer of
+    # recent trades for the pair, oldest first.  It supports len(),
+    # iteration and indexing, and slices (such as trades[-20:]) are lists.
     def onNewTradeHistory(self, t, pair, trades):
         pass
+
+    # trades is a list of only the trades that have appeared since the
+    # previous update, oldest first.
+    def onNewTrades(self, t, pair, trades):
+        pass
+
+    # snapshot is a MarketSnapshot of the pair as of the end of the loop,
+    # shared between traders, which computes values such as the spread,
+    # mid price and VWAP once for all of them.
+    def onNewSnapshot(self, t, pair, snapshot):
+        pass
         
+    # bar is a Bar that has just been completed, at one of the bot's bar
+    # resolutions (bar.resolution, in seconds).
+    def onNewBar(self, t, pair, bar):
+        pass
+
     def onLoopEnd(self, t):
         pass
     
@@ -0,0 +1,219 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Bulk export and import of MarketDatabase trade history and depth, for
+moving large amounts of data in and out faster than the row-by-row
+retrieve and insert methods allow.  See samples/market-data-tool.py for
+the command-line interface.
+'''
+
+import csv
+import datetime
+import decimal
+import multiprocessing
+import os
+import time
+
+from columnar import ColumnarTradeStore
+from database import MarketDatabase
+from fixedpoint import fromScaled, toScaled
+
+TRADE_COLUMNS = ("tid", "pair", "type", "price", "amount", "timestamp")
+DEPTH_COLUMNS = ("timestamp", "pair", "side", "price", "amount")
+
+def _chunks(start, end, chunkSeconds):
+    # Split [start, end] (seconds since the epoch) into consecutive
+    # inclusive ranges of at most chunkSeconds.
+    chunks = []
+    while start <= end:
+        chunkEnd = min(end, start + chunkSeconds - 1)
+        chunks.append((start, chunkEnd))
+        start = chunkEnd + 1
+    return chunks
+
+def _chunkName(start):
+    return datetime.datetime.fromtimestamp(start).strftime("%Y%m%d-%H%M%S")
+
+def _exportTradesCSV(args):
+    database_path, directory, pair, start, end = args
+    db = MarketDatabase(database_path, None)
+    try:
+        columns = db.retrieveTradeHistoryArrays(start, end, pair)
+        types = db.index_to_tradetype
+        path = os.path.join(directory, pair, "trades-%s.csv" % _chunkName(start))
+        with open(path, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(TRADE_COLUMNS)
+            writer.writerows((tid, pair, types[trade_type], fromScaled(price), fromScaled(amount), timestamp)
+                             for tid, timestamp, price, amount, trade_type in
+                             zip(columns["tid"].tolist(), columns["timestamp"].tolist(),
+                                 columns["price"].tolist(), columns["amount"].tolist(),
+                                 columns["type"].tolist()))
+        return len(columns["tid"])
+    finally:
+        db.close()
+
+def _exportDepthCSV(args):
+    database_path, directory, pair, start, end = args
+    # Depth timestamps have fractions of a second, so take everything
+    # before the start of the next chunk rather than up to end.
+    nextStart = datetime.datetime.fromtimestamp(end + 1)
+    db = MarketDatabase(database_path, None)
+    try:
+        snapshots = 0
+        path = os.path.join(directory, pair, "depth-%s.csv" % _chunkName(start))
+        with open(path, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(DEPTH_COLUMNS)
+            for d, asks, bids in db.retrieveDepth(datetime.datetime.fromtimestamp(start),
+                                                  nextStart, pair):
+                if d >= nextStart:
+                    break
+                timestamp = d.strftime("%Y-%m-%d %H:%M:%S")
+                writer.writerows((timestamp, pair, "ask", price, amount) for price, amount in asks)
+                writer.writerows((timestamp, pair, "bid", price, amount) for price, amount in bids)
+                snapshots += 1
+        return snapshots
+    finally:
+        db.close()
+
+def _exportTradesColumnar(args):
+    # A columnar store can only be appended to in tid order, which may not
+    # be quite the same as timestamp order, so each pair is exported by one
+    # worker reading its trades in tid order.
+    database_path, directory, pair, start, end, batchSize = args
+    db = MarketDatabase(database_path, None)
+    all_pairs = [db.index_to_pair[i] for i in sorted(db.index_to_pair)]
+    store = ColumnarTradeStore(directory, all_pairs)
+    count = 0
+    try:
+        batch = []
+        for row in db.retrieveTradeTuples(start, end, pair, batchSize):
+            batch.append(row)
+            if len(batch) >= batchSize:
+                count += store.insertTradeHistory(batch)
+                batch = []
+        count += store.insertTradeHistory(batch)
+        return count
+    finally:
+        store.close()
+        db.close()
+
+def exportMarketData(database_path, directory, pairs, start, end, format="csv", depth=False,
+                     chunkSeconds=86400, processes=None):
+    '''
+    Export the trade history of each of pairs with a timestamp in [start,
+    end] (seconds since the epoch) from the MarketDatabase at
+    database_path into directory, using a pool of worker processes (one
+    per CPU by default).
+
+    With format "csv", each pair gets a subdirectory of CSV files, each
+    covering chunkSeconds, with the columns in TRADE_COLUMNS; these can be
+    read back with importTradeHistory.  If depth is True, depth snapshots
+    are also exported, one row per price level with the columns in
+    DEPTH_COLUMNS.  With format "columnar", the trades are written to a
+    ColumnarTradeStore in directory (depth is not supported), skipping any
+    it already holds.
+
+    Returns the number of trades exported (and of depth snapshots, if
+    depth is True) as a tuple.
+    '''
+    if format not in ("csv", "columnar"):
+        raise Exception("Unknown export format: %r" % format)
+    if format == "columnar" and depth:
+        raise Exception("Depth can only be exported as CSV")
+    if not os.path.isfile(database_path):
+        raise Exception("Market database not found: %s" % database_path)
+
+    chunks = _chunks(int(start), int(end), chunkSeconds)
+    for pair in pairs:
+        pairDirectory = os.path.join(directory, pair)
+        if format == "csv" and not os.path.isdir(pairDirectory):
+            os.makedirs(pairDirectory)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        if format == "csv":
+            jobs = [(database_path, directory, pair, s, e) for pair in pairs for s, e in chunks]
+            trades = sum(pool.map(_exportTradesCSV, jobs, chunksize=1))
+            snapshots = sum(pool.map(_exportDepthCSV, jobs, chunksize=1)) if depth else 0
+        else:
+            jobs = [(database_path, directory, pair, int(start), int(end), 100000)
+                    for pair in pairs]
+            trades = sum(pool.map(_exportTradesColumnar, jobs, chunksize=1))
+            snapshots = 0
+    finally:
+        pool.close()
+        pool.join()
+    return trades, snapshots
+
+def _readTrades(paths, pair_to_index, tradetype_to_index):
+    for path in paths:
+        with open(path, "rb") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                continue
+            if tuple(header) != TRADE_COLUMNS:
+                raise Exception("%s: expected columns %s, found %s"
+                                % (path, ",".join(TRADE_COLUMNS), ",".join(header)))
+            for tid, pair, trade_type, price, amount, timestamp in reader:
+                try:
+                    pair_index = pair_to_index[pair]
+                except KeyError:
+                    raise Exception("%s: unknown pair %r" % (path, pair))
+                yield (int(tid), pair_index, tradetype_to_index[trade_type],
+                       toScaled(decimal.Decimal(price)), toScaled(decimal.Decimal(amount)),
+                       int(timestamp))
+
+def importTradeHistory(database_path, paths, all_pairs=None, batchSize=50000,
+                       deferIndexes=True, progress=None):
+    '''
+    Load trades from CSV files with the columns in TRADE_COLUMNS (such as
+    those written by exportMarketData) into the MarketDatabase at
+    database_path, creating it with all_pairs if it doesn't exist.  Rows are inserted with
+    executemany in transactions of batchSize rows, and trades whose id is
+    already stored are skipped.  If deferIndexes is True, the time index
+    is dropped for the duration and rebuilt at the end, which is much
+    faster than updating it row by row.
+
+    progress, if given, is called with (rows read, rows inserted, seconds
+    elapsed) after each batch.  Returns the same tuple for the whole
+    import.
+    '''
+    if all_pairs is None and not os.path.isfile(database_path):
+        raise Exception("Pairs must be given to create %s" % database_path)
+    db = MarketDatabase(database_path, all_pairs)
+    connection = db.connection
+    start = time.time()
+    read = 0
+    try:
+        # Nothing is lost if the import is interrupted, since it can be
+        # run again, so don't wait for the disk on every commit.
+        connection.execute("PRAGMA synchronous = OFF")
+        if deferIndexes:
+            connection.execute("DROP INDEX IF EXISTS trade_history_pair_timestamp")
+        changes = connection.total_changes
+
+        batch = []
+        for row in _readTrades(paths, db.pair_to_index, db.tradetype_to_index):
+            batch.append(row)
+            if len(batch) >= batchSize:
+                connection.executemany("INSERT OR IGNORE INTO trade_history VALUES(?, ?, ?, ?, ?, ?)", batch)
+                connection.commit()
+                read += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(read, connection.total_changes - changes, time.time() - start)
+        if batch:
+            connection.executemany("INSERT OR IGNORE INTO trade_history VALUES(?, ?, ?, ?, ?, ?)", batch)
+            connection.commit()
+            read += len(batch)
+        inserted = connection.total_changes - changes
+    finally:
+        if deferIndexes:
+            db.createIndexes()
+            connection.commit()
+        db.close()
+
+    return read, inserted, time.time() - start
@@ -0,0 +1,145 @@
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import bisect
+import itertools
+import threading
+
+from fixedpoint import fromScaled, toScaled
+
+ASK = "ask"
+BID = "bid"
+
+class PriceTrigger(object):
+    '''
+    A rule that fires when the best price on one side of a pair's book
+    crosses a threshold: when the best ask falls to price or below (side
+    "ask"), or when the best bid rises to price or above (side "bid").
+    '''
+    __slots__ = ('pair', 'side', 'scaledPrice', 'handler', 'once', 'key', 'fired')
+
+    def __init__(self, pair, side, scaledPrice, handler, once, key):
+        self.pair = pair
+        self.side = side
+        self.scaledPrice = scaledPrice
+        self.handler = handler
+        self.once = once
+        self.key = key
+        self.fired = 0
+
+    @property
+    def price(self):
+        return fromScaled(self.scaledPrice)
+
+    def __repr__(self):
+        return "PriceTrigger(pair=%r, side=%r, price=%s, handler=%r, once=%r)" % (
+            self.pair, self.side, self.price, self.handler, self.once)
+
+class PriceTriggers(object):
+    '''
+    Registry of PriceTriggers, kept sorted by threshold for each pair and
+    side.  When the best prices change, the triggers crossed are found by
+    bisecting the thresholds between the old and new best prices, so the
+    cost of an update depends on the number of triggers that fire rather
+    than the number registered.
+
+    A trigger fires each time the price crosses its threshold; it has to
+    move back across before the trigger can fire again.  A new trigger
+    whose condition already holds fires on the next update.  Triggers may
+    be added and removed from any thread.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (pair, side) -> sorted list of (scaledPrice, sequence number)
+        # keys, and key -> trigger.
+        self.keys = {}
+        self.triggers = {}
+        # Triggers added since the last update, which are checked directly.
+        self.pending = []
+        self.sequence = itertools.count()
+        # pair -> (best ask, best bid) as of the last update.
+        self.best = {}
+
+    def add(self, pair, side, price, handler, once=False):
+        '''Register handler to be called when the best price on side (ask
+        or bid) of pair crosses price, and return the new PriceTrigger.  If
+        once is True, it is removed after it first fires.'''
+        if side not in (ASK, BID):
+            raise Exception("Unknown side: %r" % side)
+        scaledPrice = toScaled(price)
+        with self.lock:
+            key = (scaledPrice, next(self.sequence))
+            trigger = PriceTrigger(pair, side, scaledPrice, handler, once, key)
+            bisect.insort(self.keys.setdefault((pair, side), []), key)
+            self.triggers[key] = trigger
+            self.pending.append(trigger)
+        return trigger
+
+    def remove(self, trigger):
+        '''Unregister a trigger; does nothing if it was already removed.'''
+        with self.lock:
+            self._remove(trigger)
+
+    def _remove(self, trigger):
+        # Called with the lock held.
+        if self.triggers.pop(trigger.key, None) is None:
+            return
+        keys = self.keys[(trigger.pair, trigger.side)]
+        del keys[bisect.bisect_left(keys, trigger.key)]
+
+    def pairs(self):
+        '''Return the set of pairs with triggers.'''
+        with self.lock:
+            return set(pair for (pair, side), keys in self.keys.items() if keys)
+
+    def update(self, pair, bestAsk, bestBid):
+        '''Record the new best ask and bid of pair (fixed-point integers, or
+        None for an empty side), and return the list of triggers that this
+        change crossed.  Triggers added with once=True are removed.'''
+        with self.lock:
+            return self._update(pair, bestAsk, bestBid)
+
+    def _update(self, pair, bestAsk, bestBid):
+        oldAsk, oldBid = self.best.get(pair, (None, None))
+        self.best[pair] = (bestAsk, bestBid)
+        fired = []
+        triggers = self.triggers
+
+        keys = self.keys.get((pair, ASK))
+        if keys and bestAsk is not None and (oldAsk is None or bestAsk < oldAsk):
+            # Thresholds in [bestAsk, oldAsk) have been crossed.
+            lo = bisect.bisect_left(keys, (bestAsk,))
+            hi = len(keys) if oldAsk is None else bisect.bisect_left(keys, (oldAsk,))
+            fired.extend(triggers[k] for k in keys[lo:hi])
+
+        keys = self.keys.get((pair, BID))
+        if keys and bestBid is not None and (oldBid is None or bestBid > oldBid):
+            # Thresholds in (oldBid, bestBid] have been crossed.
+            lo = 0 if oldBid is None else bisect.bisect_right(keys, (oldBid, float("inf")))
+            hi = bisect.bisect_right(keys, (bestBid, float("inf")))
+            fired.extend(triggers[k] for k in keys[lo:hi])
+
+        if self.pending:
+            # New triggers only have to hold now, but skip those that were
+            # crossed above anyway.
+            pending = []
+            for trigger in self.pending:
+                if trigger.pair != pair:
+                    pending.append(trigger)
+                    continue
+                if trigger.key not in triggers:
+                    continue
+                if trigger.side == ASK:
+                    holds = bestAsk is not None and bestAsk <= trigger.scaledPrice
+                    crossed = holds and (oldAsk is None or trigger.scaledPrice < oldAsk)
+                else:
+                    holds = bestBid is not None and bestBid >= trigger.scaledPrice
+                    crossed = holds and (oldBid is None or trigger.scaledPrice > oldBid)
+                if holds and not crossed:
+                    fired.append(trigger)
+            self.pending = pending
+
+        for trigger in fired:
+            trigger.fired += 1
+            if trigger.once:
+                self._remove(trigger)
+        return fired
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+import datetime
+import decimal
+
+import btcebot
+
+class PaperRangeTrader(btcebot.TraderBase):
+    '''
+    A paper-trading version of the RangeTrader in hello-world-bot.py: it
+    "buys" with all of its cash when the ask is at or below buy_price, and
+    "sells" all of its coins when the bid is at or above sell_price, without
+    placing any orders.
+    '''
+    def __init__(self, pair, buy_price, sell_price, cash):
+        btcebot.TraderBase.__init__(self, (pair,))
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+        self.cash = cash
+        self.coins = decimal.Decimal(0)
+        self.last_bid = None
+        self.trade_count = 0
+
+    def onNewDepth(self, t, pair, asks, bids):
+        ask_price, ask_amount = asks[0]
+        bid_price, bid_amount = bids[0]
+        self.last_bid = bid_price
+        if ask_price <= self.buy_price and self.cash > 0:
+            self.coins += self.cash / ask_price
+            self.cash = decimal.Decimal(0)
+            self.trade_count += 1
+        elif bid_price >= self.sell_price and self.coins > 0:
+            self.cash += self.coins * bid_price
+            self.coins = decimal.Decimal(0)
+            self.trade_count += 1
+
+# These two functions are sent to the sweep's worker processes, so they
+# must be defined at module level.
+def makeBot(api, params):
+    pair, buy_price, sell_price = params
+    bot = btcebot.Bot(api)
+    bot.addTrader(PaperRangeTrader(pair, buy_price, sell_price, decimal.Decimal(1000)))
+    return bot
+
+def evaluate(bot):
+    trader, = bot.traders
+    value = trader.cash
+    if trader.last_bid is not None:
+        value += trader.coins * trader.last_bid
+    return value, trader.trade_count
+
+def run(database_path, pair, start, end, buy_prices, sell_prices):
+    # Replay the recorded data once for every combination of buy and sell
+    # price, in parallel.
+    params = [(pair, b, s) for b in buy_prices for s in sell_prices if b < s]
+    results = btcebot.runSweep(makeBot, evaluate, database_path, start, end, params)
+    for (pair, buy_price, sell_price), (value, trade_count) in results:
+        print "buy %s sell %s: final value %.2f after %d trades" % (
+            buy_price, sell_price, value, trade_count)
+
+if __name__ == '__main__':
+    import argparse
+
+    def date(s):
+        return datetime.datetime.strptime(s, "%Y-%m-%d")
+
+    def prices(s):
+        return [decimal.Decimal(p) for p in s.split(",")]
+
+    parser = argparse.ArgumentParser(description='Backtest a range trader against logged data.')
+    parser.add_argument('--db-path', default='btce.db',
+                        help='Path to a database written by logger-bot.py.')
+    parser.add_argument('--pair', default='ltc_usd',
+                        help='Pair to trade.')
+    parser.add_argument('start', type=date, help='First day to replay (YYYY-MM-DD).')
+    parser.add_argument('end', type=date, help='Last day to replay (YYYY-MM-DD).')
+    parser.add_argument('buy_prices', type=prices,
+                        help='Comma-separated buy prices to try.')
+    parser.add_argument('sell_prices', type=prices,
+                        help='Comma-separated sell prices to try.')
+
+    args = parser.parse_args()
+    run(args.db_path, args.pair, args.start, args.end + datetime.timedelta(days=1),
+        args.buy_prices, args.sell_prices)
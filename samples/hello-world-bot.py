@@ -15,9 +15,22 @@ class RangeTrader(btcebot.TraderBase):
     at your own risk (and remember this is just a sample, not a recommendation
     on how to make money trading using this framework).
     '''
-    def __init__(self, api, pair, buy_price, sell_price, live_trades = False):
+    def __init__(self, api, pair, buy_price, sell_price, live_trades = False,
+                 connection_pool = None, account = None):
         btcebot.TraderBase.__init__(self, (pair,))
         self.api = api
+        # Reuse open connections for trading calls so that placing an order
+        # doesn't have to wait for a new connection handshake.
+        if connection_pool is None:
+            connection_pool = btcebot.ConnectionPool()
+        self.connection_pool = connection_pool
+        # Balances are read from a cache that is kept up to date in the
+        # background, instead of asking the API for them before each order.
+        # Without an API (as when benchmarking) there is nothing to cache.
+        if account is None and api is not None:
+            account = btcebot.AccountState(api, connection_pool)
+            account.start()
+        self.account = account
         self.pair = pair
         self.buy_price = buy_price
         self.sell_price = sell_price
@@ -32,43 +45,53 @@ class RangeTrader(btcebot.TraderBase):
         self.fee_adjustment = decimal.Decimal("0.998")
         
     def _attemptBuy(self, price, amount):
-        conn = btceapi.BTCEConnection()
-        info = self.api.getInfo(conn)
+        with self.connection_pool.connection() as conn:
+            self._buy(conn, price, amount)
+
+    def _buy(self, conn, price, amount):
         curr1, curr2 = self.pair.split("_")
         
         # Limit order to what we can afford to buy.
-        available = getattr(info, "balance_" + curr2)
+        available = self.account.getBalance(curr2)
+        if available is None:
+            print "balances not known yet; skipping buy"
+            return
         max_buy = available / price
         buy_amount = min(max_buy, amount) * self.fee_adjustment
         if buy_amount >= btceapi.min_orders[self.pair]:
             print "attempting to buy %s %s at %s for %s %s" % (buy_amount, 
                 curr1.upper(), price, buy_amount*price, curr2.upper())
             if self.live_trades:
-                r = self.api.trade(self.pair, "buy", price, buy_amount, conn)
+                r = self.account.trade(self.pair, "buy", price, buy_amount, conn)
                 print "\tReceived %s %s" % (r.received, curr1.upper())
                 # If the order didn't fill completely, cancel the remaining order
                 if r.order_id != 0:
                     print "\tCanceling unfilled portion of order"
-                    self.api.cancelOrder(r.order_id, conn)
+                    self.account.cancelOrder(r.order_id, conn)
 
     def _attemptSell(self, price, amount):
-        conn = btceapi.BTCEConnection()
-        info = self.api.getInfo(conn)
+        with self.connection_pool.connection() as conn:
+            self._sell(conn, price, amount)
+
+    def _sell(self, conn, price, amount):
         curr1, curr2 = self.pair.split("_")
         
         # Limit order to what we have available to sell.
-        available = getattr(info, "balance_" + curr1)
+        available = self.account.getBalance(curr1)
+        if available is None:
+            print "balances not known yet; skipping sell"
+            return
         sell_amount = min(available, amount) * self.fee_adjustment
         if sell_amount >= btceapi.min_orders[self.pair]:
             print "attempting to sell %s %s at %s for %s %s" % (sell_amount,
                 curr1.upper(), price, sell_amount*price, curr2.upper())
             if self.live_trades:
-                r = self.api.trade(self.pair, "sell", price, sell_amount, conn)
+                r = self.account.trade(self.pair, "sell", price, sell_amount, conn)
                 print "\tReceived %s %s" % (r.received, curr2.upper())
                 # If the order didn't fill completely, cancel the remaining order
                 if r.order_id != 0:
                     print "\tCanceling unfilled portion of order"
-                    self.api.cancelOrder(r.order_id, conn)
+                    self.account.cancelOrder(r.order_id, conn)
             
     # This overrides the onNewDepth method in the TraderBase class, so the 
     # framework will automatically pick it up and send updates to it.
@@ -94,11 +117,23 @@ def run(key_file, buy_floor, sell_ceiling, live_trades):
     print "Trading with key %s" % key
     api = btceapi.TradeAPI(key, handler)
             
-    # Create a trader that handles LTC/USD trades in the given range.
-    trader = RangeTrader(api, "ltc_usd", buy_floor, sell_ceiling, live_trades)
-
-    # Create a bot and add the trader to it.
+    # Create a bot.
     bot = btcebot.Bot()
+
+    # Placing orders blocks, so run the trader on a thread of its own
+    # rather than holding up the bot's market data loop.
+    bot.setTraderLanes()
+
+    # Keep the account's balances and open orders cached, refreshing them
+    # in the background.
+    account = btcebot.AccountState(api, bot.connectionPool)
+    account.addErrorHandler(onBotError)
+    account.start()
+
+    # Create a trader that handles LTC/USD trades in the given range, and
+    # let it share the bot's connection pool and account state.
+    trader = RangeTrader(api, "ltc_usd", buy_floor, sell_ceiling, live_trades,
+                         bot.connectionPool, account)
     bot.addTrader(trader)
     
     # Add an error handler so we can print info about any failures
@@ -120,6 +155,7 @@ def run(key_file, buy_floor, sell_ceiling, live_trades):
         print "Stopping..."
     finally:    
         bot.stop()
+        account.stop()
         
 if __name__ == '__main__':
     import argparse
@@ -11,22 +11,39 @@ class MarketDataLogger(btcebot.TraderBase):
     This "trader" simply logs all of the updates it receives from the bot.
     '''
     
-    def __init__(self, api, pairs, database_path):
+    def __init__(self, api, pairs, database_path, metrics=None, partition=None):
         self.api = api
         btcebot.TraderBase.__init__(self, pairs)
         self.database_path = database_path
+        self.metrics = metrics
+        self.partition = partition
         self.db = None
-        self.trade_history_seen = {}
        
     def getDB(self):
         # The database is lazily created here instead of the constructor
         # so that it can be created and used in the bot's thread.
         if self.db is None:
-            self.db = btcebot.MarketDatabase(self.database_path, self.api.pair_names)
+            # Inserts are committed in batches by a background thread, so
+            # the bot loop doesn't wait on the disk.  Most depth snapshots
+            # are stored as the difference from the last full snapshot.
+            if self.partition is not None:
+                # Start a new file every day or week, and after a week
+                # keep only one depth snapshot per minute.
+                self.db = btcebot.PartitionedMarketDatabase(
+                    self.database_path, self.api.pair_names, self.partition,
+                    depthDownsampleDays=7, depthDownsampleInterval=60,
+                    writeBehind=True, depthKeyframeInterval=60,
+                    metrics=self.metrics)
+            else:
+                self.db = btcebot.MarketDatabase(self.database_path, self.api.pair_names,
+                                                 writeBehind=True,
+                                                 depthKeyframeInterval=60,
+                                                 metrics=self.metrics)
 
         return self.db
     
     def onExit(self):
+        # Closing the database waits for any queued inserts to be written.
         if self.db is not None:
             self.db.close()
        
@@ -36,16 +53,17 @@ class MarketDataLogger(btcebot.TraderBase):
         print "%s Entering new %s depth" % (t, pair)
         self.getDB().insertDepth(t, pair, asks, bids)
 
-    # This overrides the onNewTradeHistory method in the TraderBase class, so the 
-    # framework will automatically pick it up and send updates to it.
-    def onNewTradeHistory(self, t, pair, trades):
-        history = self.trade_history_seen.setdefault(pair, set())
-        
-        new_trades = filter(lambda trade: trade.tid not in history, trades)
-        if new_trades:
-            print "%s Entering %d new %s trades" % (t, len(new_trades), pair)
-            self.getDB().insertTradeHistory(new_trades)
-            history.update(t.tid for t in new_trades)
+    # This overrides the onNewTrades method in the TraderBase class, so the
+    # framework will automatically pick it up and send it only the trades
+    # it hasn't seen before, instead of the whole trade buffer.
+    def onNewTrades(self, t, pair, trades):
+        print "%s Entering %d new %s trades" % (t, len(trades), pair)
+        self.getDB().insertTradeHistory(trades)
+
+    # Completed candles are stored in the database's bar rollups as they
+    # are built, so charts don't have to scan the raw trades.
+    def onNewBar(self, t, pair, bar):
+        self.getDB().insertBars([bar])
         
        
 def onBotError(msg, tracebackText):
@@ -54,16 +72,24 @@ def onBotError(msg, tracebackText):
     open("logger-bot-error.log", "a").write(
         "%s - %s\n%s\n%s\n" % (tstr, msg, tracebackText, "-"*80))
             
-def run(database_path):
+def run(database_path, metrics_port=None, partition=None):
     conn = btceapi.BTCEConnection()
     api = btceapi.APIInfo(conn)
-    #logger = MarketDataLogger(api.pair_names, database_path)
-    logger = MarketDataLogger(api, ("btc_usd", "ltc_usd"), database_path)
 
-    # Create a bot and add the logger to it.
-    bot = btcebot.Bot(api)
+    # Create a bot and add the logger to it.  The logger only passes trades
+    # through to the database, so let the bot keep them in fixed-point form.
+    bot = btcebot.Bot(api, fixedPoint=True)
+    #logger = MarketDataLogger(api.pair_names, database_path)
+    logger = MarketDataLogger(api, ("btc_usd", "ltc_usd"), database_path,
+                              bot.metrics, partition)
     bot.addTrader(logger)
 
+    # Optionally serve the bot's timings for Prometheus to scrape.
+    server = None
+    if metrics_port is not None:
+        server = btcebot.MetricsServer(bot.metrics, metrics_port)
+        server.start()
+
     # Add an error handler so we can print info about any failures
     bot.addErrorHandler(onBotError)    
 
@@ -83,6 +109,8 @@ def run(database_path):
         print "Stopping..."
     finally:    
         bot.stop()
+        if server is not None:
+            server.stop()
             
         
 if __name__ == '__main__':
@@ -90,6 +118,11 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Data logging example.')
     parser.add_argument('--db-path', default='btce.db',
                         help='Path to the logger database.')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve metrics over HTTP on this port.')
+    parser.add_argument('--partition', choices=('day', 'week'),
+                        help='Store data in a new database file every day or week, '
+                             'in the directory given by --db-path.')
 
     args = parser.parse_args()
-    run(args.db_path)
+    run(args.db_path, args.metrics_port, args.partition)
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# Copyright (c) 2013-2017 CodeReclaimers, LLC
+
+'''
+Exports market data recorded by logger-bot.py to CSV or columnar files, and
+bulk-imports trade history dumps into a market database.
+
+    market-data-tool.py export btce.db out --pairs btc_usd,ltc_usd --start 2017-01-01 --end 2017-02-01
+    market-data-tool.py import btce.db out/btc_usd/*.csv
+'''
+
+import datetime
+import sys
+import time
+
+import btcebot
+
+def parseTime(text):
+    '''Convert a local date, a local date and time, or seconds since the
+    epoch to seconds since the epoch.'''
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(datetime.datetime.strptime(text, fmt).timetuple()))
+        except ValueError:
+            pass
+    return int(text)
+
+def export(args):
+    pairs = args.pairs.split(",")
+    end = parseTime(args.end) if args.end else int(time.time())
+    start = time.time()
+    trades, snapshots = btcebot.exportMarketData(args.db_path, args.directory, pairs,
+                                                 parseTime(args.start), end, args.format,
+                                                 args.depth, args.chunk_hours * 3600,
+                                                 args.processes)
+    elapsed = time.time() - start
+    print "Exported %d trades and %d depth snapshots in %.1f s (%.0f trades/s)" % (
+        trades, snapshots, elapsed, trades / max(elapsed, 1e-6))
+
+def progress(read, inserted, elapsed):
+    print "%d rows read, %d inserted (%.0f rows/s)" % (read, inserted, read / max(elapsed, 1e-6))
+    sys.stdout.flush()
+
+def bulkImport(args):
+    all_pairs = args.pairs.split(",") if args.pairs else None
+    read, inserted, elapsed = btcebot.importTradeHistory(args.db_path, args.files, all_pairs,
+                                                         args.batch_size, not args.keep_indexes,
+                                                         progress)
+    print "Imported %d of %d rows in %.1f s (%.0f rows/s); %d were already stored" % (
+        inserted, read, elapsed, read / max(elapsed, 1e-6), read - inserted)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Export or bulk-import market data.')
+    commands = parser.add_subparsers()
+
+    p = commands.add_parser('export', help='Export trade history (and optionally depth).')
+    p.add_argument('db_path', help='Path to the market database.')
+    p.add_argument('directory', help='Directory to write the exported files to.')
+    p.add_argument('--pairs', required=True,
+                   help='Comma-separated pairs to export.')
+    p.add_argument('--start', required=True,
+                   help='Start of the range: YYYY-MM-DD, "YYYY-MM-DD HH:MM:SS" or epoch seconds.')
+    p.add_argument('--end', help='End of the range, in the same forms (default: now).')
+    p.add_argument('--format', choices=('csv', 'columnar'), default='csv',
+                   help='Write chunked CSV files, or a columnar trade store.')
+    p.add_argument('--depth', default=False, action='store_true',
+                   help='Also export depth snapshots (CSV only).')
+    p.add_argument('--chunk-hours', type=int, default=24,
+                   help='Hours of data in each CSV file.')
+    p.add_argument('--processes', type=int,
+                   help='Worker processes to use (default: one per CPU).')
+    p.set_defaults(func=export)
+
+    p = commands.add_parser('import', help='Bulk-import trade history CSV files.')
+    p.add_argument('db_path', help='Path to the market database.')
+    p.add_argument('files', nargs='+',
+                   help='CSV files with the columns tid,pair,type,price,amount,timestamp.')
+    p.add_argument('--pairs',
+                   help='Comma-separated pairs, needed if the database does not exist yet.')
+    p.add_argument('--batch-size', type=int, default=50000,
+                   help='Rows to insert in each transaction.')
+    p.add_argument('--keep-indexes', default=False, action='store_true',
+                   help='Update indexes as rows are inserted instead of rebuilding them at the end.')
+    p.set_defaults(func=bulkImport)
+
+    args = parser.parse_args()
+    args.func(args)